@@ -1,11 +1,35 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context, g, has_request_context, abort, send_from_directory, session
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, date
+import click
+from datetime import datetime, date, timedelta, timezone
 import os
+import time
+import hashlib
+import functools
+import gzip
+import cProfile
+import threading
+import csv
+import io
+from types import SimpleNamespace
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
 from urllib.parse import quote_plus
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.http import is_resource_modified
 import requests
 import json
 import logging
+from concurrencia import perfil_concurrencia
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from metricas import registro_metricas, BUCKETS_ESPERA
+from perfilado import (RegistroSqlLento, forma_parametros, guardar_perfil, listar_perfiles,
+                       DIRECTORIO_PERFILES)
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -28,13 +52,65 @@ else:
     logger.info("✅ Usando SQLite local")
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Workers, hilos y pool de conexiones (el mismo perfil que usa gunicorn.conf.py)
+PERFIL_CONCURRENCIA = perfil_concurrencia()
+# Estadísticas en vivo: el dashboard usa SSE sólo si los workers admiten conexiones largas
+app.config['ESTADISTICAS_SSE'] = os.environ.get(
+    'ESTADISTICAS_SSE', '1' if PERFIL_CONCURRENCIA['clase'] == 'gevent' else '0') == '1'
+app.config['ESTADISTICAS_INTERVALO'] = float(os.environ.get('ESTADISTICAS_INTERVALO', 5))
+app.config['ESTADISTICAS_SSE_DURACION'] = int(os.environ.get('ESTADISTICAS_SSE_DURACION', 55))
+# Envío de WhatsApp en segundo plano (bandeja de salida)
+app.config['CALLMEBOT_URL'] = os.environ.get('CALLMEBOT_URL', 'https://api.callmebot.com/whatsapp.php')
+app.config['NOTIFICACIONES_HILO'] = os.environ.get('NOTIFICACIONES_HILO', '1') == '1'
+app.config['NOTIFICACIONES_INTERVALO'] = float(os.environ.get('NOTIFICACIONES_INTERVALO', 2))
+app.config['NOTIFICACIONES_MAX_INTENTOS'] = int(os.environ.get('NOTIFICACIONES_MAX_INTENTOS', 6))
+app.config['NOTIFICACIONES_TIMEOUT'] = float(os.environ.get('NOTIFICACIONES_TIMEOUT', 10))
+# Cache de reportes: 'memoria' (LRU por worker), 'tabla' (compartida) o 'no'
+app.config['REPORTES_CACHE'] = os.environ.get('REPORTES_CACHE', 'memoria')
+app.config['REPORTES_CACHE_TTL'] = float(os.environ.get('REPORTES_CACHE_TTL', 3600))
+app.config['REPORTES_CACHE_CAPACIDAD'] = int(os.environ.get('REPORTES_CACHE_CAPACIDAD', 256))
+# Cada cuántos segundos un worker comprueba si otro invalidó los datos de referencia
+app.config['CACHE_INTERVALO'] = float(os.environ.get('CACHE_INTERVALO', 2))
+# Perfilado bajo demanda (perfiles guardados, validez del token) y registro de SQL lento
+app.config['PERFILES_MAX'] = int(os.environ.get('PERFILES_MAX', 20))
+app.config['PERFILES_VALIDEZ'] = int(os.environ.get('PERFILES_VALIDEZ', 3600))
+app.config['SQL_LENTO_UMBRAL'] = float(os.environ.get('SQL_LENTO_UMBRAL', 0.5))
+app.config['SQL_LENTO_MAX_BYTES'] = int(os.environ.get('SQL_LENTO_MAX_BYTES', 5 * 1024 * 1024))
+# Compresión de respuestas: tamaño mínimo en bytes y nivel de gzip (1-9)
+app.config['COMPRESION_MINIMO'] = int(os.environ.get('COMPRESION_MINIMO', 1024))
+app.config['COMPRESION_NIVEL'] = int(os.environ.get('COMPRESION_NIVEL', 6))
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,
     'pool_recycle': 300,
+    'pool_size': PERFIL_CONCURRENCIA['pool_size'],
+    'max_overflow': PERFIL_CONCURRENCIA['max_overflow'],
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
 }
 
 db = SQLAlchemy(app)
 
+# Espera por una conexión del pool, sólo con eventos públicos de la sesión:
+# desde la primera sentencia de la transacción hasta que la sesión tiene su
+# conexión (checkout, pre_ping y, si hace falta, abrir una nueva)
+@event.listens_for(db.session, 'do_orm_execute')
+def _pedir_conexion(estado):
+    if not estado.session.info.get('con_conexion'):
+        estado.session.info['inicio_checkout'] = time.perf_counter()
+
+@event.listens_for(db.session, 'after_begin')
+def _conexion_obtenida(sesion, transaccion, conexion):
+    sesion.info['con_conexion'] = True
+    inicio = sesion.info.pop('inicio_checkout', None)
+    if inicio is not None:
+        registro_metricas.observar('byb_db_pool_checkout_seconds', {},
+                                   time.perf_counter() - inicio, BUCKETS_ESPERA)
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _conexion_devuelta(sesion, transaccion):
+    if transaccion.parent is None:
+        sesion.info.pop('con_conexion', None)
+        sesion.info.pop('inicio_checkout', None)
+
 # Modelos de la base de datos
 class Producto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,6 +131,10 @@ class Trabajador(db.Model):
     telefono = db.Column(db.String(20))
     total_ganado = db.Column(db.Integer, default=0)
 
+    __table_args__ = (
+        db.Index('ix_trabajador_tipo_activo', 'tipo', 'activo'),
+    )
+
 class Pedido(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     numero_orden = db.Column(db.Integer, unique=True, nullable=False)
@@ -73,11 +153,19 @@ class Pedido(db.Model):
     mensajeria = db.Column(db.Integer, default=0)
     total = db.Column(db.Integer, nullable=False)
     observaciones = db.Column(db.Text)
+    # Último cambio del pedido o de sus comisiones (marca para backups incrementales)
+    actualizado_en = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
     vendedor = db.relationship('Trabajador', foreign_keys=[vendedor_id])
     mensajero = db.relationship('Trabajador', foreign_keys=[mensajero_id])
     elaborador = db.relationship('Trabajador', foreign_keys=[elaborador_id])
 
+    __table_args__ = (
+        db.Index('ix_pedido_fecha_estado', 'fecha_pedido', 'estado'),
+        db.Index('ix_pedido_estado_numero', 'estado', 'numero_orden'),
+        db.Index('ix_pedido_actualizado', 'actualizado_en'),
+    )
+
 class ItemPedido(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     pedido_id = db.Column(db.Integer, db.ForeignKey('pedido.id'), nullable=False)
@@ -90,6 +178,10 @@ class ItemPedido(db.Model):
     pedido = db.relationship('Pedido', backref='items')
     producto = db.relationship('Producto')
 
+    __table_args__ = (
+        db.Index('ix_item_pedido_pedido', 'pedido_id'),
+    )
+
 class ComisionPedido(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     pedido_id = db.Column(db.Integer, db.ForeignKey('pedido.id'), nullable=False)
@@ -97,9 +189,13 @@ class ComisionPedido(db.Model):
     tipo_comision = db.Column(db.String(30), nullable=False)
     monto = db.Column(db.Integer, nullable=False)
     
-    pedido = db.relationship('Pedido')
+    pedido = db.relationship('Pedido', backref='comisiones')
     trabajador = db.relationship('Trabajador')
 
+    __table_args__ = (
+        db.Index('ix_comision_pedido_pedido', 'pedido_id'),
+    )
+
 class ConfiguracionComisiones(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     comision_vendedor = db.Column(db.Integer, default=500)
@@ -107,14 +203,396 @@ class ConfiguracionComisiones(db.Model):
     ganancia_inversores = db.Column(db.Integer, default=500)
     precio_bolsa_regalo = db.Column(db.Integer, default=200)
 
+class ResumenDiario(db.Model):
+    """Acumulados del dashboard por día, mantenidos al crear y completar pedidos"""
+    fecha = db.Column(db.Date, primary_key=True)
+    # Pedidos de ese día (fecha_pedido) por estado
+    pedidos_completados = db.Column(db.Integer, nullable=False, default=0)
+    total_facturado = db.Column(db.Integer, nullable=False, default=0)
+    # Contadores globales, vigentes al cierre de ese día
+    pedidos_pendientes = db.Column(db.Integer, nullable=False, default=0)
+    trabajadores_activos = db.Column(db.Integer, nullable=False, default=0)
+
+class MigracionAplicada(db.Model):
+    """Registro de las migraciones de esquema ya aplicadas"""
+    version = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    aplicada_en = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+class VersionDatos(db.Model):
+    """Sello de versión compartido por los workers para invalidar sus caches"""
+    nombre = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    actualizado_en = db.Column(db.DateTime)
+
+class GananciaDiaria(db.Model):
+    """Ganancias acumuladas por trabajador y día de pedido, mantenidas al escribir comisiones"""
+    trabajador_id = db.Column(db.Integer, db.ForeignKey('trabajador.id'), primary_key=True)
+    fecha = db.Column(db.Date, primary_key=True)
+    monto = db.Column(db.Integer, nullable=False, default=0)
+    comisiones = db.Column(db.Integer, nullable=False, default=0)
+
+class NotificacionPendiente(db.Model):
+    """Bandeja de salida de WhatsApp: se escribe en la misma transacción que el cambio"""
+    id = db.Column(db.Integer, primary_key=True)
+    numero = db.Column(db.String(20), nullable=False)
+    mensaje = db.Column(db.Text, nullable=False)
+    # PENDIENTE -> ENVIANDO -> ENVIADO, o FALLIDO al agotar los intentos
+    estado = db.Column(db.String(20), nullable=False, default='PENDIENTE')
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    proximo_intento = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    reclamada_en = db.Column(db.DateTime)
+    ultimo_error = db.Column(db.Text)
+    creada_en = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    enviada_en = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_notificacion_estado_proximo', 'estado', 'proximo_intento'),
+    )
+
+class VersionReporte(db.Model):
+    """Versión de los datos de cada día; sube al completar pedidos o recalcular comisiones"""
+    fecha = db.Column(db.Date, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ReporteCacheado(db.Model):
+    """Reportes ya generados, compartidos por todos los workers (REPORTES_CACHE=tabla)"""
+    clave = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.String(50), nullable=False)
+    contenido = db.Column(db.Text, nullable=False)
+    generado_en = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+class Contador(db.Model):
+    """Contadores atómicos (p. ej. el último numero_orden asignado)"""
+    nombre = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+
+def _insert_dialecto():
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def _insertar_si_no_existe(modelo, valores):
+    """INSERT que ignora el conflicto de clave primaria (PostgreSQL y SQLite)"""
+    insert = _insert_dialecto()
+    db.session.execute(insert(modelo).values(**valores).on_conflict_do_nothing())
+
+def incrementar_version(nombre):
+    """Sube el sello `nombre` de VersionDatos dentro de la transacción actual"""
+    _insertar_si_no_existe(VersionDatos, {'nombre': nombre, 'version': 0})
+    db.session.execute(
+        db.update(VersionDatos)
+        .where(VersionDatos.nombre == nombre)
+        .values(version=VersionDatos.version + 1, actualizado_en=datetime.now())
+    )
+
+# Numeración de pedidos
+def _sembrar_contador_pedidos(ejecutor):
+    """Crea el contador de numero_orden partiendo del máximo existente"""
+    maximo = ejecutor.execute(
+        db.select(db.func.coalesce(db.func.max(Pedido.numero_orden), 0))
+    ).scalar()
+    ejecutor.execute(_insert_dialecto()(Contador).values(
+        nombre='numero_orden', valor=maximo).on_conflict_do_nothing())
+
+def reservar_numeros_orden(cantidad=1):
+    """Reserva `cantidad` números de orden consecutivos y devuelve el primero
+
+    Es un único UPDATE ... RETURNING sobre la fila del contador dentro de la
+    transacción actual: dos peticiones simultáneas nunca reciben el mismo número,
+    y si la transacción se deshace el número vuelve a quedar libre (sin huecos).
+    Sólo se serializan entre sí las altas de pedidos, no el resto de escrituras.
+    Conviene llamarla antes de cualquier otra escritura de la transacción.
+    """
+    actualizar = (
+        db.update(Contador)
+        .where(Contador.nombre == 'numero_orden')
+        .values(valor=Contador.valor + cantidad)
+        .execution_options(synchronize_session=False)
+    )
+    for _ in range(2):
+        if db.engine.dialect.update_returning:
+            ultimo = db.session.execute(actualizar.returning(Contador.valor)).scalar()
+        else:
+            # La fila ya quedó bloqueada por nuestro UPDATE: leerla es seguro
+            resultado = db.session.execute(actualizar)
+            ultimo = db.session.execute(
+                db.select(Contador.valor).where(Contador.nombre == 'numero_orden')
+            ).scalar() if resultado.rowcount else None
+        if ultimo is not None:
+            return ultimo - cantidad + 1
+        _sembrar_contador_pedidos(db.session)
+    raise RuntimeError("No se pudo inicializar el contador de numero_orden")
+
+def sincronizar_contador_pedidos():
+    """Alinea el contador con el máximo numero_orden (tras restaurar un backup)"""
+    maximo = db.session.query(db.func.coalesce(db.func.max(Pedido.numero_orden), 0)).scalar()
+    _insertar_si_no_existe(Contador, {'nombre': 'numero_orden', 'valor': maximo})
+    db.session.execute(
+        db.update(Contador).where(Contador.nombre == 'numero_orden').values(valor=maximo)
+    )
+
+# Cache de datos de referencia
+class CacheReferencia:
+    """Cache en memoria de trabajadores, productos y configuración
+
+    Las entradas se guardan junto a la versión de `VersionDatos` con la que se
+    cargaron. Cada worker relee esa versión como mucho una vez por `intervalo`
+    segundos, así que una invalidación hecha en otro worker se nota sin reiniciar.
+    """
+
+    NOMBRE = 'referencia'
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self._version = None
+        self._verificado = 0.0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _version_vigente(self):
+        ahora = time.monotonic()
+        if self._version is not None and ahora - self._verificado < self.intervalo:
+            return self._version
+        version = db.session.execute(
+            db.select(VersionDatos.version).where(VersionDatos.nombre == self.NOMBRE)
+        ).scalar()
+        if version is None:
+            version = 0
+        with self._lock:
+            if version != self._version:
+                self._entradas.clear()
+            self._version, self._verificado = version, ahora
+        return version
+
+    def obtener(self, clave, cargar):
+        """Devuelve el valor cacheado de `clave`, llamando a `cargar()` si falta"""
+        version = self._version_vigente()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == version:
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+        valor = cargar()
+        with self._lock:
+            if self._version == version:
+                self._entradas[clave] = (version, valor)
+        return valor
+
+    def invalidar(self):
+        """Incrementa la versión en la transacción actual; al confirmarla se fuerza la relectura local"""
+        incrementar_version(self.NOMBRE)
+        # Antes del commit otra petición aún leería la versión vieja y la daría por buena
+        db.session.info['referencia_invalidada'] = True
+
+    def forzar_relectura(self):
+        with self._lock:
+            self._verificado = 0.0
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'version': self._version,
+                'entradas': len(self._entradas),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+            }
+
+cache_referencia = CacheReferencia(app.config['CACHE_INTERVALO'])
+
+@event.listens_for(db.session, 'after_commit')
+def _releer_referencia(sesion):
+    if sesion.info.pop('referencia_invalidada', False):
+        cache_referencia.forzar_relectura()
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _olvidar_invalidacion_referencia(sesion, transaccion):
+    if transaccion.parent is None:
+        sesion.info.pop('referencia_invalidada', None)
+
+def _instantanea(obj):
+    """Copia las columnas de un objeto ORM para poder cachearlo fuera de la sesión"""
+    return SimpleNamespace(**{c.key: getattr(obj, c.key) for c in obj.__table__.columns})
+
+def trabajadores_activos():
+    return cache_referencia.obtener('trabajadores', lambda: [
+        _instantanea(t) for t in Trabajador.query.filter_by(activo=True).order_by(Trabajador.id)
+    ])
+
+def productos_activos():
+    return cache_referencia.obtener('productos', lambda: [
+        _instantanea(p) for p in Producto.query.filter_by(activo=True).order_by(Producto.id)
+    ])
+
+def inversores_activos():
+    """Ids de los inversores activos, entre quienes se reparte la ganancia"""
+    return cache_referencia.obtener('inversores', lambda: [
+        t.id for t in trabajadores_activos() if t.tipo == 'inversor'
+    ])
+
+def obtener_configuracion():
+    """Configuración de comisiones (la crea con los valores por defecto si falta)"""
+    def cargar():
+        config = ConfiguracionComisiones.query.first()
+        if not config:
+            config = ConfiguracionComisiones()
+            db.session.add(config)
+            db.session.flush()
+        return _instantanea(config)
+    return cache_referencia.obtener('configuracion', cargar)
+
+# Libro de ganancias por trabajador
+def _ganancias_de_pedidos(pedido_ids=None):
+    """{(trabajador_id, fecha): (monto, comisiones)} según las comisiones de esos pedidos (o de todos)"""
+    consulta = (
+        db.select(ComisionPedido.trabajador_id, Pedido.fecha_pedido,
+                  db.func.sum(ComisionPedido.monto), db.func.count(ComisionPedido.id))
+        .join(Pedido, Pedido.id == ComisionPedido.pedido_id)
+        .where(ComisionPedido.trabajador_id.isnot(None))
+        .group_by(ComisionPedido.trabajador_id, Pedido.fecha_pedido)
+    )
+    if pedido_ids is not None:
+        consulta = consulta.where(ComisionPedido.pedido_id.in_(pedido_ids))
+    return {
+        (trabajador_id, fecha): (monto, cantidad)
+        for trabajador_id, fecha, monto, cantidad in db.session.execute(consulta)
+    }
+
+def _aplicar_ganancias(antes, despues):
+    """Suma al libro y a Trabajador.total_ganado la diferencia entre dos agregados
+
+    Sólo escribe las claves que cambiaron: recalcular con la misma
+    configuración no toca el libro.
+    """
+    deltas = {}
+    for clave in set(antes) | set(despues):
+        monto_antes, cantidad_antes = antes.get(clave, (0, 0))
+        monto_despues, cantidad_despues = despues.get(clave, (0, 0))
+        if (monto_antes, cantidad_antes) != (monto_despues, cantidad_despues):
+            deltas[clave] = (monto_despues - monto_antes, cantidad_despues - cantidad_antes)
+    if not deltas:
+        return
+
+    conexion = db.session.connection()
+    insert = _insert_dialecto()(GananciaDiaria.__table__)
+    conexion.execute(
+        insert.on_conflict_do_update(
+            index_elements=['trabajador_id', 'fecha'],
+            set_={'monto': GananciaDiaria.__table__.c.monto + insert.excluded.monto,
+                  'comisiones': GananciaDiaria.__table__.c.comisiones + insert.excluded.comisiones}
+        ),
+        [{'trabajador_id': t, 'fecha': f, 'monto': m, 'comisiones': c}
+         for (t, f), (m, c) in deltas.items()]
+    )
+
+    por_trabajador = {}
+    for (trabajador_id, _), (monto, _) in deltas.items():
+        por_trabajador[trabajador_id] = por_trabajador.get(trabajador_id, 0) + monto
+    cambios = [{'_id': t, '_delta': d} for t, d in por_trabajador.items() if d]
+    if cambios:
+        tabla = Trabajador.__table__
+        conexion.execute(
+            tabla.update().where(tabla.c.id == db.bindparam('_id'))
+            .values(total_ganado=db.func.coalesce(tabla.c.total_ganado, 0) + db.bindparam('_delta')),
+            cambios
+        )
+
+def _reconstruir_ganancias(conexion):
+    """Rehace el libro y total_ganado desde las comisiones con sentencias de conjunto"""
+    ganancias = GananciaDiaria.__table__
+    comisiones = ComisionPedido.__table__
+    pedidos = Pedido.__table__
+    trabajadores = Trabajador.__table__
+    conexion.execute(ganancias.delete())
+    conexion.execute(ganancias.insert().from_select(
+        ['trabajador_id', 'fecha', 'monto', 'comisiones'],
+        db.select(comisiones.c.trabajador_id, pedidos.c.fecha_pedido,
+                  db.func.sum(comisiones.c.monto), db.func.count(comisiones.c.id))
+        .select_from(comisiones.join(pedidos, pedidos.c.id == comisiones.c.pedido_id))
+        .where(comisiones.c.trabajador_id.isnot(None))
+        .group_by(comisiones.c.trabajador_id, pedidos.c.fecha_pedido)
+    ))
+    conexion.execute(trabajadores.update().values(total_ganado=db.func.coalesce(
+        db.select(db.func.sum(ganancias.c.monto))
+        .where(ganancias.c.trabajador_id == trabajadores.c.id)
+        .scalar_subquery(), 0)))
+
+def reconciliar_ganancias(corregir=False):
+    """Compara el libro y total_ganado con las comisiones; con `corregir` los reconstruye
+
+    Devuelve la lista de diferencias como (tipo, clave, guardado, real).
+    """
+    reales = _ganancias_de_pedidos()
+    guardadas = {(g.trabajador_id, g.fecha): (g.monto, g.comisiones) for g in GananciaDiaria.query}
+    diferencias = [
+        ('dia', clave, guardadas.get(clave, (0, 0)), reales.get(clave, (0, 0)))
+        for clave in sorted(set(reales) | set(guardadas), key=lambda c: (c[0], c[1]))
+        if guardadas.get(clave, (0, 0)) != reales.get(clave, (0, 0))
+    ]
+
+    totales_reales = {}
+    for (trabajador_id, _), (monto, _) in reales.items():
+        totales_reales[trabajador_id] = totales_reales.get(trabajador_id, 0) + monto
+    for trabajador_id, total in db.session.execute(db.select(Trabajador.id, Trabajador.total_ganado)):
+        if (total or 0) != totales_reales.get(trabajador_id, 0):
+            diferencias.append(('total_ganado', trabajador_id, total or 0, totales_reales.get(trabajador_id, 0)))
+
+    if corregir and diferencias:
+        _reconstruir_ganancias(db.session.connection())
+        db.session.commit()
+    return diferencias
+
+@app.cli.command('reconciliar-ganancias')
+@click.option('--corregir', is_flag=True, help='Reconstruye el libro si hay diferencias')
+def reconciliar_ganancias_command(corregir):
+    """Verifica el libro de ganancias contra las comisiones registradas"""
+    diferencias = reconciliar_ganancias(corregir)
+    for tipo, clave, guardado, real in diferencias:
+        print(f"⚠️  {tipo} {clave}: {guardado} -> {real}")
+    if not diferencias:
+        print("✅ Libro de ganancias consistente")
+    elif corregir:
+        print(f"✅ Libro de ganancias reconstruido ({len(diferencias)} diferencias)")
+    else:
+        print(f"❌ {len(diferencias)} diferencias (use --corregir para reconstruir)")
+        raise SystemExit(1)
+
+def estado_cuenta(trabajador_id, desde, hasta):
+    """Ganancias de un trabajador por día en [desde, hasta], leídas del libro"""
+    return [
+        {'fecha': g.fecha.isoformat(), 'monto': g.monto, 'comisiones': g.comisiones}
+        for g in GananciaDiaria.query.filter(
+            GananciaDiaria.trabajador_id == trabajador_id,
+            GananciaDiaria.fecha >= desde, GananciaDiaria.fecha <= hasta
+        ).order_by(GananciaDiaria.fecha)
+    ]
+
+def ganancias_por_trabajador(desde, hasta):
+    """Total ganado por cada trabajador en [desde, hasta], leído del libro"""
+    return dict(
+        (trabajador_id, (monto, cantidad))
+        for trabajador_id, monto, cantidad in db.session.execute(
+            db.select(GananciaDiaria.trabajador_id, db.func.sum(GananciaDiaria.monto),
+                      db.func.sum(GananciaDiaria.comisiones))
+            .where(GananciaDiaria.fecha >= desde, GananciaDiaria.fecha <= hasta)
+            .group_by(GananciaDiaria.trabajador_id)
+        )
+    )
+
 # Funciones auxiliares
 def calcular_comisiones_pedido(pedido):
-    """Calcula las comisiones de un pedido completado"""
-    config = ConfiguracionComisiones.query.first()
-    if not config:
-        config = ConfiguracionComisiones()
-        db.session.add(config)
-        db.session.commit()
+    """Calcula las comisiones de un pedido completado, una a una
+
+    Es la referencia de _comisiones_trozo: tests/test_comisiones.py comprueba
+    que ambos caminos dejan las mismas filas.
+    """
+    config = obtener_configuracion()
+    ganancias_previas = _ganancias_de_pedidos([pedido.id])
     
     # Limpiar comisiones existentes
     ComisionPedido.query.filter_by(pedido_id=pedido.id).delete()
@@ -171,13 +649,13 @@ def calcular_comisiones_pedido(pedido):
     comisiones.append(comision)
     
     # Ganancias de inversores (dividido equitativamente)
-    inversores = Trabajador.query.filter_by(tipo='inversor', activo=True).all()
+    inversores = inversores_activos()
     if inversores:
         ganancia_por_inversor = config.ganancia_inversores // len(inversores)
-        for inversor in inversores:
+        for inversor_id in inversores:
             comision = ComisionPedido(
                 pedido_id=pedido.id,
-                trabajador_id=inversor.id,
+                trabajador_id=inversor_id,
                 tipo_comision='GANANCIA_INVERSOR',
                 monto=ganancia_por_inversor
             )
@@ -195,33 +673,502 @@ def calcular_comisiones_pedido(pedido):
     # Guardar todas las comisiones
     for comision in comisiones:
         db.session.add(comision)
+    db.session.flush()
+    _aplicar_ganancias(ganancias_previas, _ganancias_de_pedidos([pedido.id]))
+    cache_reportes.invalidar_dias([pedido.fecha_pedido])
+    pedido.actualizado_en = datetime.now()
     
     db.session.commit()
     return comisiones
 
+# Cálculo de comisiones por lotes
+COMISIONES_LOTE = 500
+
+def _comisiones_trozo(pedido_ids, config, inversores):
+    """Reemplaza las comisiones de unos pedidos con dos lecturas agregadas y un INSERT masivo
+
+    Produce exactamente las mismas filas, en el mismo orden, que
+    calcular_comisiones_pedido. No confirma la transacción.
+    """
+    pedidos = db.session.execute(
+        db.select(Pedido.id, Pedido.vendedor_id, Pedido.mensajero_id,
+                  Pedido.elaborador_id, Pedido.mensajeria, Pedido.fecha_pedido)
+        .where(Pedido.id.in_(pedido_ids)).order_by(Pedido.id)
+    ).all()
+    # Inversión (costo de producción) y unidades por pedido
+    agregados = {
+        pedido_id: (inversion, unidades)
+        for pedido_id, inversion, unidades in db.session.execute(
+            db.select(ItemPedido.pedido_id,
+                      db.func.sum(Producto.costo_produccion * ItemPedido.cantidad),
+                      db.func.sum(ItemPedido.cantidad))
+            .join(Producto, Producto.id == ItemPedido.producto_id)
+            .where(ItemPedido.pedido_id.in_(pedido_ids))
+            .group_by(ItemPedido.pedido_id)
+        )
+    }
+    ganancia_por_inversor = config.ganancia_inversores // len(inversores) if inversores else 0
+    ganancias_previas = _ganancias_de_pedidos(pedido_ids)
+
+    filas = []
+    for pedido in pedidos:
+        inversion, unidades = agregados.get(pedido.id, (0, 0))
+        if pedido.vendedor_id:
+            filas.append((pedido.id, pedido.vendedor_id, 'VENDEDOR', config.comision_vendedor))
+        if pedido.mensajero_id and pedido.mensajeria > 0:
+            filas.append((pedido.id, pedido.mensajero_id, 'MENSAJERO', pedido.mensajeria))
+        if pedido.elaborador_id:
+            filas.append((pedido.id, pedido.elaborador_id, 'ELABORADOR', 100 * unidades))
+        filas.append((pedido.id, None, 'GANANCIA_NEGOCIO', config.ganancia_negocio))
+        for inversor_id in inversores:
+            filas.append((pedido.id, inversor_id, 'GANANCIA_INVERSOR', ganancia_por_inversor))
+        filas.append((pedido.id, None, 'INVERSION', inversion))
+
+    db.session.execute(
+        db.delete(ComisionPedido).where(ComisionPedido.pedido_id.in_(pedido_ids))
+        .execution_options(synchronize_session=False)
+    )
+    if filas:
+        # render_nulls: sin él, cada cambio entre trabajador_id NULL y no NULL
+        # parte el executemany en otro INSERT (uno por comisión, en la práctica)
+        db.session.execute(db.insert(ComisionPedido).execution_options(render_nulls=True), [
+            {'pedido_id': p, 'trabajador_id': t, 'tipo_comision': tipo, 'monto': monto}
+            for p, t, tipo, monto in filas
+        ])
+    _aplicar_ganancias(ganancias_previas, _ganancias_de_pedidos(pedido_ids))
+    cache_reportes.invalidar_dias({pedido.fecha_pedido for pedido in pedidos})
+    # Las comisiones cambiadas viajan con su pedido en el próximo backup incremental
+    db.session.execute(
+        db.update(Pedido).where(Pedido.id.in_(pedido_ids)).values(actualizado_en=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    return len(filas)
+
+def recalcular_comisiones(desde=None, hasta=None, lote=COMISIONES_LOTE):
+    """Recalcula las comisiones de los pedidos completados en un rango de fecha_pedido
+
+    Recorre los pedidos por id en trozos de `lote`, con una transacción por
+    trozo. Devuelve (pedidos, comisiones) procesados.
+    """
+    config = obtener_configuracion()
+    inversores = inversores_activos()
+    pedidos = comisiones = 0
+    ultimo_id = 0
+    while True:
+        consulta = db.select(Pedido.id).where(Pedido.estado == 'COMPLETADO', Pedido.id > ultimo_id)
+        if desde:
+            consulta = consulta.where(Pedido.fecha_pedido >= desde)
+        if hasta:
+            consulta = consulta.where(Pedido.fecha_pedido <= hasta)
+        ids = db.session.execute(consulta.order_by(Pedido.id).limit(lote)).scalars().all()
+        if not ids:
+            break
+        comisiones += _comisiones_trozo(ids, config, inversores)
+        db.session.commit()
+        pedidos += len(ids)
+        ultimo_id = ids[-1]
+    return pedidos, comisiones
+
+def completar_pedidos(pedido_ids, lote=COMISIONES_LOTE, notificar_a=None):
+    """Completa varios pedidos y calcula sus comisiones, una transacción por trozo
+
+    Con `notificar_a`, cada trozo encola un único WhatsApp con el reporte de
+    sus pedidos. Devuelve los ids de los pedidos que pasaron a COMPLETADO
+    (los que ya lo estaban se ignoran).
+    """
+    config = obtener_configuracion()
+    inversores = inversores_activos()
+    completados = []
+    ids = sorted(set(pedido_ids))
+    for inicio in range(0, len(ids), lote):
+        trozo = ids[inicio:inicio + lote]
+        filas = db.session.execute(
+            db.select(Pedido.id, Pedido.estado, Pedido.fecha_pedido, Pedido.total)
+            .where(Pedido.id.in_(trozo), Pedido.estado != 'COMPLETADO')
+        ).all()
+        if not filas:
+            continue
+
+        # Resumen del dashboard: un UPDATE por día afectado
+        por_dia = {}
+        for fila in filas:
+            cantidad, total = por_dia.get(fila.fecha_pedido, (0, 0))
+            por_dia[fila.fecha_pedido] = (cantidad + 1, total + fila.total)
+        pendientes = sum(1 for fila in filas if fila.estado == 'PENDIENTE')
+        if pendientes:
+            acumular_resumen(date.today(), pedidos_pendientes=-pendientes)
+        for fecha, (cantidad, total) in por_dia.items():
+            acumular_resumen(fecha, pedidos_completados=cantidad, total_facturado=total)
+
+        trozo = [fila.id for fila in filas]
+        db.session.execute(
+            db.update(Pedido).where(Pedido.id.in_(trozo)).values(estado='COMPLETADO')
+            .execution_options(synchronize_session=False)
+        )
+        _comisiones_trozo(trozo, config, inversores)
+        if notificar_a:
+            pedidos = Pedido.query.filter(Pedido.id.in_(trozo)).order_by(Pedido.numero_orden).all()
+            encolar_whatsapp(notificar_a, "\n".join(generar_reporte_pedido(p) for p in pedidos))
+        db.session.commit()
+        completados.extend(trozo)
+    return completados
+
+@app.cli.command('recalcular-comisiones')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), help='Fecha de pedido inicial (AAAA-MM-DD)')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), help='Fecha de pedido final (AAAA-MM-DD)')
+@click.option('--lote', default=COMISIONES_LOTE, show_default=True, help='Pedidos por transacción')
+def recalcular_comisiones_command(desde, hasta, lote):
+    """Recalcula las comisiones de los pedidos completados con la configuración actual"""
+    inicio = time.perf_counter()
+    pedidos, comisiones = recalcular_comisiones(desde.date() if desde else None,
+                                                hasta.date() if hasta else None, lote)
+    print(f"✅ {pedidos} pedidos recalculados ({comisiones} comisiones) "
+          f"en {time.perf_counter() - inicio:.1f} s")
+
+# Notificaciones por WhatsApp
+class ErrorEnvio(Exception):
+    """Fallo al enviar un WhatsApp; `reintentable` indica si tiene sentido volver a intentarlo"""
+
+    def __init__(self, mensaje, reintentable=True):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+
+_sesiones_http = {}
+
+def _sesion_http():
+    """Sesión HTTP con conexiones reutilizables, una por proceso (tras el fork de gunicorn)"""
+    sesion = _sesiones_http.get(os.getpid())
+    if sesion is None:
+        sesion = requests.Session()
+        adaptador = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+        sesion.mount('http://', adaptador)
+        sesion.mount('https://', adaptador)
+        _sesiones_http.clear()
+        _sesiones_http[os.getpid()] = sesion
+    return sesion
+
 def enviar_whatsapp(numero, mensaje):
-    """Envía mensaje por WhatsApp usando CallMeBot API"""
+    """Envía mensaje por WhatsApp usando CallMeBot API; lanza ErrorEnvio si falla"""
     api_key = os.environ.get('CALLMEBOT_API_KEY')
     if not api_key:
-        print("API Key de CallMeBot no configurada")
-        return False
+        raise ErrorEnvio("API Key de CallMeBot no configurada", reintentable=False)
     
+    params = {
+        'phone': numero,
+        'text': mensaje,
+        'apikey': api_key
+    }
+    timeout = app.config['NOTIFICACIONES_TIMEOUT']
+    inicio = time.perf_counter()
     try:
-        url = f"https://api.callmebot.com/whatsapp.php"
-        params = {
-            'phone': numero,
-            'text': mensaje,
-            'apikey': api_key
+        response = _sesion_http().get(app.config['CALLMEBOT_URL'], params=params,
+                                      timeout=(min(3, timeout), timeout))
+    except requests.RequestException as e:
+        registro_metricas.observar('byb_whatsapp_envio_seconds', {'resultado': 'error_red'},
+                                   time.perf_counter() - inicio)
+        raise ErrorEnvio(f"Error enviando WhatsApp: {e}")
+    registro_metricas.observar('byb_whatsapp_envio_seconds', {'resultado': str(response.status_code)},
+                               time.perf_counter() - inicio)
+    if response.status_code != 200:
+        # 4xx (salvo 429) no se arregla reintentando
+        reintentable = response.status_code >= 500 or response.status_code == 429
+        raise ErrorEnvio(f"CallMeBot respondió HTTP {response.status_code}", reintentable)
+    return True
+
+def encolar_whatsapp(numero, mensaje):
+    """Deja el mensaje en la bandeja de salida dentro de la transacción actual"""
+    db.session.add(NotificacionPendiente(numero=numero, mensaje=mensaje))
+
+class EnviadorNotificaciones:
+    """Vacía la bandeja de salida: reintentos con espera exponencial, límite de ritmo y descarte
+
+    Varios procesos pueden vaciarla a la vez: cada mensaje se reclama con un
+    UPDATE condicional antes de enviarlo, así que nunca se manda dos veces.
+    """
+
+    ESPERA_BASE = 30          # segundos antes del primer reintento
+    ESPERA_MAXIMA = 3600
+    RECLAMO_CADUCADO = 300    # un ENVIANDO más viejo que esto se da por abandonado
+    SONDEO = 30               # sin avisos, revisar la bandeja cada tantos segundos
+
+    def __init__(self, intervalo, max_intentos):
+        self.intervalo = intervalo
+        self.max_intentos = max_intentos
+        self._ultimo_envio = 0.0
+        self._aviso = threading.Event()
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _esperar_turno(self):
+        """Respeta un mínimo de `intervalo` segundos entre envíos de este proceso"""
+        espera = self._ultimo_envio + self.intervalo - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        self._ultimo_envio = time.monotonic()
+
+    def _reclamar(self, notificacion_id):
+        ahora = datetime.now()
+        resultado = db.session.execute(
+            db.update(NotificacionPendiente)
+            .where(NotificacionPendiente.id == notificacion_id,
+                   NotificacionPendiente.estado == 'PENDIENTE')
+            .values(estado='ENVIANDO', reclamada_en=ahora)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return resultado.rowcount == 1
+
+    def procesar_pendientes(self, limite=50):
+        """Envía los mensajes vencidos; devuelve (enviados, reprogramados, descartados)"""
+        ahora = datetime.now()
+        db.session.execute(
+            db.update(NotificacionPendiente)
+            .where(NotificacionPendiente.estado == 'ENVIANDO',
+                   NotificacionPendiente.reclamada_en < ahora - timedelta(seconds=self.RECLAMO_CADUCADO))
+            .values(estado='PENDIENTE')
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        ids = db.session.execute(
+            db.select(NotificacionPendiente.id)
+            .where(NotificacionPendiente.estado == 'PENDIENTE',
+                   NotificacionPendiente.proximo_intento <= ahora)
+            .order_by(NotificacionPendiente.id).limit(limite)
+        ).scalars().all()
+
+        enviados = reprogramados = descartados = 0
+        for notificacion_id in ids:
+            if not self._reclamar(notificacion_id):
+                continue
+            notificacion = db.session.get(NotificacionPendiente, notificacion_id)
+            self._esperar_turno()
+            try:
+                enviar_whatsapp(notificacion.numero, notificacion.mensaje)
+                notificacion.estado = 'ENVIADO'
+                notificacion.enviada_en = datetime.now()
+                notificacion.ultimo_error = None
+                enviados += 1
+            except ErrorEnvio as e:
+                notificacion.intentos += 1
+                notificacion.ultimo_error = str(e)
+                if not e.reintentable or notificacion.intentos >= self.max_intentos:
+                    notificacion.estado = 'FALLIDO'
+                    descartados += 1
+                    logger.error(f"WhatsApp {notificacion.id} descartado tras {notificacion.intentos} intentos: {e}")
+                else:
+                    espera = min(self.ESPERA_BASE * 2 ** (notificacion.intentos - 1), self.ESPERA_MAXIMA)
+                    notificacion.estado = 'PENDIENTE'
+                    notificacion.proximo_intento = datetime.now() + timedelta(seconds=espera)
+                    reprogramados += 1
+                    logger.warning(f"WhatsApp {notificacion.id} reintentará en {espera}s: {e}")
+            db.session.commit()
+        return enviados, reprogramados, descartados
+
+    def _bucle(self):
+        while True:
+            self._aviso.wait(timeout=self.SONDEO)
+            self._aviso.clear()
+            try:
+                with app.app_context():
+                    while sum(self.procesar_pendientes()):
+                        pass
+            except Exception as e:
+                logger.error(f"Error en el envío de notificaciones: {e}")
+
+    def despertar(self):
+        """Avisa al hilo de envío de este proceso (lo arranca si hace falta)"""
+        if not app.config['NOTIFICACIONES_HILO']:
+            return
+        with self._lock:
+            if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+                self._aviso = threading.Event()
+                self._hilo = threading.Thread(target=self._bucle, name='enviador-whatsapp', daemon=True)
+                self._pid = os.getpid()
+                self._hilo.start()
+        self._aviso.set()
+
+enviador_notificaciones = EnviadorNotificaciones(app.config['NOTIFICACIONES_INTERVALO'],
+                                                 app.config['NOTIFICACIONES_MAX_INTENTOS'])
+
+@app.cli.command('enviar-notificaciones')
+@click.option('--una-vez', is_flag=True, help='Vaciar la bandeja y terminar')
+@click.option('--reintentar-fallidos', is_flag=True, help='Devolver los descartados a la bandeja')
+def enviar_notificaciones_command(una_vez, reintentar_fallidos):
+    """Envía los WhatsApp pendientes de la bandeja de salida"""
+    if reintentar_fallidos:
+        cantidad = NotificacionPendiente.query.filter_by(estado='FALLIDO').update(
+            {'estado': 'PENDIENTE', 'intentos': 0, 'proximo_intento': datetime.now()})
+        db.session.commit()
+        print(f"🔁 {cantidad} notificaciones devueltas a la bandeja")
+    while True:
+        enviados, reprogramados, descartados = enviador_notificaciones.procesar_pendientes()
+        if enviados or reprogramados or descartados:
+            print(f"📤 Enviados: {enviados}, reprogramados: {reprogramados}, descartados: {descartados}")
+        if una_vez and not (enviados or reprogramados or descartados):
+            break
+        if not (enviados or reprogramados or descartados):
+            time.sleep(enviador_notificaciones.intervalo)
+
+# Cache de reportes
+class AlmacenMemoria:
+    """LRU en memoria de cada worker, con caducidad"""
+
+    def __init__(self, capacidad, ttl):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+
+    def leer(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            version, contenido, caduca = entrada
+            if caduca < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return version, contenido
+
+    def escribir(self, clave, version, contenido):
+        with self._lock:
+            self._entradas[clave] = (version, contenido, time.monotonic() + self.ttl)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+class AlmacenTabla:
+    """Tabla `reporte_cacheado`: un reporte generado en un worker sirve a todos"""
+
+    def leer(self, clave):
+        fila = db.session.execute(
+            db.select(ReporteCacheado.version, ReporteCacheado.contenido)
+            .where(ReporteCacheado.clave == clave)
+        ).first()
+        return tuple(fila) if fila else None
+
+    def escribir(self, clave, version, contenido):
+        # Conexión propia: guardar en cache no debe depender de que la petición confirme
+        valores = {'clave': clave, 'version': version, 'contenido': contenido,
+                   'generado_en': datetime.now()}
+        sentencia = _insert_dialecto()(ReporteCacheado).values(valores)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=['clave'],
+            set_={'version': sentencia.excluded.version,
+                  'contenido': sentencia.excluded.contenido,
+                  'generado_en': sentencia.excluded.generado_en})
+        try:
+            with db.engine.begin() as conexion:
+                conexion.execute(sentencia)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el reporte {clave} en cache: {e}")
+
+    def limpiar(self):
+        db.session.execute(db.delete(ReporteCacheado))
+
+    def __len__(self):
+        return db.session.execute(db.select(db.func.count()).select_from(ReporteCacheado)).scalar()
+
+class CacheReportes:
+    """Reportes ya generados, válidos mientras no cambien los datos de su periodo
+
+    La versión de un periodo combina la de cada día (`VersionReporte`, que sube
+    al completar pedidos o recalcular comisiones) con una global para cambios
+    masivos como una restauración. Un día cerrado conserva su versión, así que
+    su reporte se sirve siempre de la cache.
+    """
+
+    NOMBRE = 'reportes'
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _version(self, desde, hasta):
+        global_ = db.select(VersionDatos.version).where(VersionDatos.nombre == self.NOMBRE) \
+            .scalar_subquery()
+        dias = db.select(db.func.coalesce(db.func.sum(VersionReporte.version), 0)) \
+            .where(VersionReporte.fecha >= desde, VersionReporte.fecha <= hasta).scalar_subquery()
+        version_global, version_dias = db.session.execute(db.select(global_, dias)).one()
+        return f"{version_global or 0}.{version_dias}"
+
+    def obtener(self, clave, desde, hasta, generar):
+        """Devuelve el reporte de `clave` sobre [desde, hasta], generándolo con `generar()` si hace falta"""
+        if self.almacen is None:
+            return generar()
+        version = self._version(desde, hasta)
+        entrada = self.almacen.leer(clave)
+        if entrada is not None and entrada[0] == version:
+            self.aciertos += 1
+            return entrada[1]
+        self.fallos += 1
+        contenido = generar()
+        # Una versión subida en esta transacción aún puede deshacerse: no se guarda
+        if not db.session.info.get('reportes_modificados'):
+            self.almacen.escribir(clave, version, contenido)
+        return contenido
+
+    def invalidar_dias(self, fechas):
+        """Sube la versión de esos días dentro de la transacción actual"""
+        fechas = sorted(set(fechas))
+        if not fechas:
+            return
+        for fecha in fechas:
+            _insertar_si_no_existe(VersionReporte, {'fecha': fecha, 'version': 0})
+        db.session.execute(
+            db.update(VersionReporte).where(VersionReporte.fecha.in_(fechas))
+            .values(version=VersionReporte.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.info['reportes_modificados'] = True
+
+    def invalidar(self):
+        """Invalida todos los reportes (p. ej. tras restaurar una copia)"""
+        incrementar_version(self.NOMBRE)
+        db.session.info['reportes_modificados'] = True
+
+    def estadisticas(self):
+        return {
+            'almacen': app.config['REPORTES_CACHE'],
+            'entradas': len(self.almacen) if self.almacen is not None else 0,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
         }
-        response = requests.get(url, params=params)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"Error enviando WhatsApp: {e}")
-        return False
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _limpiar_marca_reportes(sesion, transaccion):
+    if transaccion.parent is None:
+        sesion.info.pop('reportes_modificados', None)
+
+def _crear_almacen_reportes():
+    tipo = app.config['REPORTES_CACHE']
+    if tipo == 'memoria':
+        return AlmacenMemoria(app.config['REPORTES_CACHE_CAPACIDAD'], app.config['REPORTES_CACHE_TTL'])
+    if tipo == 'tabla':
+        return AlmacenTabla()
+    return None
+
+cache_reportes = CacheReportes(_crear_almacen_reportes())
 
 def generar_reporte_pedido(pedido):
     """Genera el reporte individual de un pedido"""
-    comisiones = ComisionPedido.query.filter_by(pedido_id=pedido.id).all()
+    return cache_reportes.obtener(f'pedido:{pedido.id}', pedido.fecha_pedido, pedido.fecha_pedido,
+                                  lambda: _generar_reporte_pedido(pedido))
+
+def _generar_reporte_pedido(pedido):
+    comisiones = ComisionPedido.query.options(db.joinedload(ComisionPedido.trabajador)) \
+        .filter_by(pedido_id=pedido.id).order_by(ComisionPedido.id).all()
     
     mensaje = f"""🔸 *[{pedido.numero_orden}] Reporte Financiero* 🏷️
 💰 Total facturado: {pedido.total} CUP
@@ -245,73 +1192,1231 @@ def generar_reporte_pedido(pedido):
     
     return mensaje
 
-def generar_reporte_diario():
-    """Genera el reporte diario consolidado"""
-    pedidos_hoy = Pedido.query.filter(
-        Pedido.fecha_pedido == date.today(),
-        Pedido.estado == 'COMPLETADO'
+def _ganancias_reporte(desde, hasta):
+    """[(nombre, monto)] por trabajador en los pedidos completados del rango, en una consulta"""
+    return db.session.execute(
+        db.select(Trabajador.nombre, db.func.sum(ComisionPedido.monto))
+        .join(ComisionPedido, ComisionPedido.trabajador_id == Trabajador.id)
+        .join(Pedido, Pedido.id == ComisionPedido.pedido_id)
+        .where(Pedido.fecha_pedido >= desde, Pedido.fecha_pedido <= hasta,
+               Pedido.estado == 'COMPLETADO')
+        .group_by(Trabajador.id, Trabajador.nombre)
+        .order_by(Trabajador.id)
+    ).all()
+
+def _lineas_ganancias(lineas, desde, hasta):
+    ganancias = _ganancias_reporte(desde, hasta)
+    if ganancias:
+        lineas.append("\n👥 GANANCIAS POR TRABAJADOR:")
+        lineas.extend(f"• {nombre}: {monto} CUP" for nombre, monto in ganancias)
+
+def generar_reporte_diario(fecha=None):
+    """Genera el reporte diario consolidado (dos consultas, sin importar cuántos pedidos haya)"""
+    fecha = fecha or date.today()
+    # El reporte vacío de hoy dice "hoy": no debe servirse pasada la medianoche
+    clave = f'diario:{fecha.isoformat()}' + (':hoy' if fecha == date.today() else '')
+    return cache_reportes.obtener(clave, fecha, fecha, lambda: _generar_reporte_diario(fecha))
+
+def _generar_reporte_diario(fecha):
+    pedidos_dia = db.session.execute(
+        db.select(Pedido.numero_orden, Pedido.cliente_nombre, Pedido.total)
+        .where(Pedido.fecha_pedido == fecha, Pedido.estado == 'COMPLETADO')
+        .order_by(Pedido.numero_orden)
     ).all()
     
-    if not pedidos_hoy:
-        return "📊 No hay pedidos completados hoy"
-    
-    total_facturado = sum(p.total for p in pedidos_hoy)
+    if not pedidos_dia:
+        return "📊 No hay pedidos completados hoy" if fecha == date.today() \
+            else f"📊 No hay pedidos completados el {fecha.strftime('%d/%m/%Y')}"
     
-    mensaje = f"""📊 *REPORTE DIARIO - {date.today().strftime('%d/%m/%Y')}*
+    lineas = [
+        f"📊 *REPORTE DIARIO - {fecha.strftime('%d/%m/%Y')}*",
+        "",
+        f"🔢 Pedidos completados: {len(pedidos_dia)}",
+        f"💰 Total facturado: {sum(total for _, _, total in pedidos_dia)} CUP",
+        "",
+        "📋 PEDIDOS:",
+    ]
+    lineas.extend(f"• [{numero}] {cliente}: {total} CUP" for numero, cliente, total in pedidos_dia)
+    _lineas_ganancias(lineas, fecha, fecha)
+    return "\n".join(lineas) + "\n"
 
-🔢 Pedidos completados: {len(pedidos_hoy)}
-💰 Total facturado: {total_facturado} CUP
+def generar_reporte_periodo(desde, hasta, titulo='REPORTE'):
+    """Reporte consolidado de un rango: totales por día y ganancias por trabajador
 
-📋 PEDIDOS:
-"""
+    Siempre dos consultas agregadas, sea una semana o un año.
+    """
+    if desde == hasta:
+        return generar_reporte_diario(desde)
+    return cache_reportes.obtener(f'periodo:{titulo}:{desde.isoformat()}:{hasta.isoformat()}',
+                                  desde, hasta, lambda: _generar_reporte_periodo(desde, hasta, titulo))
+
+def _generar_reporte_periodo(desde, hasta, titulo):
+    por_dia = db.session.execute(
+        db.select(Pedido.fecha_pedido, db.func.count(Pedido.id), db.func.sum(Pedido.total))
+        .where(Pedido.fecha_pedido >= desde, Pedido.fecha_pedido <= hasta,
+               Pedido.estado == 'COMPLETADO')
+        .group_by(Pedido.fecha_pedido)
+        .order_by(Pedido.fecha_pedido)
+    ).all()
     
-    for pedido in pedidos_hoy:
-        mensaje += f"• [{pedido.numero_orden}] {pedido.cliente_nombre}: {pedido.total} CUP\n"
-    
-    # Consolidado de ganancias por trabajador
-    ganancias_trabajadores = {}
-    for pedido in pedidos_hoy:
-        comisiones = ComisionPedido.query.filter_by(pedido_id=pedido.id).all()
-        for comision in comisiones:
-            if comision.trabajador_id and comision.trabajador:
-                nombre = comision.trabajador.nombre
-                if nombre not in ganancias_trabajadores:
-                    ganancias_trabajadores[nombre] = 0
-                ganancias_trabajadores[nombre] += comision.monto
-    
-    if ganancias_trabajadores:
-        mensaje += "\n👥 GANANCIAS POR TRABAJADOR:\n"
-        for nombre, ganancia in ganancias_trabajadores.items():
-            mensaje += f"• {nombre}: {ganancia} CUP\n"
+    rango = f"{desde.strftime('%d/%m/%Y')} - {hasta.strftime('%d/%m/%Y')}"
+    if not por_dia:
+        return f"📊 No hay pedidos completados entre {rango}"
     
-    return mensaje
+    lineas = [
+        f"📊 *{titulo} - {rango}*",
+        "",
+        f"🔢 Pedidos completados: {sum(cantidad for _, cantidad, _ in por_dia)}",
+        f"💰 Total facturado: {sum(total for _, _, total in por_dia)} CUP",
+        "",
+        "📅 POR DÍA:",
+    ]
+    lineas.extend(f"• {fecha.strftime('%d/%m/%Y')}: {cantidad} pedidos, {total} CUP"
+                  for fecha, cantidad, total in por_dia)
+    _lineas_ganancias(lineas, desde, hasta)
+    return "\n".join(lineas) + "\n"
+
+# Resumen diario del dashboard
+def _calcular_resumen(fecha):
+    """Calcula la fila del resumen de una fecha a partir de las tablas base"""
+    completados, total = db.session.query(
+        db.func.count(Pedido.id), db.func.coalesce(db.func.sum(Pedido.total), 0)
+    ).filter(Pedido.fecha_pedido == fecha, Pedido.estado == 'COMPLETADO').one()
+    return {
+        'fecha': fecha,
+        'pedidos_completados': completados,
+        'total_facturado': total,
+        'pedidos_pendientes': Pedido.query.filter_by(estado='PENDIENTE').count(),
+        'trabajadores_activos': Trabajador.query.filter_by(activo=True).count(),
+    }
+
+def _asegurar_resumen(fecha):
+    """Crea la fila del resumen de `fecha` si aún no existe"""
+    if db.session.get(ResumenDiario, fecha) is not None:
+        return
+    with db.session.no_autoflush:
+        valores = _calcular_resumen(fecha)
+    _insertar_si_no_existe(ResumenDiario, valores)
+
+def acumular_resumen(fecha, **deltas):
+    """Suma los deltas a la fila del resumen de `fecha` dentro de la transacción actual
+
+    Debe llamarse antes de modificar los pedidos afectados, para que una fila
+    recién creada no cuente dos veces el mismo cambio.
+    """
+    _asegurar_resumen(fecha)
+    db.session.execute(
+        db.update(ResumenDiario)
+        .where(ResumenDiario.fecha == fecha)
+        .values({getattr(ResumenDiario, campo): getattr(ResumenDiario, campo) + delta
+                 for campo, delta in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+
+def obtener_estadisticas():
+    """Estadísticas del dashboard leídas de la fila de hoy del resumen"""
+    hoy = date.today()
+    resumen = db.session.get(ResumenDiario, hoy)
+    if resumen is None:
+        _asegurar_resumen(hoy)
+        db.session.commit()
+        resumen = db.session.get(ResumenDiario, hoy)
+    return {
+        'pedidos_hoy': resumen.pedidos_completados,
+        'total_hoy': resumen.total_facturado,
+        'pedidos_pendientes': resumen.pedidos_pendientes,
+        'trabajadores_activos': resumen.trabajadores_activos
+    }
+
+def reconciliar_resumen():
+    """Recalcula el resumen desde las tablas base y corrige las diferencias
+
+    Los contadores globales (pendientes y trabajadores activos) sólo se
+    corrigen en la fila de hoy; en días cerrados son una foto histórica.
+    Devuelve la lista de (fecha, campo, valor_guardado, valor_real) corregidos.
+    """
+    hoy = date.today()
+    reales = {
+        fecha: (completados, total)
+        for fecha, completados, total in db.session.query(
+            Pedido.fecha_pedido, db.func.count(Pedido.id), db.func.sum(Pedido.total)
+        ).filter(Pedido.estado == 'COMPLETADO').group_by(Pedido.fecha_pedido)
+    }
+    guardados = {r.fecha: r for r in ResumenDiario.query.all()}
+    diferencias = []
+
+    for fecha in sorted(set(reales) | set(guardados) | {hoy}):
+        resumen = guardados.get(fecha)
+        if resumen is None:
+            resumen = ResumenDiario(fecha=fecha, pedidos_completados=0, total_facturado=0,
+                                    pedidos_pendientes=0, trabajadores_activos=0)
+            db.session.add(resumen)
+        completados, total = reales.get(fecha, (0, 0))
+        esperado = {'pedidos_completados': completados, 'total_facturado': total or 0}
+        if fecha == hoy:
+            actual = _calcular_resumen(hoy)
+            esperado['pedidos_pendientes'] = actual['pedidos_pendientes']
+            esperado['trabajadores_activos'] = actual['trabajadores_activos']
+        for campo, valor in esperado.items():
+            if getattr(resumen, campo) != valor:
+                diferencias.append((fecha, campo, getattr(resumen, campo), valor))
+                setattr(resumen, campo, valor)
+
+    db.session.commit()
+    return diferencias
+
+class DifusorEstadisticas:
+    """Comparte una única copia de las estadísticas entre todos los clientes del proceso
+
+    Cada cambio (o cada `intervalo` segundos, para ver los cambios hechos por
+    otros workers) cuesta una sola lectura del resumen, sin importar cuántas
+    pestañas estén escuchando.
+    """
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._cond = threading.Condition()
+        self._version = None
+        self._datos = None
+        self._refrescado = 0.0
+        self._refrescando = False
+
+    def _cargar(self):
+        with app.app_context():
+            datos = obtener_estadisticas()
+        version = hashlib.sha1(json.dumps(datos, sort_keys=True).encode()).hexdigest()[:16]
+        with self._cond:
+            self._refrescado = time.monotonic()
+            self._refrescando = False
+            if version != self._version:
+                self._version, self._datos = version, datos
+            self._cond.notify_all()
+
+    def _refrescar_si_toca(self):
+        """Refresca si el dato venció; sólo un hilo consulta, el resto espera"""
+        with self._cond:
+            vencido = time.monotonic() - self._refrescado >= self.intervalo
+            if not vencido or self._refrescando:
+                return
+            self._refrescando = True
+        try:
+            self._cargar()
+        except Exception:
+            with self._cond:
+                self._refrescando = False
+                self._cond.notify_all()
+            raise
+
+    def publicar(self):
+        """Recalcula tras un cambio confirmado en este proceso y despierta a los clientes"""
+        try:
+            self._cargar()
+        except Exception as e:
+            logger.error(f"Error publicando estadísticas: {e}")
+
+    def actual(self):
+        """Devuelve (version, datos), refrescando como mucho una vez por intervalo"""
+        return self.esperar(None, timeout=self.intervalo)
+
+    def esperar(self, version, timeout):
+        """Bloquea hasta que haya una versión distinta de `version` o venza el timeout"""
+        limite = time.monotonic() + timeout
+        while True:
+            self._refrescar_si_toca()
+            with self._cond:
+                if self._version is not None and self._version != version:
+                    return self._version, self._datos
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return self._version, self._datos
+                proximo = self._refrescado + self.intervalo - time.monotonic()
+                self._cond.wait(timeout=max(0.05, min(restante, proximo)))
+
+difusor_estadisticas = DifusorEstadisticas(app.config['ESTADISTICAS_INTERVALO'])
+
+@app.cli.command('reconciliar-resumen')
+def reconciliar_resumen_command():
+    """Reconstruye el resumen diario del dashboard desde pedidos y trabajadores"""
+    diferencias = reconciliar_resumen()
+    for fecha, campo, guardado, real in diferencias:
+        print(f"⚠️  {fecha.isoformat()} {campo}: {guardado} -> {real}")
+    print(f"✅ Resumen diario reconciliado ({len(diferencias)} correcciones)")
+
+# Migraciones del esquema
+# db.create_all() sólo crea tablas nuevas: los cambios sobre tablas existentes
+# (índices, columnas) se añaden aquí con una versión nueva y nunca se editan.
+def _crear_indices(conexion, *nombres):
+    """Crea los índices declarados en los modelos que aún no existan"""
+    indices = {i.name: i for tabla in db.metadata.tables.values() for i in tabla.indexes}
+    for nombre in nombres:
+        indices[nombre].create(conexion, checkfirst=True)
+
+def _agregar_columna(conexion, tabla, columna, definicion):
+    """ALTER TABLE ADD COLUMN si la columna no existe todavía"""
+    existentes = {c['name'] for c in db.inspect(conexion).get_columns(tabla)}
+    if columna not in existentes:
+        conexion.execute(db.text(f'ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}'))
+
+def _agregar_marca_pedidos(conexion):
+    # Los pedidos existentes quedan en NULL: sólo los trae un backup completo
+    _agregar_columna(conexion, 'pedido', 'actualizado_en', 'TIMESTAMP')
+    _crear_indices(conexion, 'ix_pedido_actualizado')
+
+MIGRACIONES = [
+    (1, 'indices de consultas frecuentes', lambda conexion: _crear_indices(
+        conexion,
+        'ix_pedido_fecha_estado',
+        'ix_pedido_estado_numero',
+        'ix_item_pedido_pedido',
+        'ix_comision_pedido_pedido',
+        'ix_trabajador_tipo_activo',
+    )),
+    (2, 'contador de numero_orden', _sembrar_contador_pedidos),
+    (3, 'libro de ganancias por trabajador', lambda conexion: _reconstruir_ganancias(conexion)),
+    (4, 'marca de cambio en pedidos', lambda conexion: _agregar_marca_pedidos(conexion)),
+    (5, 'fecha de los sellos de versión', lambda conexion: _agregar_columna(
+        conexion, 'version_datos', 'actualizado_en', 'TIMESTAMP')),
+    (6, 'secuencia del sello de pedidos', lambda conexion: SECUENCIA_PEDIDOS.create(
+        conexion, checkfirst=True)),
+]
+
+def aplicar_migraciones():
+    """Aplica, cada una en su transacción, las migraciones pendientes"""
+    MigracionAplicada.__table__.create(db.engine, checkfirst=True)
+    aplicadas = {m.version for m in MigracionAplicada.query.all()}
+    db.session.commit()
+    nuevas = []
+    for version, nombre, migrar in MIGRACIONES:
+        if version in aplicadas:
+            continue
+        logger.info(f"Applying migration {version}: {nombre}")
+        with db.engine.begin() as conexion:
+            migrar(conexion)
+            conexion.execute(db.insert(MigracionAplicada).values(
+                version=version, nombre=nombre, aplicada_en=datetime.now()))
+        nuevas.append(version)
+    # Las migraciones escriben por su cuenta, fuera de la sesión
+    sellar_pedidos_pendiente()
+    return nuevas
+
+@app.cli.command('migrar')
+def migrar_command():
+    """Aplica las migraciones de esquema pendientes"""
+    db.create_all()
+    nuevas = aplicar_migraciones()
+    print(f"✅ Migraciones aplicadas: {nuevas or 'ninguna pendiente'}")
+
+# Consultas frecuentes cuyo plan se verifica con EXPLAIN
+CONSULTAS_FRECUENTES = {
+    'pedidos completados hoy': lambda: db.select(db.func.count(Pedido.id)).where(
+        Pedido.fecha_pedido == date.today(), Pedido.estado == 'COMPLETADO'),
+    'pedidos pendientes': lambda: db.select(db.func.count(Pedido.id)).where(
+        Pedido.estado == 'PENDIENTE'),
+    'listado de pedidos': lambda: db.select(Pedido).order_by(
+        Pedido.numero_orden.desc()).limit(PEDIDOS_POR_PAGINA + 1),
+    'listado de pedidos por estado': lambda: db.select(Pedido).where(
+        Pedido.estado == 'PENDIENTE').order_by(Pedido.numero_orden.desc()).limit(PEDIDOS_POR_PAGINA + 1),
+    'items de un pedido': lambda: db.select(ItemPedido).where(ItemPedido.pedido_id == 1),
+    'comisiones de un pedido': lambda: db.select(ComisionPedido).where(ComisionPedido.pedido_id == 1),
+    'trabajadores por tipo': lambda: db.select(Trabajador).where(
+        Trabajador.tipo == 'inversor', Trabajador.activo == True),
+    'resumen de hoy': lambda: db.select(ResumenDiario).where(ResumenDiario.fecha == date.today()),
+}
+
+def _tablas_recorridas(conexion, consulta):
+    """Tablas que el plan de la consulta lee con un recorrido secuencial"""
+    compilada = consulta.compile(dialect=conexion.dialect)
+    if compilada.positional:
+        parametros = tuple(compilada.params[p] for p in compilada.positiontup)
+    else:
+        parametros = compilada.params
+
+    if conexion.dialect.name == 'postgresql':
+        # Con tablas pequeñas el planificador prefiere Seq Scan aunque exista
+        # un índice útil; al desactivarlo sólo queda si no hay alternativa.
+        conexion.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        plan = conexion.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compilada}', parametros).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        pendientes, tablas = [plan[0]['Plan']], []
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo.get('Node Type') == 'Seq Scan':
+                tablas.append(nodo.get('Relation Name'))
+            pendientes.extend(nodo.get('Plans', []))
+        return tablas
+
+    # SQLite: "SCAN tabla" es un recorrido completo, salvo que recorra un índice
+    # en orden y un LIMIT lo corte (paginación por numero_orden)
+    con_limite = ' LIMIT ' in str(compilada)
+    filas = conexion.exec_driver_sql(f'EXPLAIN QUERY PLAN {compilada}', parametros).all()
+    return [fila[-1].split()[1] for fila in filas
+            if fila[-1].startswith('SCAN ') and not (con_limite and ' USING ' in fila[-1])]
+
+def verificar_consultas():
+    """Devuelve {consulta: [tablas con recorrido secuencial]} de las consultas frecuentes"""
+    problemas = {}
+    with db.engine.connect() as conexion:
+        for nombre, construir in CONSULTAS_FRECUENTES.items():
+            with conexion.begin():
+                tablas = _tablas_recorridas(conexion, construir())
+            if tablas:
+                problemas[nombre] = tablas
+    return problemas
+
+@app.cli.command('verificar-consultas')
+def verificar_consultas_command():
+    """Avisa de las consultas frecuentes que recorren tablas enteras"""
+    problemas = verificar_consultas()
+    for nombre in CONSULTAS_FRECUENTES:
+        if nombre in problemas:
+            print(f"❌ {nombre}: recorrido secuencial de {', '.join(problemas[nombre])}")
+        else:
+            print(f"✅ {nombre}")
+    if problemas:
+        raise SystemExit(1)
+
+# Listado de pedidos (paginación por cursor sobre numero_orden)
+PEDIDOS_POR_PAGINA = 50
+PEDIDOS_POR_PAGINA_MAX = 200
+FILTROS_PEDIDOS = ('estado', 'entrega_desde', 'entrega_hasta', 'vendedor_id', 'mensajero_id', 'cliente')
+
+def _leer_filtros_pedidos(args):
+    """Valida los filtros del listado; lanza ValueError si alguno es inválido"""
+    filtros = {}
+    for campo in FILTROS_PEDIDOS:
+        valor = (args.get(campo) or '').strip()
+        if not valor:
+            continue
+        if campo in ('entrega_desde', 'entrega_hasta'):
+            try:
+                datetime.strptime(valor, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Fecha inválida en {campo}: {valor}")
+        elif campo in ('vendedor_id', 'mensajero_id') and not valor.isdigit():
+            raise ValueError(f"Identificador inválido en {campo}: {valor}")
+        filtros[campo] = valor
+    return filtros
+
+def consultar_pedidos(filtros, antes=None, limite=PEDIDOS_POR_PAGINA):
+    """Devuelve una página de pedidos (más recientes primero) y el cursor de la siguiente
+
+    El cursor es el último numero_orden de la página: la siguiente se pide con
+    `numero_orden < cursor`, así que el coste no depende de cuántas páginas haya
+    detrás ni del tamaño total del historial.
+    """
+    query = Pedido.query
+    if 'estado' in filtros:
+        query = query.filter(Pedido.estado == filtros['estado'].upper())
+    if 'entrega_desde' in filtros:
+        query = query.filter(Pedido.fecha_entrega >= datetime.strptime(filtros['entrega_desde'], '%Y-%m-%d').date())
+    if 'entrega_hasta' in filtros:
+        query = query.filter(Pedido.fecha_entrega <= datetime.strptime(filtros['entrega_hasta'], '%Y-%m-%d').date())
+    if 'vendedor_id' in filtros:
+        query = query.filter(Pedido.vendedor_id == int(filtros['vendedor_id']))
+    if 'mensajero_id' in filtros:
+        query = query.filter(Pedido.mensajero_id == int(filtros['mensajero_id']))
+    if 'cliente' in filtros:
+        patron = f"%{filtros['cliente']}%"
+        query = query.filter(db.or_(Pedido.cliente_nombre.ilike(patron),
+                                    Pedido.cliente_telefono.ilike(patron)))
+    if antes is not None:
+        query = query.filter(Pedido.numero_orden < antes)
+
+    pedidos = query.order_by(Pedido.numero_orden.desc()).limit(limite + 1).all()
+    siguiente = pedidos[limite - 1].numero_orden if len(pedidos) > limite else None
+    return pedidos[:limite], siguiente
+
+def _leer_pagina(args):
+    """Lee `antes` y `limite` de la query string"""
+    antes = args.get('antes', type=int)
+    limite = args.get('limite', PEDIDOS_POR_PAGINA, type=int)
+    return antes, max(1, min(limite, PEDIDOS_POR_PAGINA_MAX))
+
+def serializar_pedido(pedido):
+    """Columnas del pedido en un dict apto para JSON"""
+    return {
+        'id': pedido.id,
+        'numero_orden': pedido.numero_orden,
+        'fecha_pedido': pedido.fecha_pedido.isoformat() if pedido.fecha_pedido else None,
+        'fecha_entrega': pedido.fecha_entrega.isoformat() if pedido.fecha_entrega else None,
+        'horario_entrega': pedido.horario_entrega,
+        'cliente_nombre': pedido.cliente_nombre,
+        'cliente_telefono': pedido.cliente_telefono,
+        'cliente_direccion': pedido.cliente_direccion,
+        'vendedor_id': pedido.vendedor_id,
+        'mensajero_id': pedido.mensajero_id,
+        'elaborador_id': pedido.elaborador_id,
+        'estado': pedido.estado,
+        'modificado': pedido.modificado,
+        'subtotal': pedido.subtotal,
+        'mensajeria': pedido.mensajeria,
+        'total': pedido.total,
+        'observaciones': pedido.observaciones
+    }
+
+def _serializar_trabajador(trabajador):
+    if trabajador is None:
+        return None
+    return {'id': trabajador.id, 'nombre': trabajador.nombre, 'tipo': trabajador.tipo}
+
+def consultar_detalles(ids):
+    """Carga pedidos con items, productos, trabajadores y comisiones en 3 consultas
+
+    Una para los pedidos (con sus tres trabajadores por JOIN) y una selectin
+    por colección (items + producto, comisiones + trabajador), sin importar
+    cuántos pedidos o items haya.
+    """
+    return Pedido.query.options(
+        db.joinedload(Pedido.vendedor),
+        db.joinedload(Pedido.mensajero),
+        db.joinedload(Pedido.elaborador),
+        db.selectinload(Pedido.items).joinedload(ItemPedido.producto),
+        db.selectinload(Pedido.comisiones).joinedload(ComisionPedido.trabajador),
+    ).filter(Pedido.id.in_(ids)).order_by(Pedido.numero_orden.desc()).all()
+
+def serializar_detalle(pedido):
+    """Pedido completo (items, productos, trabajadores y comisiones) apto para JSON"""
+    detalle = serializar_pedido(pedido)
+    detalle['vendedor'] = _serializar_trabajador(pedido.vendedor)
+    detalle['mensajero'] = _serializar_trabajador(pedido.mensajero)
+    detalle['elaborador'] = _serializar_trabajador(pedido.elaborador)
+    detalle['items'] = [{
+        'id': item.id,
+        'producto_id': item.producto_id,
+        'producto': {
+            'id': item.producto.id,
+            'nombre': item.producto.nombre,
+            'tipo': item.producto.tipo,
+            'tamaño': item.producto.tamaño
+        } if item.producto else None,
+        'cantidad': item.cantidad,
+        'precio_unitario': item.precio_unitario,
+        'incluye_bolsa_regalo': item.incluye_bolsa_regalo,
+        'precio_bolsa': item.precio_bolsa
+    } for item in sorted(pedido.items, key=lambda i: i.id)]
+    detalle['comisiones'] = [{
+        'tipo_comision': comision.tipo_comision,
+        'trabajador': _serializar_trabajador(comision.trabajador),
+        'monto': comision.monto
+    } for comision in sorted(pedido.comisiones, key=lambda c: c.id)]
+    return detalle
+
+# Precios de los items
+def precio_item(producto, cantidad, incluye_bolsa_regalo, config):
+    """Devuelve (precio_unitario, precio_bolsa, importe) calculados en el servidor
+
+    La bolsa de regalo se cobra por unidad al precio de la configuración.
+    """
+    precio_bolsa = config.precio_bolsa_regalo * cantidad if incluye_bolsa_regalo else 0
+    return producto.precio_venta, precio_bolsa, producto.precio_venta * cantidad + precio_bolsa
+
+# Importación masiva de pedidos (CSV / JSONL)
+IMPORTACION_LOTE = 1000
+CAMPOS_PEDIDO_CSV = ('cliente_nombre', 'cliente_telefono', 'cliente_direccion', 'fecha_entrega',
+                     'horario_entrega', 'vendedor', 'mensajero', 'elaborador', 'mensajeria',
+                     'observaciones')
+
+def _es_verdadero(valor):
+    if isinstance(valor, bool):
+        return valor
+    return str(valor or '').strip().lower() in ('1', 'si', 'sí', 'true', 'x')
+
+class ArchivoIlegible(ValueError):
+    """El archivo dejó de poder leerse: no se importa nada desde esa línea"""
+
+    def __init__(self, error):
+        super().__init__(f"Archivo ilegible desde esta línea, no se importó nada a partir de aquí: {error}")
+
+def _leer_pedidos_jsonl(lineas):
+    """Genera (linea, pedido) con un pedido por línea; pedido es una excepción si no se pudo leer
+
+    Si el archivo deja de poder decodificarse, el último pedido es un
+    ArchivoIlegible en la primera línea no leída.
+    """
+    numero = 0
+    try:
+        for numero, linea in enumerate(lineas, 1):
+            if not linea.strip():
+                continue
+            try:
+                pedido = json.loads(linea)
+                if not isinstance(pedido, dict):
+                    raise ValueError("cada línea debe ser un objeto JSON")
+            except ValueError as e:
+                pedido = ValueError(f"JSON inválido: {e}")
+            yield numero, pedido
+    except UnicodeDecodeError as e:
+        yield numero + 1, ArchivoIlegible(e)
+
+def _leer_pedidos_csv(lineas):
+    """Genera (linea, pedido) agrupando en un pedido las filas consecutivas con la misma referencia
+
+    Cada fila es un item (producto, cantidad, incluye_bolsa_regalo); los datos
+    del pedido se toman de su primera fila. Sin columna `referencia` cada
+    fila es un pedido de un solo item.
+    """
+    lector = csv.DictReader(lineas)
+    actual, referencia_actual, linea_actual = None, None, None
+    try:
+        for fila in lector:
+            numero = lector.line_num
+            referencia = (fila.get('referencia') or '').strip() or None
+            if actual is None or referencia is None or referencia != referencia_actual:
+                if actual is not None:
+                    yield linea_actual, actual
+                actual = {campo: fila.get(campo) for campo in CAMPOS_PEDIDO_CSV}
+                actual['referencia'] = referencia
+                actual['items'] = []
+                referencia_actual, linea_actual = referencia, numero
+            actual['items'].append({
+                'producto': fila.get('producto'),
+                'cantidad': fila.get('cantidad'),
+                'incluye_bolsa_regalo': fila.get('incluye_bolsa_regalo')
+            })
+    except (UnicodeDecodeError, csv.Error) as e:
+        # El pedido en curso puede tener items sin leer: tampoco se importa
+        yield (linea_actual if actual is not None else lector.line_num + 1), ArchivoIlegible(e)
+        return
+    if actual is not None:
+        yield linea_actual, actual
+
+class _Referencias:
+    """Productos y trabajadores activos en memoria, buscables por id o por nombre"""
+
+    def __init__(self, productos=None):
+        self.config = obtener_configuracion()
+        self.productos = {}
+        for producto in (productos_activos() if productos is None else productos):
+            self.productos[str(producto.id)] = producto
+            self.productos[producto.nombre.strip().lower()] = producto
+        self.trabajadores = {}
+        for trabajador in trabajadores_activos():
+            self.trabajadores[str(trabajador.id)] = trabajador
+            self.trabajadores[trabajador.nombre.strip().lower()] = trabajador
+
+    def producto(self, valor):
+        producto = self.productos.get(str(valor or '').strip().lower())
+        if producto is None:
+            raise ValueError(f"Producto desconocido: {valor}")
+        return producto
+
+    def trabajador(self, valor, tipo):
+        if valor in (None, ''):
+            return None
+        trabajador = self.trabajadores.get(str(valor).strip().lower())
+        if trabajador is None or trabajador.tipo != tipo:
+            raise ValueError(f"{tipo.capitalize()} desconocido: {valor}")
+        return trabajador.id
+
+# Topes de lo que puede traer un pedido (las columnas son INTEGER de 32 bits)
+CANTIDAD_MAXIMA = 10000
+IMPORTE_MAXIMO = 10 ** 7
+ID_MAXIMO = 2 ** 31 - 1
+
+def _entero(valor):
+    """int(valor) sin truncar decimales ni aceptar booleanos; ValueError si no es un entero"""
+    if isinstance(valor, bool) or (isinstance(valor, float) and not valor.is_integer()):
+        raise ValueError(valor)
+    try:
+        return int(valor)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(valor)
+
+def _texto(datos, campo):
+    """Campo de texto opcional sin espacios ('' si falta); ValueError si no es texto"""
+    valor = datos.get(campo)
+    if valor is None:
+        return ''
+    if not isinstance(valor, str):
+        raise ValueError(f"{campo} debe ser texto")
+    return valor.strip()
+
+def _validar_pedido(datos, referencias):
+    """Convierte un pedido recibido en (fila de Pedido sin número, filas de ItemPedido)"""
+    if not isinstance(datos, dict):
+        raise ValueError("El pedido debe ser un objeto")
+    cliente = _texto(datos, 'cliente_nombre')
+    if not cliente:
+        raise ValueError("Falta cliente_nombre")
+    direccion = _texto(datos, 'cliente_direccion')
+    if not direccion:
+        raise ValueError("Falta cliente_direccion")
+    try:
+        fecha_entrega = datetime.strptime(str(datos.get('fecha_entrega') or '').strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"fecha_entrega inválida: {datos.get('fecha_entrega')}")
+    mensajeria = datos.get('mensajeria')
+    try:
+        # Sólo falta si no viene o viene vacía: un 0 explícito es un 0
+        mensajeria = 0 if mensajeria in (None, '') else _entero(mensajeria)
+    except ValueError:
+        raise ValueError(f"mensajeria inválida: {datos.get('mensajeria')}")
+    if mensajeria < 0:
+        raise ValueError("mensajeria no puede ser negativa")
+    if mensajeria > IMPORTE_MAXIMO:
+        raise ValueError(f"mensajeria inválida: {mensajeria}")
+
+    items = datos.get('items') or []
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError("items debe ser una lista de objetos")
+    if not items:
+        raise ValueError("El pedido no tiene items")
+    filas_items, subtotal = [], 0
+    for item in items:
+        producto = referencias.producto(item.get('producto', item.get('producto_id')))
+        cantidad = item.get('cantidad')
+        try:
+            cantidad = 1 if cantidad in (None, '') else _entero(cantidad)
+        except ValueError:
+            raise ValueError(f"cantidad inválida: {item.get('cantidad')}")
+        if cantidad <= 0 or cantidad > CANTIDAD_MAXIMA:
+            raise ValueError(f"cantidad inválida: {cantidad}")
+        bolsa = _es_verdadero(item.get('incluye_bolsa_regalo'))
+        precio_unitario, precio_bolsa, importe = precio_item(producto, cantidad, bolsa, referencias.config)
+        filas_items.append({
+            'producto_id': producto.id,
+            'cantidad': cantidad,
+            'precio_unitario': precio_unitario,
+            'incluye_bolsa_regalo': bolsa,
+            'precio_bolsa': precio_bolsa
+        })
+        subtotal += importe
+
+    pedido = {
+        'fecha_pedido': date.today(),
+        'fecha_entrega': fecha_entrega,
+        'horario_entrega': _texto(datos, 'horario_entrega') or None,
+        'cliente_nombre': cliente,
+        'cliente_telefono': _texto(datos, 'cliente_telefono') or None,
+        'cliente_direccion': direccion,
+        'vendedor_id': referencias.trabajador(datos.get('vendedor', datos.get('vendedor_id')), 'vendedor'),
+        'mensajero_id': referencias.trabajador(datos.get('mensajero', datos.get('mensajero_id')), 'mensajero'),
+        'elaborador_id': referencias.trabajador(datos.get('elaborador', datos.get('elaborador_id')), 'elaborador'),
+        'estado': 'PENDIENTE',
+        'modificado': False,
+        'subtotal': subtotal,
+        'mensajeria': mensajeria,
+        'total': subtotal + mensajeria,
+        'observaciones': _texto(datos, 'observaciones') or None
+    }
+    return pedido, filas_items
+
+def _guardar_lote(lote):
+    """Inserta un lote de pedidos válidos en una sola transacción
+
+    Reserva un bloque de números de orden, inserta todos los pedidos con un
+    INSERT multi-fila (RETURNING id) y luego todos sus items de una vez.
+    """
+    primero = reservar_numeros_orden(len(lote))
+    filas_pedidos = []
+    for desplazamiento, (_, _, pedido, _) in enumerate(lote):
+        pedido['numero_orden'] = primero + desplazamiento
+        filas_pedidos.append(pedido)
+    acumular_resumen(date.today(), pedidos_pendientes=len(lote))
+    ids = db.session.execute(
+        db.insert(Pedido).returning(Pedido.id, sort_by_parameter_order=True), filas_pedidos
+    ).scalars().all()
+    filas_items = []
+    for pedido_id, (_, _, _, items) in zip(ids, lote):
+        for item in items:
+            filas_items.append(dict(item, pedido_id=pedido_id))
+    db.session.execute(db.insert(ItemPedido), filas_items)
+    db.session.commit()
+
+def importar_pedidos(lineas, formato, lote=IMPORTACION_LOTE):
+    """Importa pedidos desde un flujo de líneas CSV o JSONL
+
+    Devuelve un resultado por pedido leído: {'linea', 'referencia', 'ok',
+    'numero_orden' | 'error'}. Un pedido inválido no detiene la importación;
+    si falla la escritura de un lote, se marcan con error todos sus pedidos.
+    Si el archivo deja de poder leerse, se guarda lo leído hasta entonces y el
+    último resultado, marcado con 'interrumpido', es el de la línea donde se
+    detuvo la lectura.
+    """
+    if formato not in ('csv', 'jsonl'):
+        raise ValueError(f"Formato no soportado: {formato}")
+    leer = _leer_pedidos_csv if formato == 'csv' else _leer_pedidos_jsonl
+    referencias = _Referencias()
+    resultados, pendientes = [], []
+
+    def vaciar():
+        if not pendientes:
+            return
+        try:
+            _guardar_lote(pendientes)
+            for linea, referencia, pedido, _ in pendientes:
+                resultados.append({'linea': linea, 'referencia': referencia, 'ok': True,
+                                   'numero_orden': pedido['numero_orden']})
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error importando lote: {e}")
+            for linea, referencia, _, _ in pendientes:
+                resultados.append({'linea': linea, 'referencia': referencia, 'ok': False,
+                                   'error': f"Error guardando el lote: {e}"})
+        pendientes.clear()
+
+    for linea, datos in leer(lineas):
+        referencia = datos.get('referencia') if isinstance(datos, dict) else None
+        try:
+            if isinstance(datos, Exception):
+                raise datos
+            pedido, items = _validar_pedido(datos, referencias)
+        except ValueError as e:
+            resultados.append({'linea': linea, 'referencia': referencia, 'ok': False, 'error': str(e)})
+            if isinstance(e, ArchivoIlegible):
+                resultados[-1]['interrumpido'] = True
+                break
+            continue
+        pendientes.append((linea, referencia, pedido, items))
+        if len(pendientes) >= lote:
+            vaciar()
+    vaciar()
+
+    resultados.sort(key=lambda r: r['linea'])
+    if any(r['ok'] for r in resultados):
+        difusor_estadisticas.publicar()
+    return resultados
+
+def _referencias_para(items):
+    """Referencias con sólo los productos pedidos, leídos en una única consulta IN"""
+    ids = set()
+    for item in items:
+        try:
+            producto_id = _entero(item.get('producto_id'))
+        except ValueError:
+            raise ValueError(f"producto_id inválido: {item.get('producto_id')}")
+        # Fuera del rango de la columna el driver falla en vez de no encontrarlo
+        if not 1 <= producto_id <= ID_MAXIMO:
+            raise ValueError(f"producto_id inválido: {item.get('producto_id')}")
+        ids.add(producto_id)
+    productos = Producto.query.filter(Producto.id.in_(ids), Producto.activo == True).all() if ids else []
+    return _Referencias(productos=[_instantanea(p) for p in productos])
+
+def crear_pedido_con_items(datos):
+    """Valida `datos`, calcula los precios en el servidor y crea el pedido sin confirmar
+
+    `datos` trae los campos del pedido y `items` = [{producto_id, cantidad,
+    incluye_bolsa_regalo}]; los precios que mande el cliente se ignoran.
+    Devuelve (pedido, filas de sus items). Lanza ValueError si algo no es
+    válido.
+    """
+    items = datos.get('items') or []
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        raise ValueError("items debe ser una lista de objetos")
+    fila, filas_items = _validar_pedido(datos, _referencias_para(items))
+
+    fila['numero_orden'] = reservar_numeros_orden()
+    acumular_resumen(date.today(), pedidos_pendientes=1)
+    pedido = Pedido(**fila)
+    db.session.add(pedido)
+    db.session.flush()
+
+    # Todos los items en un único executemany
+    for item in filas_items:
+        item['pedido_id'] = pedido.id
+    db.session.execute(db.insert(ItemPedido), filas_items)
+    return pedido, filas_items
+
+def _formato_de(nombre_archivo, formato=None):
+    if formato:
+        return formato.lower()
+    return 'csv' if nombre_archivo.lower().endswith('.csv') else 'jsonl'
+
+@app.cli.command('importar-pedidos')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), help='Por defecto, según la extensión')
+@click.option('--lote', default=IMPORTACION_LOTE, show_default=True, help='Pedidos por transacción')
+def importar_pedidos_command(archivo, formato, lote):
+    """Importa pedidos con sus items desde un archivo CSV o JSONL"""
+    inicio = time.perf_counter()
+    with open(archivo, encoding='utf-8', newline='') as f:
+        resultados = importar_pedidos(f, _formato_de(archivo, formato), lote)
+    segundos = time.perf_counter() - inicio
+    correctos = sum(1 for r in resultados if r['ok'])
+    for r in resultados:
+        if not r['ok']:
+            print(f"❌ Línea {r['linea']}{' (' + r['referencia'] + ')' if r['referencia'] else ''}: {r['error']}")
+    print(f"✅ {correctos} pedidos importados, {len(resultados) - correctos} con errores "
+          f"en {segundos:.1f} s ({correctos / max(segundos, 1e-9) * 60:.0f} pedidos/min)")
+
+# Exportación para contabilidad (CSV / NDJSON en streaming)
+EXPORTACION_LOTE = 1000
+
+def _consulta_export_pedidos():
+    return (
+        db.select(Pedido.id, Pedido.numero_orden, Pedido.fecha_pedido, Pedido.fecha_entrega,
+                  Pedido.horario_entrega, Pedido.cliente_nombre, Pedido.cliente_telefono,
+                  Pedido.cliente_direccion, Pedido.vendedor_id, Pedido.mensajero_id,
+                  Pedido.elaborador_id, Pedido.estado, Pedido.modificado, Pedido.subtotal,
+                  Pedido.mensajeria, Pedido.total, Pedido.observaciones)
+        .order_by(Pedido.id)
+    )
+
+def _consulta_export_items():
+    return (
+        db.select(ItemPedido.id, ItemPedido.pedido_id, Pedido.numero_orden, Pedido.fecha_pedido,
+                  ItemPedido.producto_id, Producto.nombre.label('producto'), ItemPedido.cantidad,
+                  ItemPedido.precio_unitario, ItemPedido.incluye_bolsa_regalo, ItemPedido.precio_bolsa)
+        .join(Pedido, Pedido.id == ItemPedido.pedido_id)
+        .join(Producto, Producto.id == ItemPedido.producto_id)
+        .order_by(ItemPedido.pedido_id, ItemPedido.id)
+    )
+
+def _consulta_export_comisiones():
+    return (
+        db.select(ComisionPedido.id, ComisionPedido.pedido_id, Pedido.numero_orden,
+                  Pedido.fecha_pedido, ComisionPedido.trabajador_id,
+                  Trabajador.nombre.label('trabajador'), ComisionPedido.tipo_comision,
+                  ComisionPedido.monto)
+        .join(Pedido, Pedido.id == ComisionPedido.pedido_id)
+        .outerjoin(Trabajador, Trabajador.id == ComisionPedido.trabajador_id)
+        .order_by(ComisionPedido.pedido_id, ComisionPedido.id)
+    )
+
+EXPORTACIONES = {
+    'pedidos': _consulta_export_pedidos,
+    'items': _consulta_export_items,
+    'comisiones': _consulta_export_comisiones,
+}
+
+def _valor_json(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    raise TypeError(f"No serializable: {type(valor).__name__}")
+
+def exportar_filas(consulta, formato, desde=None, hasta=None, lote=EXPORTACION_LOTE):
+    """Genera el texto de la exportación por trozos de `lote` filas
+
+    Las filas se leen con un cursor del lado del servidor (yield_per), así
+    que la memoria no depende del tamaño del rango.
+    """
+    if desde:
+        consulta = consulta.where(Pedido.fecha_pedido >= desde)
+    if hasta:
+        consulta = consulta.where(Pedido.fecha_pedido <= hasta)
+    resultado = db.session.execute(consulta.execution_options(yield_per=lote))
+    columnas = list(resultado.keys())
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if formato == 'csv':
+        escritor.writerow(columnas)
+        yield buffer.getvalue()
+    for filas in resultado.partitions():
+        buffer.seek(0)
+        buffer.truncate()
+        if formato == 'csv':
+            escritor.writerows(filas)
+        else:
+            for fila in filas:
+                buffer.write(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False,
+                                        default=_valor_json))
+                buffer.write('\n')
+        yield buffer.getvalue()
+
+# Métricas por petición (ver metricas.py)
+def _endpoint_actual():
+    if not has_request_context():
+        return 'fuera_de_peticion'
+    return request.endpoint or 'desconocido'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_sentencia(conn, cursor, statement, parameters, context, executemany):
+    conn.info['inicio_sentencia'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_sentencia(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info.pop('inicio_sentencia', None)
+    if inicio is None:
+        return
+    duracion = time.perf_counter() - inicio
+    if duracion >= app.config['SQL_LENTO_UMBRAL']:
+        _registrar_sql_lento(statement, parameters, executemany, duracion)
+    if has_request_context():
+        perfil_sql = g.get('_perfil_sql')
+        if perfil_sql is not None:
+            perfil_sql.append((statement, forma_parametros(parameters, executemany), duracion))
+        # Se acumula en g y se registra una sola vez al terminar la petición
+        g._sql_sentencias = g.get('_sql_sentencias', 0) + 1
+        g._sql_segundos = g.get('_sql_segundos', 0.0) + duracion
+        return
+    etiquetas = {'endpoint': 'fuera_de_peticion'}
+    registro_metricas.contar('byb_sql_queries_total', etiquetas)
+    registro_metricas.contar('byb_sql_duration_seconds_total', etiquetas, duracion)
+
+registro_sql_lento = RegistroSqlLento(max_bytes=app.config['SQL_LENTO_MAX_BYTES'])
+
+def _registrar_sql_lento(sentencia, parametros, executemany, segundos):
+    endpoint = _endpoint_actual()
+    logger.warning(f"SQL lento ({segundos * 1000:.0f} ms) en {endpoint}: {' '.join(sentencia.split())[:200]}")
+    try:
+        registro_sql_lento.registrar(sentencia, parametros, executemany, segundos, endpoint,
+                                     request.path if has_request_context() else None)
+    except OSError as e:
+        logger.error(f"No se pudo escribir el registro de SQL lento: {e}")
+
+def _firmador_perfiles():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='perfilar')
+
+def token_perfil():
+    """Token firmado que activa el perfilado de una petición (válido PERFILES_VALIDEZ s)"""
+    return _firmador_perfiles().dumps('perfilar')
+
+def _token_perfil_valido():
+    token = request.headers.get('X-Perfilar') or request.args.get('perfilar')
+    if not token:
+        return False
+    try:
+        return _firmador_perfiles().loads(token, max_age=app.config['PERFILES_VALIDEZ']) == 'perfilar'
+    except BadSignature:
+        return False
+
+def _terminar_perfil(codigo):
+    """Detiene el perfilador de la petición (si lo hay), lo guarda y devuelve su id"""
+    perfilador = g.pop('_perfilador', None)
+    if perfilador is None:
+        return None
+    perfilador.disable()
+    try:
+        return guardar_perfil(perfilador, g.pop('_perfil_sql', []), {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'endpoint': _endpoint_actual(),
+            'metodo': request.method,
+            'ruta': request.full_path.rstrip('?'),
+            'codigo': codigo,
+            'ms': round((time.perf_counter() - g._inicio_perfil) * 1000, 1),
+        }, maximo=app.config['PERFILES_MAX'])
+    except OSError as e:
+        logger.error(f"No se pudo guardar el perfil: {e}")
+        return None
+
+@app.before_request
+def _iniciar_medicion():
+    g._inicio_peticion = time.perf_counter()
+
+@app.before_request
+def _iniciar_perfil():
+    if request.endpoint in ('perfiles', 'descargar_perfil') or not _token_perfil_valido():
+        return
+    perfilador = cProfile.Profile()
+    try:
+        perfilador.enable()
+    except ValueError:
+        logger.warning("Ya hay un perfilador activo en este hilo; la petición no se perfila")
+        return
+    g._perfilador = perfilador
+    g._perfil_sql = []
+    g._inicio_perfil = time.perf_counter()
+
+@app.after_request
+def _anotar_codigo(response):
+    g._codigo = response.status_code
+    identificador = _terminar_perfil(response.status_code)
+    if identificador:
+        response.headers['X-Perfil'] = identificador
+        response.headers['X-Perfil-Url'] = url_for('descargar_perfil', identificador=identificador,
+                                                   extension='json')
+    return response
+
+@app.teardown_request
+def _registrar_peticion(error=None):
+    if error is not None:
+        _terminar_perfil(500)
+    inicio = g.pop('_inicio_peticion', None)
+    if inicio is None:
+        return
+    endpoint = _endpoint_actual()
+    codigo = 500 if error is not None else g.get('_codigo', 500)
+    registro_metricas.contar('byb_http_requests_total',
+                             {'endpoint': endpoint, 'metodo': request.method, 'codigo': str(codigo)})
+    registro_metricas.observar('byb_http_request_duration_seconds', {'endpoint': endpoint},
+                               time.perf_counter() - inicio)
+    if g.get('_sql_sentencias'):
+        registro_metricas.contar('byb_sql_queries_total', {'endpoint': endpoint}, g._sql_sentencias)
+        registro_metricas.contar('byb_sql_duration_seconds_total', {'endpoint': endpoint}, g._sql_segundos)
+
+# Sello de pedidos: sube después de confirmar cualquier escritura sobre pedidos
+# o lo que se deriva de ellos, venga de la unidad de trabajo, de sentencias
+# masivas o de SQL directo sobre la conexión (p. ej. _reconstruir_ganancias).
+# Se sube fuera de la transacción que escribe, así que las altas no esperan
+# unas a otras por el sello. En PostgreSQL es una secuencia (sin bloqueo de
+# fila); SQLite ya serializa las escrituras y usa su fila de VersionDatos.
+SELLO_PEDIDOS = 'pedidos'
+TABLAS_SELLO_PEDIDOS = {'pedido', 'item_pedido', 'comision_pedido', 'ganancia_diaria',
+                        'resumen_diario', 'trabajador'}
+SECUENCIA_PEDIDOS = db.Sequence('sello_pedidos', metadata=db.metadata)
+_sello_pendiente = threading.local()
+
+@event.listens_for(Engine, 'after_execute')
+def _detectar_escrituras_pedidos(conn, sentencia, parametros_multiples, parametros, opciones, resultado):
+    tabla = getattr(sentencia, 'table', None)
+    if getattr(sentencia, 'is_dml', False) and tabla is not None and tabla.name in TABLAS_SELLO_PEDIDOS:
+        conn.info['pedidos_modificados'] = True
+
+@event.listens_for(Engine, 'commit')
+def _confirmar_escrituras_pedidos(conn):
+    if conn.info.pop('pedidos_modificados', False):
+        _sello_pendiente.activo = True
+
+@event.listens_for(Engine, 'rollback')
+def _descartar_escrituras_pedidos(conn):
+    conn.info.pop('pedidos_modificados', None)
+
+def subir_sello_pedidos():
+    """Sube el sello de pedidos en una transacción propia y corta"""
+    with db.engine.begin() as conexion:
+        if conexion.dialect.supports_sequences:
+            conexion.execute(db.select(SECUENCIA_PEDIDOS.next_value()))
+        else:
+            conexion.execute(_insert_dialecto()(VersionDatos).values(
+                nombre=SELLO_PEDIDOS, version=0).on_conflict_do_nothing())
+            conexion.execute(db.update(VersionDatos).where(VersionDatos.nombre == SELLO_PEDIDOS)
+                             .values(version=VersionDatos.version + 1, actualizado_en=datetime.now()))
+
+def sellar_pedidos_pendiente():
+    """Sube el sello si este hilo confirmó escrituras sobre pedidos desde la última vez"""
+    if not getattr(_sello_pendiente, 'activo', False):
+        return
+    _sello_pendiente.activo = False
+    try:
+        subir_sello_pedidos()
+    except SQLAlchemyError as e:
+        # Los datos ya están confirmados: como mucho se sirve un 304 de más
+        logger.error(f"Could not bump orders stamp: {e}")
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _sellar_pedidos(sesion, transaccion):
+    # Aquí la sesión ya devolvió su conexión: el sello no ocupa una segunda del pool
+    if transaccion.parent is None:
+        sellar_pedidos_pendiente()
+
+def version_pedidos():
+    """Valor actual del sello de pedidos (lectura sin bloqueos)"""
+    if db.engine.dialect.supports_sequences:
+        ultimo, llamado = db.session.execute(
+            db.text(f'SELECT last_value, is_called FROM {SECUENCIA_PEDIDOS.name}')).one()
+        return ultimo + int(llamado)
+    return db.session.execute(
+        db.select(VersionDatos.version).where(VersionDatos.nombre == SELLO_PEDIDOS)).scalar() or 0
+
+def _version_plantillas():
+    """Huella y fecha de las plantillas: un despliegue nuevo invalida las páginas cacheadas"""
+    carpeta = os.path.join(app.root_path, app.template_folder)
+    huella, ultima = hashlib.sha1(), 0.0
+    for raiz, _, archivos in sorted(os.walk(carpeta)):
+        for nombre in sorted(archivos):
+            info = os.stat(os.path.join(raiz, nombre))
+            huella.update(f"{nombre}:{info.st_mtime_ns}:{info.st_size};".encode())
+            ultima = max(ultima, info.st_mtime)
+    return huella.hexdigest()[:12], datetime.fromtimestamp(ultima, timezone.utc)
+
+VERSION_PLANTILLAS, FECHA_PLANTILLAS = _version_plantillas()
+
+def _sello_respuesta(sellos):
+    """(etag, last_modified) de la URL actual según los sellos indicados
+
+    El sello de pedidos es un contador sin fecha: las páginas que dependen de
+    él sólo llevan ETag (last_modified es None).
+    """
+    filas = db.session.execute(
+        db.select(VersionDatos.nombre, VersionDatos.version, VersionDatos.actualizado_en)
+        .where(VersionDatos.nombre.in_([nombre for nombre in sellos if nombre != SELLO_PEDIDOS]))
+    ).all()
+    versiones = {fila.nombre: fila.version for fila in filas}
+    if SELLO_PEDIDOS in sellos:
+        versiones[SELLO_PEDIDOS] = version_pedidos()
+    hoy = date.today()
+    clave = '|'.join([request.full_path, hoy.isoformat(), VERSION_PLANTILLAS,
+                      *(f"{nombre}={versiones.get(nombre, 0)}" for nombre in sellos)])
+    etag = hashlib.sha1(clave.encode()).hexdigest()[:20]
+    if SELLO_PEDIDOS in sellos:
+        return etag, None
+    # Las páginas con "hoy" cambian a medianoche aunque no cambien los datos
+    fechas = [datetime.combine(hoy, datetime.min.time()).astimezone(timezone.utc), FECHA_PLANTILLAS]
+    fechas += [fila.actualizado_en.astimezone(timezone.utc) for fila in filas if fila.actualizado_en]
+    return etag, max(fechas).replace(microsecond=0)
+
+def condicional(*sellos):
+    """Decorador de vistas GET: 304 antes de tocar plantillas o consultas si nada cambió
+
+    `sellos` son los nombres de VersionDatos (o SELLO_PEDIDOS) de los que
+    depende la página. El ETag (débil, para que valga con y sin compresión) y,
+    si se puede fechar, Last-Modified salen de la lectura de esos sellos.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(*args, **kwargs):
+            # Un mensaje flash pendiente cambia la página sin cambiar los datos
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return vista(*args, **kwargs)
+            etag, modificado = _sello_respuesta(sellos)
+            if is_resource_modified(request.environ, etag, last_modified=modificado):
+                respuesta = app.make_response(vista(*args, **kwargs))
+                if respuesta.status_code != 200:
+                    return respuesta
+            else:
+                respuesta = Response(status=304)
+            respuesta.set_etag(etag, weak=True)
+            if modificado is not None:
+                respuesta.last_modified = modificado
+            respuesta.cache_control.no_cache = True
+            return respuesta
+        return envoltura
+    return decorador
+
+# Compresión de respuestas
+TIPOS_COMPRIMIBLES = {'text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                      'application/javascript', 'application/x-ndjson'}
+BROTLI_CALIDAD = 5
+
+def _codificacion_aceptada():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+@app.after_request
+def _comprimir(respuesta):
+    """gzip (o brotli si está instalado) para respuestas de texto por encima de COMPRESION_MINIMO"""
+    if respuesta.mimetype not in TIPOS_COMPRIMIBLES:
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    # Las respuestas en streaming (exportaciones, SSE) se dejan tal cual
+    if (respuesta.status_code != 200 or respuesta.direct_passthrough or respuesta.is_streamed
+            or 'Content-Encoding' in respuesta.headers or request.method == 'HEAD'):
+        return respuesta
+    codificacion = _codificacion_aceptada()
+    if codificacion is None:
+        return respuesta
+    cuerpo = respuesta.get_data()
+    if len(cuerpo) < app.config['COMPRESION_MINIMO']:
+        return respuesta
+    if codificacion == 'br':
+        respuesta.set_data(brotli.compress(cuerpo, quality=BROTLI_CALIDAD))
+    else:
+        respuesta.set_data(gzip.compress(cuerpo, compresslevel=app.config['COMPRESION_NIVEL'], mtime=0))
+    respuesta.headers['Content-Encoding'] = codificacion
+    # Otra codificación es otra representación: el ETag fuerte ya no vale
+    etag, debil = respuesta.get_etag()
+    if etag and not debil:
+        respuesta.set_etag(etag, weak=True)
+    return respuesta
 
 # Rutas
 @app.route('/')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
 def index():
     try:
         # Obtener estadísticas para el dashboard
-        pedidos_hoy = Pedido.query.filter(
-            Pedido.fecha_pedido == date.today(),
-            Pedido.estado == 'COMPLETADO'
-        ).count()
-        
-        total_hoy = sum(p.total for p in Pedido.query.filter(
-            Pedido.fecha_pedido == date.today(),
-            Pedido.estado == 'COMPLETADO'
-        ).all()) or 0
-        
-        pedidos_pendientes = Pedido.query.filter_by(estado='PENDIENTE').count()
-        trabajadores_activos = Trabajador.query.filter_by(activo=True).count()
-        
+        estadisticas = obtener_estadisticas()
         return render_template('index.html',
-                             pedidos_hoy=pedidos_hoy,
-                             total_hoy=total_hoy,
-                             pedidos_pendientes=pedidos_pendientes,
-                             trabajadores_activos=trabajadores_activos)
+                             sse_activo=app.config['ESTADISTICAS_SSE'],
+                             **estadisticas)
     except Exception as e:
         # En caso de error, mostrar dashboard básico
         logger.error(f"Error en dashboard: {e}")
+        db.session.rollback()
         return render_template('index.html',
                              pedidos_hoy=0,
                              total_hoy=0,
@@ -320,84 +2425,112 @@ def index():
 
 @app.route('/api/estadisticas')
 def api_estadisticas():
-    pedidos_hoy = Pedido.query.filter(
-        Pedido.fecha_pedido == date.today(),
-        Pedido.estado == 'COMPLETADO'
-    ).count()
-    
-    total_hoy = sum(p.total for p in Pedido.query.filter(
-        Pedido.fecha_pedido == date.today(),
-        Pedido.estado == 'COMPLETADO'
-    ).all()) or 0
-    
-    pedidos_pendientes = Pedido.query.filter_by(estado='PENDIENTE').count()
-    trabajadores_activos = Trabajador.query.filter_by(activo=True).count()
-    
-    return jsonify({
-        'pedidos_hoy': pedidos_hoy,
-        'total_hoy': total_hoy,
-        'pedidos_pendientes': pedidos_pendientes,
-        'trabajadores_activos': trabajadores_activos
-    })
+    version, datos = difusor_estadisticas.actual()
+    if request.if_none_match.contains_weak(version):
+        respuesta = Response(status=304)
+    else:
+        respuesta = jsonify(datos)
+    respuesta.set_etag(version)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+@app.route('/api/estadisticas/stream')
+def api_estadisticas_stream():
+    """Server-Sent Events: envía las estadísticas sólo cuando cambian
+
+    La conexión se cierra tras ESTADISTICAS_SSE_DURACION segundos para no
+    retener el worker; EventSource reconecta solo y manda Last-Event-ID.
+    """
+    version_cliente = request.headers.get('Last-Event-ID')
+    duracion = app.config['ESTADISTICAS_SSE_DURACION']
+
+    def generar():
+        version = version_cliente
+        limite = time.monotonic() + duracion
+        yield "retry: 2000\n\n"
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            nueva, datos = difusor_estadisticas.esperar(version, timeout=min(15, restante))
+            if nueva is not None and nueva != version:
+                version = nueva
+                yield f"id: {version}\nevent: estadisticas\ndata: {json.dumps(datos)}\n\n"
+            else:
+                # Comentario SSE para mantener viva la conexión a través de proxies
+                yield ": ping\n\n"
+
+    return Response(generar(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/pedidos')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
 def pedidos():
-    pedidos = Pedido.query.order_by(Pedido.numero_orden.desc()).all()
-    trabajadores = Trabajador.query.filter_by(activo=True).all()
-    productos = Producto.query.filter_by(activo=True).all()
-    return render_template('pedidos.html', pedidos=pedidos, trabajadores=trabajadores, productos=productos)
+    antes, limite = _leer_pagina(request.args)
+    try:
+        filtros = _leer_filtros_pedidos(request.args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        filtros = {}
+    pedidos, siguiente = consultar_pedidos(filtros, antes, limite)
+    # El enlace a la página siguiente conserva un tamaño de página no estándar
+    return render_template('pedidos.html', pedidos=pedidos, filtros=filtros,
+                           siguiente=siguiente, pagina_inicial=antes is None,
+                           limite=limite if limite != PEDIDOS_POR_PAGINA else None,
+                           trabajadores=trabajadores_activos(), productos=productos_activos())
+
+@app.route('/api/pedidos')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
+def api_pedidos():
+    antes, limite = _leer_pagina(request.args)
+    try:
+        filtros = _leer_filtros_pedidos(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    pedidos, siguiente = consultar_pedidos(filtros, antes, limite)
+    return jsonify({
+        'pedidos': [serializar_pedido(p) for p in pedidos],
+        'siguiente': siguiente
+    })
+
+@app.route('/api/pedidos/<int:pedido_id>')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
+def api_pedido_detalle(pedido_id):
+    pedidos = consultar_detalles([pedido_id])
+    if not pedidos:
+        return jsonify({'error': 'Pedido no encontrado'}), 404
+    return jsonify(serializar_detalle(pedidos[0]))
+
+@app.route('/api/pedidos/detalle')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
+def api_pedidos_detalle():
+    """Detalle de varios pedidos en una sola petición: ?ids=1,2,3"""
+    try:
+        ids = [int(x) for x in request.args.get('ids', '').split(',') if x.strip()]
+    except ValueError:
+        return jsonify({'error': 'ids debe ser una lista de enteros separados por comas'}), 400
+    if len(ids) > PEDIDOS_POR_PAGINA_MAX:
+        return jsonify({'error': f'Máximo {PEDIDOS_POR_PAGINA_MAX} pedidos por petición'}), 400
+    pedidos = consultar_detalles(ids) if ids else []
+    return jsonify({'pedidos': [serializar_detalle(p) for p in pedidos]})
 
 @app.route('/crear_pedido', methods=['POST'])
 def crear_pedido():
     try:
-        # Obtener el siguiente número de orden
-        ultimo_pedido = Pedido.query.order_by(Pedido.numero_orden.desc()).first()
-        numero_orden = (ultimo_pedido.numero_orden + 1) if ultimo_pedido else 1
-        
-        # Crear el pedido
-        pedido = Pedido(
-            numero_orden=numero_orden,
-            fecha_entrega=datetime.strptime(request.form['fecha_entrega'], '%Y-%m-%d').date(),
-            horario_entrega=request.form.get('horario_entrega'),
-            cliente_nombre=request.form['cliente_nombre'],
-            cliente_telefono=request.form.get('cliente_telefono'),
-            cliente_direccion=request.form['cliente_direccion'],
-            vendedor_id=request.form.get('vendedor_id') or None,
-            mensajero_id=request.form.get('mensajero_id') or None,
-            elaborador_id=request.form.get('elaborador_id') or None,
-            mensajeria=int(request.form.get('mensajeria', 0)),
-            observaciones=request.form.get('observaciones'),
-            subtotal=0,
-            total=0
-        )
-        
-        db.session.add(pedido)
-        db.session.flush()  # Para obtener el ID
-        
-        # Procesar productos
         productos_ids = request.form.getlist('productos[]')
         cantidades = request.form.getlist('cantidades[]')
-        precios = request.form.getlist('precios[]')
-        
-        subtotal = 0
-        for i, producto_id in enumerate(productos_ids):
-            if producto_id:
-                cantidad = int(cantidades[i]) if cantidades[i] else 1
-                precio_unitario = int(precios[i]) if precios[i] else 0
-                
-                item = ItemPedido(
-                    pedido_id=pedido.id,
-                    producto_id=int(producto_id),
-                    cantidad=cantidad,
-                    precio_unitario=precio_unitario // cantidad if cantidad > 0 else 0
-                )
-                db.session.add(item)
-                subtotal += precio_unitario
-        
-        pedido.subtotal = subtotal
-        pedido.total = subtotal + pedido.mensajeria
-        
+        datos = {campo: request.form.get(campo) for campo in (
+            'fecha_entrega', 'horario_entrega', 'cliente_nombre', 'cliente_telefono',
+            'cliente_direccion', 'vendedor_id', 'mensajero_id', 'elaborador_id',
+            'mensajeria', 'observaciones')}
+        # Los precios se calculan en el servidor a partir del producto
+        datos['items'] = [
+            {'producto_id': producto_id, 'cantidad': cantidades[i] if i < len(cantidades) else 1}
+            for i, producto_id in enumerate(productos_ids) if producto_id
+        ]
+        crear_pedido_con_items(datos)
         db.session.commit()
+        difusor_estadisticas.publicar()
         flash('Pedido creado exitosamente', 'success')
         
     except Exception as e:
@@ -406,26 +2539,123 @@ def crear_pedido():
     
     return redirect(url_for('pedidos'))
 
+@app.route('/api/pedidos', methods=['POST'])
+def api_crear_pedido():
+    """Crea un pedido desde JSON: {cliente_nombre, ..., items: [{producto_id, cantidad}]}"""
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict):
+        return jsonify({'error': 'Se esperaba un objeto JSON'}), 400
+    try:
+        pedido, items = crear_pedido_con_items(datos)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    # Serializar antes de confirmar: tras el commit el pedido caduca y se releería
+    respuesta = serializar_pedido(pedido)
+    respuesta['items'] = [{campo: item[campo] for campo in (
+        'producto_id', 'cantidad', 'precio_unitario', 'incluye_bolsa_regalo', 'precio_bolsa'
+    )} for item in items]
+    db.session.commit()
+    difusor_estadisticas.publicar()
+    return jsonify(respuesta), 201
+
+@app.route('/importar_pedidos', methods=['POST'])
+def importar_pedidos_upload():
+    """Sube un archivo CSV/JSONL (campo `archivo`) y devuelve el resultado por pedido"""
+    archivo = request.files.get('archivo')
+    if archivo is None or not archivo.filename:
+        return jsonify({'error': 'Falta el archivo'}), 400
+    try:
+        formato = _formato_de(archivo.filename, request.form.get('formato'))
+        lineas = io.TextIOWrapper(archivo.stream, encoding='utf-8', newline='')
+        resultados = importar_pedidos(lineas, formato)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    correctos = sum(1 for r in resultados if r['ok'])
+    respuesta = {
+        'importados': correctos,
+        'errores': len(resultados) - correctos,
+        'resultados': resultados
+    }
+    # Lo anterior ya está guardado: volver a subir el archivo entero lo duplicaría
+    interrumpido = next((r for r in resultados if r.get('interrumpido')), None)
+    if interrumpido:
+        respuesta['error'] = (f"Lectura interrumpida en la línea {interrumpido['linea']}: "
+                              f"sólo se importaron las líneas anteriores")
+    return jsonify(respuesta)
+
+@app.route('/export/<tabla>')
+def exportar(tabla):
+    """Exporta pedidos, items o comisiones de un rango de fecha_pedido (`formato=csv|ndjson`)
+
+    Sin `desde` ni `hasta` se exporta todo el historial.
+    """
+    if tabla not in EXPORTACIONES:
+        return jsonify({'error': f"No se puede exportar {tabla}"}), 404
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({'error': "formato debe ser csv o ndjson"}), 400
+    desde = hasta = None
+    if request.args.get('desde') or request.args.get('hasta'):
+        try:
+            desde, hasta = _leer_rango({'desde': request.args.get('desde') or '1970-01-01',
+                                        'hasta': request.args.get('hasta')})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    nombre = tabla
+    if desde:
+        nombre += f"_{desde.isoformat()}_{hasta.isoformat()}"
+    return Response(
+        stream_with_context(exportar_filas(EXPORTACIONES[tabla](), formato, desde, hasta)),
+        mimetype='text/csv' if formato == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{nombre}.{formato}"'}
+    )
+
 @app.route('/completar_pedido/<int:pedido_id>')
 def completar_pedido(pedido_id):
     pedido = Pedido.query.get_or_404(pedido_id)
     if pedido.estado != 'COMPLETADO':
+        if pedido.estado == 'PENDIENTE':
+            acumular_resumen(date.today(), pedidos_pendientes=-1)
+        acumular_resumen(pedido.fecha_pedido, pedidos_completados=1, total_facturado=pedido.total)
         pedido.estado = 'COMPLETADO'
-        db.session.commit()
         
         # Calcular comisiones
-        calcular_comisiones_pedido(pedido)
+        _comisiones_trozo([pedido.id], obtener_configuracion(), inversores_activos())
         
-        # Enviar reporte por WhatsApp
+        # El reporte por WhatsApp se encola en la misma transacción
         admin_phone = os.environ.get('ADMIN_PHONE')
         if admin_phone:
-            mensaje = generar_reporte_pedido(pedido)
-            enviar_whatsapp(admin_phone, mensaje)
+            encolar_whatsapp(admin_phone, generar_reporte_pedido(pedido))
         
-        flash('Pedido completado y reporte enviado por WhatsApp', 'success')
+        db.session.commit()
+        difusor_estadisticas.publicar()
+        enviador_notificaciones.despertar()
+        flash('Pedido completado; el reporte se enviará por WhatsApp', 'success')
     
     return redirect(url_for('pedidos'))
 
+@app.route('/completar_pedidos', methods=['POST'])
+def completar_pedidos_seleccionados():
+    try:
+        ids = [int(x) for x in request.form.getlist('pedido_ids[]')]
+        completados = completar_pedidos(ids, notificar_a=os.environ.get('ADMIN_PHONE'))
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al completar pedidos: {str(e)}', 'error')
+        return redirect(url_for('pedidos'))
+
+    if completados:
+        difusor_estadisticas.publicar()
+        enviador_notificaciones.despertar()
+        flash(f'{len(completados)} pedidos completados', 'success')
+    else:
+        flash('No se seleccionó ningún pedido pendiente', 'warning')
+    return redirect(url_for('pedidos'))
+
 @app.route('/reporte_diario')
 def reporte_diario():
     mensaje = generar_reporte_diario()
@@ -433,7 +2663,9 @@ def reporte_diario():
     # Enviar por WhatsApp
     admin_phone = os.environ.get('ADMIN_PHONE')
     if admin_phone:
-        enviar_whatsapp(admin_phone, mensaje)
+        encolar_whatsapp(admin_phone, mensaje)
+        db.session.commit()
+        enviador_notificaciones.despertar()
         flash('Reporte diario enviado por WhatsApp', 'success')
     else:
         flash('Número de administrador no configurado', 'warning')
@@ -441,9 +2673,96 @@ def reporte_diario():
     return redirect(url_for('index'))
 
 @app.route('/trabajadores')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
 def trabajadores():
-    trabajadores = Trabajador.query.filter_by(activo=True).all()
-    return render_template('trabajadores.html', trabajadores=trabajadores)
+    # total_ganado cambia con cada comisión: se lee aparte, no de la cache
+    totales = dict(db.session.execute(
+        db.select(Trabajador.id, Trabajador.total_ganado).where(Trabajador.activo == True)
+    ).all())
+    return render_template('trabajadores.html', trabajadores=trabajadores_activos(), totales=totales)
+
+def _leer_rango(args):
+    """Lee `desde` y `hasta` (AAAA-MM-DD); por defecto, la semana en curso"""
+    hoy = date.today()
+    try:
+        desde = datetime.strptime(args['desde'], '%Y-%m-%d').date() if args.get('desde') \
+            else hoy - timedelta(days=hoy.weekday())
+        hasta = datetime.strptime(args['hasta'], '%Y-%m-%d').date() if args.get('hasta') else hoy
+    except ValueError:
+        raise ValueError("Las fechas deben tener el formato AAAA-MM-DD")
+    if desde > hasta:
+        raise ValueError("desde no puede ser posterior a hasta")
+    return desde, hasta
+
+REPORTES_PERIODO = {
+    'semana': 'REPORTE SEMANAL',
+    'mes': 'REPORTE MENSUAL',
+}
+
+@app.route('/reporte')
+def reporte():
+    """Reporte de un periodo (`periodo=semana|mes` o `desde`/`hasta`) como texto; `enviar=1` lo manda por WhatsApp"""
+    hoy = date.today()
+    periodo = request.args.get('periodo')
+    if periodo == 'mes' and not request.args.get('desde'):
+        desde, hasta = hoy.replace(day=1), hoy
+    elif periodo in (None, 'semana') or request.args.get('desde'):
+        try:
+            desde, hasta = _leer_rango(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        return jsonify({'error': f"periodo desconocido: {periodo}"}), 400
+    mensaje = generar_reporte_periodo(desde, hasta, REPORTES_PERIODO.get(periodo, 'REPORTE'))
+    
+    if request.args.get('enviar') == '1':
+        admin_phone = os.environ.get('ADMIN_PHONE')
+        if not admin_phone:
+            return jsonify({'error': 'Número de administrador no configurado'}), 400
+        encolar_whatsapp(admin_phone, mensaje)
+        db.session.commit()
+        enviador_notificaciones.despertar()
+    return Response(mensaje, mimetype='text/plain')
+
+@app.route('/api/ganancias')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
+def api_ganancias():
+    """Ganancias de cada trabajador en el rango, desde el libro diario"""
+    try:
+        desde, hasta = _leer_rango(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    ganancias = ganancias_por_trabajador(desde, hasta)
+    return jsonify({
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'trabajadores': [
+            {'id': t.id, 'nombre': t.nombre, 'tipo': t.tipo,
+             'monto': ganancias[t.id][0], 'comisiones': ganancias[t.id][1]}
+            for t in trabajadores_activos() if t.id in ganancias
+        ]
+    })
+
+@app.route('/api/trabajadores/<int:trabajador_id>/estado_cuenta')
+@condicional(SELLO_PEDIDOS, CacheReferencia.NOMBRE)
+def api_estado_cuenta(trabajador_id):
+    """Estado de cuenta diario de un trabajador en el rango, desde el libro diario"""
+    try:
+        desde, hasta = _leer_rango(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    trabajador = db.session.get(Trabajador, trabajador_id)
+    if trabajador is None:
+        return jsonify({'error': 'Trabajador no encontrado'}), 404
+    dias = estado_cuenta(trabajador_id, desde, hasta)
+    return jsonify({
+        'trabajador': _serializar_trabajador(trabajador),
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'total': sum(d['monto'] for d in dias),
+        'total_ganado': trabajador.total_ganado or 0,
+        'dias': dias
+    })
 
 @app.route('/crear_trabajador', methods=['POST'])
 def crear_trabajador():
@@ -453,8 +2772,11 @@ def crear_trabajador():
             tipo=request.form['tipo'],
             telefono=request.form.get('telefono')
         )
+        acumular_resumen(date.today(), trabajadores_activos=1)
         db.session.add(trabajador)
+        cache_referencia.invalidar()
         db.session.commit()
+        difusor_estadisticas.publicar()
         flash('Trabajador creado exitosamente', 'success')
     except Exception as e:
         db.session.rollback()
@@ -463,9 +2785,9 @@ def crear_trabajador():
     return redirect(url_for('trabajadores'))
 
 @app.route('/productos')
+@condicional(CacheReferencia.NOMBRE)
 def productos():
-    productos = Producto.query.filter_by(activo=True).all()
-    return render_template('productos.html', productos=productos)
+    return render_template('productos.html', productos=productos_activos())
 
 @app.route('/crear_producto', methods=['POST'])
 def crear_producto():
@@ -479,6 +2801,7 @@ def crear_producto():
             stock=int(request.form.get('stock', 0))
         )
         db.session.add(producto)
+        cache_referencia.invalidar()
         db.session.commit()
         flash('Producto creado exitosamente', 'success')
     except Exception as e:
@@ -509,6 +2832,7 @@ def actualizar_configuracion():
         config.precio_bolsa_regalo = int(request.form['precio_bolsa_regalo'])
         
         db.session.add(config)
+        cache_referencia.invalidar()
         db.session.commit()
         flash('Configuración actualizada exitosamente', 'success')
     except Exception as e:
@@ -517,6 +2841,42 @@ def actualizar_configuracion():
     
     return redirect(url_for('configuracion'))
 
+@app.route('/api/cache')
+def api_cache():
+    """Contadores de aciertos/fallos de las caches de este worker"""
+    return jsonify({**cache_referencia.estadisticas(), 'reportes': cache_reportes.estadisticas()})
+
+@app.route('/metrics')
+def metrics():
+    """Métricas de todos los workers en formato de exposición de Prometheus"""
+    return Response(registro_metricas.exponer(), mimetype='text/plain; version=0.0.4')
+
+SQL_LENTO_POR_PAGINA = 50
+SQL_LENTO_POR_PAGINA_MAX = 1000
+
+@app.route('/perfiles')
+def perfiles():
+    """Perfiles guardados y últimas consultas lentas; exige el token de perfilado"""
+    if not _token_perfil_valido():
+        abort(403)
+    limite = request.args.get('limite', SQL_LENTO_POR_PAGINA, type=int)
+    return jsonify({
+        'perfiles': [{'id': identificador,
+                      'json': url_for('descargar_perfil', identificador=identificador, extension='json'),
+                      'prof': url_for('descargar_perfil', identificador=identificador, extension='prof')}
+                     for identificador in listar_perfiles()],
+        'sql_lento': registro_sql_lento.leer(max(1, min(limite, SQL_LENTO_POR_PAGINA_MAX))),
+    })
+
+@app.route('/perfiles/<identificador>.<extension>')
+def descargar_perfil(identificador, extension):
+    """Descarga un perfil: .json (resumen y SQL) o .prof (para pstats/snakeviz)"""
+    if not _token_perfil_valido():
+        abort(403)
+    if extension not in ('json', 'prof'):
+        abort(404)
+    return send_from_directory(DIRECTORIO_PERFILES, f'{identificador}.{extension}', as_attachment=True)
+
 # Ruta de healthcheck para Railway
 @app.route('/health')
 def health_check():
@@ -543,6 +2903,9 @@ def init_db():
         db.create_all()
         logger.info("Tables created successfully")
         
+        # Cambios de esquema sobre tablas ya existentes
+        aplicar_migraciones()
+        
         # Verificar si ya hay datos
         if Trabajador.query.first():
             logger.info("Database already has data")
@@ -593,16 +2956,59 @@ def init_db():
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
         db.session.rollback()
+        raise
 
-# Función para crear tablas al iniciar
-@app.before_first_request
-def create_tables():
-    """Crea las tablas antes de la primera petición"""
-    try:
-        with app.app_context():
-            init_db()
-    except Exception as e:
-        logger.error(f"Error in create_tables: {e}")
+# Inicialización explícita antes de arrancar (gunicorn la lanza en on_starting)
+@app.cli.command('inicializar')
+def inicializar_command():
+    """Crea las tablas, aplica migraciones y siembra los datos de ejemplo"""
+    inicio = time.perf_counter()
+    init_db()
+    print(f"✅ Base de datos inicializada en {time.perf_counter() - inicio:.2f} s")
+
+@app.cli.command('token-perfil')
+def token_perfil_command():
+    """Imprime un token para perfilar peticiones y descargar los perfiles"""
+    token = token_perfil()
+    print(token)
+    print(f"Uso: curl -H 'X-Perfilar: {token}' .../pedidos  (o ?perfilar=<token>); "
+          f"válido {app.config['PERFILES_VALIDEZ']} s")
+
+PLANTILLAS_CALIENTES = ['index.html', 'pedidos.html']
+
+def calentar():
+    """Prepara un worker recién creado antes de que reciba tráfico
+
+    Abre las conexiones del pool, compila las plantillas más usadas y carga las
+    caches de referencia. Devuelve los segundos de cada paso.
+    """
+    tiempos = {}
+    with app.app_context():
+        inicio = time.perf_counter()
+        conexiones = []
+        try:
+            for _ in range(PERFIL_CONCURRENCIA['pool_size']):
+                conexiones.append(db.engine.connect())
+                conexiones[-1].execute(db.text('SELECT 1'))
+        finally:
+            for conexion in conexiones:
+                conexion.close()
+        tiempos['pool'] = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for plantilla in PLANTILLAS_CALIENTES:
+            app.jinja_env.get_template(plantilla)
+        tiempos['plantillas'] = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        trabajadores_activos()
+        productos_activos()
+        inversores_activos()
+        obtener_configuracion()
+        obtener_estadisticas()
+        db.session.remove()
+        tiempos['caches'] = time.perf_counter() - inicio
+    return tiempos
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -611,4 +3017,7 @@ if __name__ == '__main__':
     logger.info(f"Starting server on port {port}")
     logger.info(f"Debug mode: {debug_mode}")
     
+    with app.app_context():
+        init_db()
+    
     app.run(host='0.0.0.0', port=port, debug=debug_mode)
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 """
 Script de backup para Chocolates ByB
-Genera un backup de la base de datos en formato JSON
+Genera un backup de la base de datos en formato JSON, o en modo streaming
+como un directorio con un NDJSON comprimido por tabla y un manifest.json.
+Los backups incrementales guardan sólo los pedidos nuevos o cambiados desde
+el backup anterior; restaurar uno reproduce toda la cadena desde el completo.
 """
 
+import csv
+import gzip
+import hashlib
+import io
 import json
 import os
-from datetime import datetime
-from app import app, db, Pedido, Trabajador, Producto, ItemPedido, ComisionPedido, ConfiguracionComisiones
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, timedelta
+from app import app, db, Pedido, Trabajador, Producto, ItemPedido, ComisionPedido, ConfiguracionComisiones, cache_referencia, cache_reportes, sincronizar_contador_pedidos, _reconstruir_ganancias, reconciliar_resumen, _insert_dialecto, _valor_json
 
 def backup_database():
     """Genera un backup completo de la base de datos"""
@@ -126,121 +135,507 @@ def backup_database():
         
         return filepath
 
-def restore_database(backup_file):
-    """Restaura la base de datos desde un archivo de backup"""
+# Backup en streaming: una tabla por archivo, leída por trozos
+# Orden de restauración: las tablas referenciadas van primero
+TABLAS = [Trabajador, Producto, ConfiguracionComisiones, Pedido, ItemPedido, ComisionPedido]
+LOTE = 5000
+VERSION_STREAMING = '2.0'
+
+# Pedidos, items y comisiones viajan juntos: un incremental trae cada pedido
+# cambiado con todos sus items y comisiones. El resto se copia entero (es pequeño).
+TABLAS_POR_PEDIDO = (Pedido, ItemPedido, ComisionPedido)
+# Solape con el backup anterior para no perder transacciones que confirmaron tarde
+MARGEN_INCREMENTAL = timedelta(minutes=10)
+
+def volcar_tabla(modelo, ruta, condicion=None):
+    """Escribe la tabla en `ruta` (NDJSON gzip) sin cargarla entera; devuelve (filas, sha256)
+
+    El checksum es del contenido sin comprimir, así no depende del nivel de gzip.
+    """
+    tabla = modelo.__table__
+    columnas = [c.name for c in tabla.columns]
+    consulta = db.select(tabla).order_by(*tabla.primary_key.columns)
+    if condicion is not None:
+        consulta = consulta.where(condicion)
+    resultado = db.session.execute(consulta.execution_options(yield_per=LOTE))
+    suma = hashlib.sha256()
+    filas = 0
+    with gzip.open(ruta, 'wb', compresslevel=6) as archivo:
+        for trozo in resultado.partitions():
+            bloque = ''.join(
+                json.dumps(dict(zip(columnas, fila)), ensure_ascii=False, default=_valor_json) + '\n'
+                for fila in trozo
+            ).encode('utf-8')
+            suma.update(bloque)
+            archivo.write(bloque)
+            filas += len(trozo)
+    return filas, suma.hexdigest()
+
+def leer_manifest(directorio):
+    with open(os.path.join(directorio, 'manifest.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+def ultimo_backup(carpeta='backup'):
+    """Directorio del backup en streaming más reciente, o None"""
+    if not os.path.isdir(carpeta):
+        return None
+    candidatos = sorted(
+        nombre for nombre in os.listdir(carpeta)
+        if os.path.exists(os.path.join(carpeta, nombre, 'manifest.json'))
+    )
+    return os.path.join(carpeta, candidatos[-1]) if candidatos else None
+
+def _marcas():
+    """Marcas de agua actuales: hora de inicio y máximo id de cada tabla"""
+    return {
+        'actualizado_en': datetime.now().isoformat(),
+        'ids': {
+            modelo.__tablename__: db.session.execute(
+                db.select(db.func.coalesce(db.func.max(modelo.id), 0))
+            ).scalar()
+            for modelo in TABLAS
+        }
+    }
+
+def _condiciones_incrementales(marcas):
+    """Filtro por tabla para traer sólo los pedidos nuevos o cambiados desde `marcas`"""
+    desde = datetime.fromisoformat(marcas['actualizado_en']) - MARGEN_INCREMENTAL
+    cambiados = db.select(Pedido.id).where(db.or_(
+        Pedido.actualizado_en >= desde,
+        Pedido.id > marcas['ids'][Pedido.__tablename__]
+    ))
+    return {
+        Pedido: Pedido.id.in_(cambiados),
+        ItemPedido: ItemPedido.pedido_id.in_(cambiados),
+        ComisionPedido: ComisionPedido.pedido_id.in_(cambiados),
+    }
+
+# Volcado en paralelo: un proceso por tabla, todos sobre la misma instantánea
+MODELOS = {modelo.__tablename__: modelo for modelo in TABLAS}
+# Tablas fuera del backup con claves foráneas hacia él (p. ej. el libro de
+# ganancias): se vacían antes de la carga y se rehacen en _despues_de_restaurar
+TABLAS_DEPENDIENTES = [
+    tabla for tabla in reversed(db.metadata.sorted_tables)
+    if tabla not in {modelo.__table__ for modelo in TABLAS}
+    and any(fk.column.table in {modelo.__table__ for modelo in TABLAS} for fk in tabla.foreign_keys)
+]
+# Las tablas grandes primero, para que no queden solas al final
+ORDEN_VOLCADO = ['comision_pedido', 'item_pedido', 'pedido', 'trabajador', 'producto', 'configuracion_comisiones']
+
+def _es_postgresql():
+    return db.session.connection().dialect.name == 'postgresql'
+
+def _abrir_instantanea():
+    """Transacción REPEATABLE READ en la sesión; en PostgreSQL exporta su instantánea"""
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+    return db.session.execute(db.text('SELECT pg_export_snapshot()')).scalar()
+
+def _volcar_en_proceso(tarea):
+    """Vuelca una tabla desde un proceso del pool; devuelve (tabla, filas, sha256)"""
+    nombre, directorio, instantanea, marcas = tarea
+    modelo = MODELOS[nombre]
+    with app.app_context():
+        # Las conexiones heredadas del proceso padre no se pueden compartir
+        db.engine.dispose(close=False)
+        if instantanea:
+            db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+            db.session.execute(db.text(f"SET TRANSACTION SNAPSHOT '{instantanea}'"))
+        condicion = _condiciones_incrementales(marcas).get(modelo) if marcas else None
+        filas, sha256 = volcar_tabla(modelo, os.path.join(directorio, f'{nombre}.ndjson.gz'), condicion)
+        db.session.rollback()
+    return nombre, filas, sha256
+
+def _procesos_por_defecto():
+    # En SQLite los procesos no pueden compartir instantánea: se vuelca en uno solo
+    if db.engine.dialect.name != 'postgresql':
+        return 1
+    return max(1, min(len(TABLAS), os.cpu_count() or 1))
+
+def backup_streaming(incremental=False, base=None, procesos=None):
+    """Genera un backup con memoria constante, sea cual sea el tamaño de la base
+
+    Con `incremental`, sólo guarda lo cambiado desde `base` (por defecto, el
+    backup más reciente); si no hay ninguno previo, hace uno completo. Con
+    más de un proceso, cada tabla se vuelca en paralelo desde la instantánea
+    exportada por este proceso (PostgreSQL).
+    """
+    with app.app_context():
+        marcas_base = None
+        if incremental:
+            base = base or ultimo_backup()
+            if base is None:
+                print("ℹ️  No hay backup previo: se hace uno completo")
+                incremental = False
+            elif 'marcas' not in leer_manifest(base):
+                print(f"ℹ️  {base} no tiene marcas de agua: se hace un backup completo")
+                incremental = False
+            else:
+                marcas_base = leer_manifest(base)['marcas']
+        procesos = procesos or _procesos_por_defecto()
+        
+        # Con microsegundos: un incremental lanzado en el mismo segundo que su
+        # base no debe escribir en el directorio de ésta
+        fecha_str = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        directorio = os.path.join('backup', f'backup_chocolates_byb_{fecha_str}')
+        os.makedirs(directorio, exist_ok=False)
+        
+        inicio = time.perf_counter()
+        instantanea = _abrir_instantanea()
+        if procesos > 1 and instantanea is None:
+            print("⚠️  Sin instantánea compartida (SQLite): las tablas pueden no ser coherentes entre sí")
+        manifest = {
+            'fecha_backup': datetime.now().isoformat(),
+            'version': VERSION_STREAMING,
+            'tipo': 'incremental' if incremental else 'completo',
+            'marcas': _marcas(),
+            'tablas': {}
+        }
+        if incremental:
+            manifest['base'] = os.path.basename(os.path.normpath(base))
+        
+        tareas = [(nombre, directorio, instantanea, marcas_base) for nombre in ORDEN_VOLCADO]
+        if procesos > 1:
+            # La transacción de la instantánea sigue abierta hasta que terminan todos
+            with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+                resultados = list(ejecutor.map(_volcar_en_proceso, tareas))
+        else:
+            condiciones = _condiciones_incrementales(marcas_base) if marcas_base else {}
+            resultados = [
+                (nombre,) + volcar_tabla(MODELOS[nombre], os.path.join(directorio, f'{nombre}.ndjson.gz'),
+                                         condiciones.get(MODELOS[nombre]))
+                for nombre in ORDEN_VOLCADO
+            ]
+        db.session.rollback()
+        
+        por_tabla = {nombre: (filas, sha256) for nombre, filas, sha256 in resultados}
+        for modelo in TABLAS:
+            nombre = modelo.__tablename__
+            filas, sha256 = por_tabla[nombre]
+            manifest['tablas'][nombre] = {'archivo': f'{nombre}.ndjson.gz', 'filas': filas, 'sha256': sha256}
+        
+        with open(os.path.join(directorio, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        
+        print(f"✅ Backup {manifest['tipo']} creado exitosamente: {directorio} "
+              f"({procesos} procesos, {time.perf_counter() - inicio:.1f} s)")
+        if incremental:
+            print(f"   Base: {manifest['base']}")
+        print(f"📊 Estadísticas del backup:")
+        for nombre, entrada in manifest['tablas'].items():
+            print(f"   - {nombre}: {entrada['filas']}")
+        
+        return directorio
+
+# Verificación: recalcula filas y checksums sin tocar la base de datos
+def _verificar_archivo(tarea):
+    """(tabla, ok, detalle) comparando un archivo del backup con su entrada del manifest"""
+    nombre, ruta, entrada = tarea
+    suma = hashlib.sha256()
+    filas = 0
+    try:
+        with gzip.open(ruta, 'rb') as archivo:
+            for linea in archivo:
+                suma.update(linea)
+                filas += 1
+    except (OSError, EOFError) as e:
+        return nombre, False, f"archivo ilegible: {e}"
+    if filas != entrada['filas']:
+        return nombre, False, f"{filas} filas, el manifest dice {entrada['filas']}"
+    if suma.hexdigest() != entrada['sha256']:
+        return nombre, False, "checksum distinto"
+    return nombre, True, f"{filas} filas"
+
+def verify_backup(directorio, procesos=None):
+    """Comprueba en paralelo todos los archivos de un backup (y de su cadena de incrementales)"""
+    tareas = [
+        (f"{os.path.basename(os.path.normpath(paso))}/{nombre}",
+         os.path.join(paso, entrada['archivo']), entrada)
+        for paso, manifest in cadena_de_backups(directorio)
+        for nombre, entrada in manifest['tablas'].items()
+    ]
+    with ProcessPoolExecutor(max_workers=procesos or os.cpu_count()) as ejecutor:
+        resultados = list(ejecutor.map(_verificar_archivo, tareas))
+    
+    for nombre, ok, detalle in resultados:
+        print(f"   {'✅' if ok else '❌'} {nombre}: {detalle}")
+    errores = sum(1 for _, ok, _ in resultados if not ok)
+    if errores:
+        print(f"❌ {errores} archivos no coinciden con el manifest")
+    else:
+        print(f"✅ Backup verificado: {len(resultados)} archivos correctos")
+    return errores == 0
+
+def _convertidores(modelo):
+    """Funciones para pasar de JSON a los tipos de fecha de cada columna"""
+    convertidores = {}
+    for columna in modelo.__table__.columns:
+        if isinstance(columna.type, db.DateTime):
+            convertidores[columna.name] = datetime.fromisoformat
+        elif isinstance(columna.type, db.Date):
+            convertidores[columna.name] = date.fromisoformat
+    return convertidores
+
+def _en_trozos(filas):
+    trozo = []
+    for fila in filas:
+        trozo.append(fila)
+        if len(trozo) == LOTE:
+            yield trozo
+            trozo = []
+    if trozo:
+        yield trozo
+
+def _convertir(modelo, filas):
+    convertidores = _convertidores(modelo)
+    for fila in filas:
+        for columna, convertir in convertidores.items():
+            if isinstance(fila.get(columna), str):
+                fila[columna] = convertir(fila[columna])
+        yield fila
+
+def leer_tabla(directorio, modelo, entrada):
+    """Genera las filas de una tabla del backup en trozos de LOTE, ya convertidas"""
+    with gzip.open(os.path.join(directorio, entrada['archivo']), 'rt', encoding='utf-8') as archivo:
+        yield from _en_trozos(_convertir(modelo, (json.loads(linea) for linea in archivo)))
+
+# Carga masiva: COPY en PostgreSQL, executemany en SQLite
+def _valor_copy(valor):
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+def _copiar(modelo, trozo):
+    """COPY de un trozo de filas por la conexión de la sesión (misma transacción)"""
+    columnas = list(trozo[0])
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerows([_valor_copy(fila.get(c)) for c in columnas] for fila in trozo)
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {modelo.__tablename__} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buffer
+    )
+
+def _diferir_restricciones():
+    """Las comprobaciones de claves foráneas se hacen al confirmar, no fila a fila"""
+    if _es_postgresql():
+        db.session.execute(db.text('SET CONSTRAINTS ALL DEFERRED'))
+    else:
+        db.session.execute(db.text('PRAGMA defer_foreign_keys = ON'))
+
+def _reiniciar_secuencias():
+    """Que los próximos INSERT sigan tras los ids restaurados (SQLite ya usa max(rowid)+1)"""
+    if not _es_postgresql():
+        return
+    for modelo in TABLAS:
+        tabla = modelo.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), "
+            f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {tabla}"
+        ))
+
+def _cargar_completo(fuentes):
+    """Vacía las tablas y carga `fuentes` ({modelo: trozos de filas}) conservando los ids
+
+    Los índices secundarios de las tablas grandes se quitan durante la carga y
+    se reconstruyen al final, que es mucho más rápido que mantenerlos fila a fila.
+    Devuelve [(tabla, filas, segundos)]; los índices van con filas None.
+    """
+    _diferir_restricciones()
+    # Las FKs no son DEFERRABLE: primero los hijos que no se restauran
+    for tabla in TABLAS_DEPENDIENTES:
+        db.session.execute(tabla.delete())
+    for modelo in reversed(TABLAS):
+        db.session.execute(db.delete(modelo))
+    conexion = db.session.connection()
+    indices = [indice for modelo in TABLAS_POR_PEDIDO for indice in modelo.__table__.indexes]
+    for indice in indices:
+        indice.drop(conexion, checkfirst=True)
+    
+    copiar = _es_postgresql()
+    estadisticas = []
+    for modelo in TABLAS:
+        inicio = time.perf_counter()
+        filas = 0
+        for trozo in fuentes.get(modelo, ()):
+            if copiar:
+                _copiar(modelo, trozo)
+            else:
+                db.session.execute(db.insert(modelo), trozo)
+            filas += len(trozo)
+        estadisticas.append((modelo.__tablename__, filas, time.perf_counter() - inicio))
+    
+    inicio = time.perf_counter()
+    for indice in indices:
+        indice.create(conexion)
+    estadisticas.append(('índices', None, time.perf_counter() - inicio))
+    return estadisticas
+
+def _upsert(modelo, filas):
+    """INSERT ... ON CONFLICT (id) DO UPDATE de un trozo de filas"""
+    insert = _insert_dialecto()(modelo)
+    columnas = [c.name for c in modelo.__table__.columns if not c.primary_key]
+    db.session.execute(
+        insert.on_conflict_do_update(
+            index_elements=[c.name for c in modelo.__table__.primary_key.columns],
+            set_={c: insert.excluded[c] for c in columnas}
+        ),
+        filas
+    )
+
+def _aplicar_incremental(fuentes):
+    """Aplica un incremental: reemplaza cada pedido traído junto con sus items y comisiones"""
+    _diferir_restricciones()
+    estadisticas = []
+    for modelo in TABLAS:
+        inicio = time.perf_counter()
+        filas = 0
+        for trozo in fuentes.get(modelo, ()):
+            if modelo is Pedido:
+                ids = [fila['id'] for fila in trozo]
+                db.session.execute(db.delete(ComisionPedido).where(ComisionPedido.pedido_id.in_(ids)))
+                db.session.execute(db.delete(ItemPedido).where(ItemPedido.pedido_id.in_(ids)))
+            if modelo in TABLAS_POR_PEDIDO[1:]:
+                db.session.execute(db.insert(modelo), trozo)
+            else:
+                _upsert(modelo, trozo)
+            filas += len(trozo)
+        estadisticas.append((modelo.__tablename__, filas, time.perf_counter() - inicio))
+    return estadisticas
+
+def _informe(estadisticas):
+    print("📊 Carga:")
+    for tabla, filas, segundos in estadisticas:
+        if filas is None:
+            print(f"   - {tabla} reconstruidos en {segundos:.2f} s")
+            continue
+        ritmo = f"{filas / segundos:,.0f} filas/s" if filas and segundos else ""
+        print(f"   - {tabla}: {filas} filas en {segundos:.2f} s {ritmo}")
+
+def _despues_de_restaurar():
+    """Deja secuencias, caches, contador de pedidos, libro y resumen coherentes con lo restaurado"""
+    _reiniciar_secuencias()
+    # Que los workers en marcha descarten trabajadores/productos cacheados
+    cache_referencia.invalidar()
+    cache_reportes.invalidar()
+    # Que el próximo pedido continúe tras el último número restaurado
+    db.session.flush()
+    sincronizar_contador_pedidos()
+    db.session.commit()
+    
+    # El libro de ganancias no va en el backup: se rehace desde las comisiones restauradas
+    _reconstruir_ganancias(db.session.connection())
+    db.session.commit()
+    reconciliar_resumen()
+
+def _confirmar(confirmar):
+    if not confirmar:
+        return True
+    print("⚠️  ADVERTENCIA: Esta operación eliminará todos los datos actuales")
+    respuesta = input("¿Está seguro que desea continuar? (SI/no): ")
+    if respuesta.upper() != 'SI':
+        print("❌ Operación cancelada")
+        return False
+    return True
+
+def cadena_de_backups(directorio):
+    """[(directorio, manifest)] desde el backup completo hasta `directorio`, en orden de aplicación"""
+    cadena, vistos = [], set()
+    while True:
+        real = os.path.realpath(directorio)
+        if real in vistos:
+            raise ValueError(f"La cadena de backups de {cadena[0][0]} tiene un ciclo en {directorio}")
+        vistos.add(real)
+        manifest = leer_manifest(directorio)
+        cadena.append((directorio, manifest))
+        if manifest.get('tipo', 'completo') == 'completo':
+            return list(reversed(cadena))
+        base = os.path.join(os.path.dirname(os.path.normpath(directorio)), manifest['base'])
+        if not os.path.exists(os.path.join(base, 'manifest.json')):
+            raise FileNotFoundError(f"Falta el backup base {manifest['base']} de {directorio}")
+        directorio = base
+
+def _fuentes_streaming(directorio, manifest):
+    return {
+        modelo: leer_tabla(directorio, modelo, manifest['tablas'][modelo.__tablename__])
+        for modelo in TABLAS if modelo.__tablename__ in manifest['tablas']
+    }
+
+def restore_streaming(directorio, confirmar=True):
+    """Restaura un backup en streaming (y su cadena de incrementales) conservando los ids"""
+    cadena = cadena_de_backups(directorio)
+    
+    with app.app_context():
+        if len(cadena) > 1:
+            print(f"ℹ️  Se aplicarán {len(cadena)} backups: {', '.join(os.path.basename(d) for d, _ in cadena)}")
+        if not _confirmar(confirmar):
+            return False
+        
+        inicio = time.perf_counter()
+        estadisticas = []
+        for paso, manifest in cadena:
+            fuentes = _fuentes_streaming(paso, manifest)
+            if manifest.get('tipo', 'completo') == 'completo':
+                estadisticas += _cargar_completo(fuentes)
+            else:
+                estadisticas += _aplicar_incremental(fuentes)
+        
+        _despues_de_restaurar()
+        _informe(estadisticas)
+        
+        print(f"✅ Base de datos restaurada exitosamente desde: {directorio} en {time.perf_counter() - inicio:.1f} s")
+        print(f"📅 Fecha del backup: {cadena[-1][1]['fecha_backup']}")
+        return True
+
+def _fuentes_json(datos):
+    """Convierte un backup JSON (formato 1.0) en filas por tabla con los ids originales"""
+    items = (
+        dict(item, pedido_id=pedido['id'])
+        for pedido in datos.get('pedidos', [])
+        for item in pedido.get('items', [])
+    )
+    pedidos = ({k: v for k, v in pedido.items() if k != 'items'} for pedido in datos.get('pedidos', []))
+    configuracion = [datos['configuracion']] if datos.get('configuracion') else []
+    return {
+        Trabajador: _en_trozos(datos.get('trabajadores', [])),
+        Producto: _en_trozos(datos.get('productos', [])),
+        ConfiguracionComisiones: _en_trozos(configuracion),
+        Pedido: _en_trozos(_convertir(Pedido, pedidos)),
+        ItemPedido: _en_trozos(items),
+        ComisionPedido: _en_trozos(datos.get('comisiones', [])),
+    }
+
+def restore_database(backup_file, confirmar=True):
+    """Restaura la base de datos desde un archivo de backup (JSON) o un directorio (streaming)"""
     
     if not os.path.exists(backup_file):
         print(f"❌ Archivo de backup no encontrado: {backup_file}")
         return False
     
     try:
+        if os.path.isdir(backup_file):
+            return restore_streaming(backup_file, confirmar)
+        
         with open(backup_file, 'r', encoding='utf-8') as f:
             backup_data = json.load(f)
         
         with app.app_context():
-            print("⚠️  ADVERTENCIA: Esta operación eliminará todos los datos actuales")
-            confirm = input("¿Está seguro que desea continuar? (SI/no): ")
-            
-            if confirm.upper() != 'SI':
-                print("❌ Operación cancelada")
+            if not _confirmar(confirmar):
                 return False
             
-            # Limpiar tablas
-            ComisionPedido.query.delete()
-            ItemPedido.query.delete()
-            Pedido.query.delete()
-            Producto.query.delete()
-            Trabajador.query.delete()
-            ConfiguracionComisiones.query.delete()
-            
-            datos = backup_data['datos']
-            
-            # Restaurar trabajadores
-            for t_data in datos.get('trabajadores', []):
-                trabajador = Trabajador(
-                    nombre=t_data['nombre'],
-                    tipo=t_data['tipo'],
-                    activo=t_data['activo'],
-                    telefono=t_data['telefono'],
-                    total_ganado=t_data['total_ganado']
-                )
-                db.session.add(trabajador)
-            
-            # Restaurar productos
-            for p_data in datos.get('productos', []):
-                producto = Producto(
-                    nombre=p_data['nombre'],
-                    tipo=p_data['tipo'],
-                    tamaño=p_data['tamaño'],
-                    peso=p_data['peso'],
-                    precio_venta=p_data['precio_venta'],
-                    costo_produccion=p_data['costo_produccion'],
-                    stock=p_data['stock'],
-                    activo=p_data['activo']
-                )
-                db.session.add(producto)
-            
-            db.session.commit()
+            inicio = time.perf_counter()
+            estadisticas = _cargar_completo(_fuentes_json(backup_data['datos']))
+            _despues_de_restaurar()
+            _informe(estadisticas)
             
-            # Restaurar pedidos
-            for ped_data in datos.get('pedidos', []):
-                pedido = Pedido(
-                    numero_orden=ped_data['numero_orden'],
-                    fecha_pedido=datetime.fromisoformat(ped_data['fecha_pedido']).date() if ped_data['fecha_pedido'] else None,
-                    fecha_entrega=datetime.fromisoformat(ped_data['fecha_entrega']).date() if ped_data['fecha_entrega'] else None,
-                    horario_entrega=ped_data['horario_entrega'],
-                    cliente_nombre=ped_data['cliente_nombre'],
-                    cliente_telefono=ped_data['cliente_telefono'],
-                    cliente_direccion=ped_data['cliente_direccion'],
-                    vendedor_id=ped_data['vendedor_id'],
-                    mensajero_id=ped_data['mensajero_id'],
-                    elaborador_id=ped_data['elaborador_id'],
-                    estado=ped_data['estado'],
-                    modificado=ped_data['modificado'],
-                    subtotal=ped_data['subtotal'],
-                    mensajeria=ped_data['mensajeria'],
-                    total=ped_data['total'],
-                    observaciones=ped_data['observaciones']
-                )
-                db.session.add(pedido)
-                db.session.flush()
-                
-                # Restaurar items del pedido
-                for item_data in ped_data.get('items', []):
-                    item = ItemPedido(
-                        pedido_id=pedido.id,
-                        producto_id=item_data['producto_id'],
-                        cantidad=item_data['cantidad'],
-                        precio_unitario=item_data['precio_unitario'],
-                        incluye_bolsa_regalo=item_data['incluye_bolsa_regalo'],
-                        precio_bolsa=item_data['precio_bolsa']
-                    )
-                    db.session.add(item)
-            
-            # Restaurar comisiones
-            for com_data in datos.get('comisiones', []):
-                comision = ComisionPedido(
-                    pedido_id=com_data['pedido_id'],
-                    trabajador_id=com_data['trabajador_id'],
-                    tipo_comision=com_data['tipo_comision'],
-                    monto=com_data['monto']
-                )
-                db.session.add(comision)
-            
-            # Restaurar configuración
-            config_data = datos.get('configuracion')
-            if config_data:
-                config = ConfiguracionComisiones(
-                    comision_vendedor=config_data['comision_vendedor'],
-                    ganancia_negocio=config_data['ganancia_negocio'],
-                    ganancia_inversores=config_data['ganancia_inversores'],
-                    precio_bolsa_regalo=config_data['precio_bolsa_regalo']
-                )
-                db.session.add(config)
-            
-            db.session.commit()
-            
-            print(f"✅ Base de datos restaurada exitosamente desde: {backup_file}")
+            print(f"✅ Base de datos restaurada exitosamente desde: {backup_file} en {time.perf_counter() - inicio:.1f} s")
             print(f"📅 Fecha del backup: {backup_data['fecha_backup']}")
             return True
             
@@ -254,18 +649,39 @@ if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Uso:")
         print("  python backup.py backup                    # Crear backup")
-        print("  python backup.py restore <archivo>         # Restaurar backup")
+        print("  python backup.py backup --streaming        # Backup por tabla (NDJSON gzip)")
+        print("  python backup.py backup --incremental      # Sólo lo cambiado desde el último backup")
+        print("  python backup.py backup ... --procesos N   # Tablas en paralelo (por defecto, CPUs en PostgreSQL)")
+        print("  python backup.py verify <dir>              # Comprobar filas y checksums del backup")
+        print("  python backup.py restore <archivo|dir>     # Restaurar backup")
+        print("  python backup.py restore <archivo|dir> --si  # Restaurar sin pedir confirmación")
         sys.exit(1)
     
     comando = sys.argv[1].lower()
     
     if comando == "backup":
-        backup_database()
-    elif comando == "restore":
+        procesos = None
+        if '--procesos' in sys.argv[2:]:
+            procesos = int(sys.argv[sys.argv.index('--procesos') + 1])
+        if '--incremental' in sys.argv[2:]:
+            backup_streaming(incremental=True, procesos=procesos)
+        elif '--streaming' in sys.argv[2:] or procesos:
+            backup_streaming(procesos=procesos)
+        else:
+            backup_database()
+    elif comando == "verify":
         if len(sys.argv) < 3:
+            print("❌ Especifique el directorio del backup")
+            sys.exit(1)
+        if not verify_backup(sys.argv[2]):
+            sys.exit(1)
+    elif comando == "restore":
+        argumentos = [a for a in sys.argv[2:] if not a.startswith('--')]
+        if not argumentos:
             print("❌ Especifique el archivo de backup")
             sys.exit(1)
-        restore_database(sys.argv[2])
+        if not restore_database(argumentos[0], confirmar='--si' not in sys.argv[2:]):
+            sys.exit(1)
     else:
-        print("❌ Comando no válido. Use 'backup' o 'restore'")
+        print("❌ Comando no válido. Use 'backup', 'verify' o 'restore'")
         sys.exit(1)
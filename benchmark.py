@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Benchmark del listado de pedidos para Chocolates ByB
+Mide /pedidos y /api/pedidos con historiales de distinto tamaño sobre una
+base SQLite temporal; con paginación por cursor los tiempos deben ser planos.
+
+    python benchmark.py [tamaños...]          # Listado de pedidos
+    python benchmark.py carga URL [segundos] [clientes]   # Prueba de carga contra gunicorn
+    python benchmark.py arranque [pedidos]    # Primera petición de un worker, con y sin calentar
+    python benchmark.py generar PEDIDOS [items_por_pedido]   # Sólo genera datos sintéticos
+    python benchmark.py suite [pedidos] [items_por_pedido] [salida.json]   # Rutas y operaciones clave
+    python benchmark.py comparar ANTES.json DESPUES.json [tolerancia]     # Regresiones entre dos suites
+
+La prueba de carga va contra un servidor ya arrancado (p. ej. con distintos
+WORKER_CLASS / WEB_CONCURRENCY) para comparar el rendimiento de cada perfil.
+
+Los datos van siempre a una SQLite temporal: DATABASE_URL se ignora para no
+sembrar por descuido la base real. Para usar otra base hay que pedirlo
+expresamente con BENCH_DATABASE_URL. La suite se repite contra PostgreSQL si
+BENCH_POSTGRES_URL apunta a una base local de pruebas: la generación sólo
+añade pedidos hasta el volumen pedido, nunca borra.
+"""
+
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from statistics import median
+
+_tmp = tempfile.mkdtemp(prefix='bench_byb_')
+os.environ['DATABASE_URL'] = (os.environ.get('BENCH_DATABASE_URL')
+                              or f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+
+from app import (app, db, init_db, Pedido, ItemPedido, ComisionPedido, Producto, Trabajador,
+                 reservar_numeros_orden, _comisiones_trozo, obtener_configuracion, inversores_activos,
+                 reconciliar_resumen, generar_reporte_diario, cache_referencia, cache_reportes)
+
+REPETICIONES = 20
+LOTE = 5000
+
+def sembrar_pedidos(hasta):
+    """Inserta pedidos sintéticos en bloque hasta tener `hasta` en total
+
+    Los números salen del contador, como en un alta normal, y el personal es
+    el que haya dado de alta.
+    """
+    desde = Pedido.query.count()
+    hoy = date.today()
+    vendedor, mensajero = (
+        db.session.execute(db.select(Trabajador.id).where(Trabajador.tipo == tipo, Trabajador.activo == True)  # noqa: E712
+                           .order_by(Trabajador.id).limit(1)).scalar()
+        for tipo in ('vendedor', 'mensajero')
+    )
+    for inicio in range(desde, hasta, LOTE):
+        cantidad = min(LOTE, hasta - inicio)
+        primer_numero = reservar_numeros_orden(cantidad)
+        filas = []
+        for i in range(cantidad):
+            n = inicio + i + 1
+            filas.append({
+                'numero_orden': primer_numero + i,
+                'fecha_pedido': hoy - timedelta(days=(hasta - n) // 50),
+                'fecha_entrega': hoy - timedelta(days=(hasta - n) // 50) + timedelta(days=1),
+                'cliente_nombre': f'Cliente {n % 997}',
+                'cliente_direccion': 'Calle 1',
+                'vendedor_id': vendedor,
+                'mensajero_id': mensajero,
+                'estado': 'PENDIENTE' if n % 10 == 0 else 'COMPLETADO',
+                'modificado': False,
+                'subtotal': 1900,
+                'mensajeria': 100,
+                'total': 2000
+            })
+        db.session.execute(db.insert(Pedido).execution_options(render_nulls=True), filas)
+        db.session.commit()
+
+def medir(cliente, url):
+    """Mediana en milisegundos de REPETICIONES peticiones GET"""
+    tiempos = []
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        respuesta = cliente.get(url)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        assert respuesta.status_code == 200, (url, respuesta.status_code)
+    return median(tiempos)
+
+def main(tamaños):
+    with app.app_context():
+        init_db()
+    cliente = app.test_client()
+
+    casos = [
+        ('/pedidos', lambda n: '/pedidos'),
+        ('/pedidos (página profunda)', lambda n: f'/pedidos?antes={n // 2}'),
+        ('/api/pedidos', lambda n: '/api/pedidos'),
+        ('/api/pedidos?estado=PENDIENTE', lambda n: '/api/pedidos?estado=PENDIENTE'),
+        ('/api/pedidos?cliente=...', lambda n: '/api/pedidos?cliente=Cliente%2042'),
+    ]
+
+    print(f"{'pedidos':>10}  " + "  ".join(f"{nombre:>32}" for nombre, _ in casos))
+    for tamaño in tamaños:
+        with app.app_context():
+            sembrar_pedidos(tamaño)
+        resultados = [medir(cliente, url(tamaño)) for _, url in casos]
+        print(f"{tamaño:>10}  " + "  ".join(f"{ms:>29.2f} ms" for ms in resultados))
+
+RUTAS_CARGA = ['/api/estadisticas', '/api/pedidos', '/pedidos', '/api/ganancias']
+
+def prueba_carga(url, segundos=20, clientes=16):
+    """`clientes` hilos pidiendo RUTAS_CARGA durante `segundos`; imprime peticiones/s y latencias"""
+    import requests
+    fin = time.monotonic() + segundos
+
+    def cliente(n):
+        sesion = requests.Session()
+        tiempos, errores, i = [], 0, n
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                respuesta = sesion.get(url.rstrip('/') + RUTAS_CARGA[i % len(RUTAS_CARGA)], timeout=30)
+                if respuesta.status_code >= 500:
+                    errores += 1
+            except requests.RequestException:
+                errores += 1
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            i += 1
+        return tiempos, errores
+
+    with ThreadPoolExecutor(max_workers=clientes) as ejecutor:
+        resultados = list(ejecutor.map(cliente, range(clientes)))
+    tiempos = sorted(t for ts, _ in resultados for t in ts)
+    errores = sum(e for _, e in resultados)
+    print(f"{len(tiempos)} peticiones en {segundos} s con {clientes} clientes: "
+          f"{len(tiempos) / segundos:.1f} peticiones/s, {errores} errores")
+    if tiempos:
+        print(f"   - p50 {tiempos[len(tiempos) // 2]:.1f} ms, p95 {tiempos[int(len(tiempos) * 0.95)]:.1f} ms, "
+              f"máx {tiempos[-1]:.1f} ms")
+
+# Se ejecuta en un intérprete nuevo para medir un worker recién arrancado
+CODIGO_ARRANQUE = """
+import json, sys, time
+inicio = time.perf_counter()
+from app import app, calentar
+importado = time.perf_counter()
+if sys.argv[1] == '1':
+    calentar()
+listo = time.perf_counter()
+cliente = app.test_client()
+primeras = {}
+for url in ('/', '/pedidos'):
+    t = time.perf_counter()
+    cliente.get(url)
+    primeras[url] = (time.perf_counter() - t) * 1000
+print(json.dumps({'importar': (importado - inicio) * 1000, 'calentar': (listo - importado) * 1000,
+                  'primeras': primeras}))
+"""
+
+def medir_arranque(pedidos=10000, repeticiones=5):
+    """Latencia de las primeras peticiones de un worker nuevo, con y sin calentar()"""
+    with app.app_context():
+        init_db()
+        sembrar_pedidos(pedidos)
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'':>14}  {'importar':>10}  {'calentar':>10}  {'1ª /':>10}  {'1ª /pedidos':>12}")
+    for calentado in ('0', '1'):
+        medidas = []
+        for _ in range(repeticiones):
+            salida = subprocess.run(
+                [sys.executable, '-c', CODIGO_ARRANQUE, calentado], cwd=directorio,
+                capture_output=True, text=True, check=True
+            ).stdout
+            medidas.append(json.loads(salida.strip().splitlines()[-1]))
+        fila = [median(m['importar'] for m in medidas), median(m['calentar'] for m in medidas),
+                median(m['primeras']['/'] for m in medidas), median(m['primeras']['/pedidos'] for m in medidas)]
+        nombre = 'calentado' if calentado == '1' else 'en frío'
+        print(f"{nombre:>14}  " + "  ".join(f"{ms:>7.1f} ms" for ms in fila[:3]) + f"  {fila[3]:>9.1f} ms")
+
+# Datos sintéticos a gran escala
+PRODUCTOS_SINTETICOS = 20
+DIAS_SINTETICOS = 365
+
+def _productos_sinteticos():
+    """Completa el catálogo hasta PRODUCTOS_SINTETICOS y devuelve [(id, precio_venta)]"""
+    existentes = Producto.query.filter_by(activo=True).count()
+    if existentes < PRODUCTOS_SINTETICOS:
+        db.session.execute(db.insert(Producto), [{
+            'nombre': f'Bombón sintético {n}', 'tipo': 'chocolate', 'tamaño': 'mediano', 'peso': 100,
+            'precio_venta': 1000 + 50 * n, 'costo_produccion': 400 + 20 * n, 'stock': 0, 'activo': True,
+        } for n in range(existentes, PRODUCTOS_SINTETICOS)])
+        db.session.commit()
+        cache_referencia.invalidar()
+    return db.session.execute(
+        db.select(Producto.id, Producto.precio_venta).where(Producto.activo == True)  # noqa: E712
+    ).all()
+
+def generar_datos(hasta, items_por_pedido=4, semilla=1, completados=0.9):
+    """Añade pedidos con sus items y comisiones hasta tener `hasta` en total
+
+    Todo va por INSERT masivos de LOTE filas (sin RETURNING, que en SQLite
+    obliga a insertar fila a fila). Las comisiones de los completados salen de _comisiones_trozo,
+    el mismo código que usa la aplicación, así que cuadran con el libro de
+    ganancias; al final se reconstruye el resumen del dashboard.
+    Devuelve los segundos empleados.
+    """
+    inicio_total = time.perf_counter()
+    azar = random.Random(semilla)
+    productos = _productos_sinteticos()
+    personal = {tipo: [t.id for t in Trabajador.query.filter_by(tipo=tipo, activo=True)]
+                for tipo in ('vendedor', 'mensajero', 'elaborador')}
+    config = obtener_configuracion()
+    inversores = inversores_activos()
+    hoy = date.today()
+
+    desde = Pedido.query.count()
+    for inicio in range(desde, hasta, LOTE):
+        cantidad = min(LOTE, hasta - inicio)
+        primer_numero = reservar_numeros_orden(cantidad)
+        pedidos, items_de = [], []
+        for n in range(cantidad):
+            items = []
+            for _ in range(azar.randint(1, 2 * items_por_pedido - 1)):
+                producto_id, precio = azar.choice(productos)
+                bolsa = azar.random() < 0.1
+                items.append({'producto_id': producto_id, 'cantidad': azar.randint(1, 5),
+                              'precio_unitario': precio, 'incluye_bolsa_regalo': bolsa,
+                              'precio_bolsa': 50 if bolsa else 0})
+            subtotal = sum(i['cantidad'] * i['precio_unitario'] + i['precio_bolsa'] for i in items)
+            mensajeria = azar.choice((0, 100, 150))
+            fecha = hoy - timedelta(days=azar.randrange(DIAS_SINTETICOS))
+            pedidos.append({
+                'numero_orden': primer_numero + n,
+                'fecha_pedido': fecha,
+                'fecha_entrega': fecha + timedelta(days=1),
+                'horario_entrega': azar.choice(('mañana', 'tarde')),
+                'cliente_nombre': f'Cliente {azar.randrange(50000)}',
+                'cliente_telefono': f'5{azar.randrange(10 ** 7):07d}',
+                'cliente_direccion': f'Calle {azar.randrange(300)}',
+                'vendedor_id': azar.choice(personal['vendedor']) if personal['vendedor'] else None,
+                'mensajero_id': azar.choice(personal['mensajero']) if mensajeria and personal['mensajero'] else None,
+                'elaborador_id': azar.choice(personal['elaborador']) if personal['elaborador'] else None,
+                'estado': 'COMPLETADO' if azar.random() < completados else 'PENDIENTE',
+                'modificado': False,
+                'subtotal': subtotal,
+                'mensajeria': mensajeria,
+                'total': subtotal + mensajeria,
+            })
+            items_de.append(items)
+
+        db.session.execute(db.insert(Pedido).execution_options(render_nulls=True), pedidos)
+        # Los números de orden son consecutivos: un rango trae todos los ids nuevos
+        por_numero = dict(db.session.execute(
+            db.select(Pedido.numero_orden, Pedido.id)
+            .where(Pedido.numero_orden.between(primer_numero, primer_numero + cantidad - 1))
+        ).all())
+        ids = [por_numero[pedido['numero_orden']] for pedido in pedidos]
+        filas_items = []
+        for pedido_id, items in zip(ids, items_de):
+            for item in items:
+                item['pedido_id'] = pedido_id
+                filas_items.append(item)
+        db.session.execute(db.insert(ItemPedido), filas_items)
+        completos = [pedido_id for pedido_id, pedido in zip(ids, pedidos) if pedido['estado'] == 'COMPLETADO']
+        if completos:
+            _comisiones_trozo(completos, config, inversores)
+        db.session.commit()
+
+    reconciliar_resumen()
+    cache_reportes.invalidar()
+    db.session.commit()
+    return time.perf_counter() - inicio_total
+
+def volumen():
+    return {modelo.__tablename__: db.session.query(db.func.count(modelo.id)).scalar()
+            for modelo in (Pedido, ItemPedido, ComisionPedido)}
+
+# Suite de rendimiento con resultados en JSON
+REPETICIONES_SUITE = {'rutas': 20, 'escrituras': 50, 'reporte': 10, 'backup': 3}
+
+def cronometrar(funcion, repeticiones):
+    """Ejecuta `funcion(i)` `repeticiones` veces y devuelve mediana, p95 y mínimo en ms"""
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {'mediana_ms': round(median(tiempos), 2),
+            'p95_ms': round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 2),
+            'min_ms': round(tiempos[0], 2), 'repeticiones': repeticiones}
+
+def _version_codigo():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def ejecutar_suite(pedidos=100000, items_por_pedido=4):
+    """Genera el volumen pedido y mide rutas, altas, completados, reporte y backups"""
+    from backup import backup_database, backup_streaming
+    with app.app_context():
+        init_db()
+        generacion = generar_datos(pedidos, items_por_pedido)
+        motor = db.engine.dialect.name
+        filas = volumen()
+    print(f"[{motor}] datos listos en {generacion:.1f} s: {filas}")
+
+    cliente = app.test_client()
+    mediciones = {}
+
+    def get(url):
+        def peticion(_):
+            respuesta = cliente.get(url)
+            assert respuesta.status_code == 200, (url, respuesta.status_code)
+        return peticion
+    for url in ('/', '/api/estadisticas', '/pedidos'):
+        mediciones[f'GET {url}'] = cronometrar(get(url), REPETICIONES_SUITE['rutas'])
+
+    def alta(i):
+        respuesta = cliente.post('/crear_pedido', data={
+            'fecha_entrega': date.today().isoformat(), 'cliente_nombre': f'Suite {i}',
+            'cliente_direccion': 'Calle 1', 'productos[]': ['1'], 'cantidades[]': ['2'], 'precios[]': ['1900'],
+        })
+        assert respuesta.status_code == 302, respuesta.status_code
+    mediciones['crear_pedido'] = cronometrar(alta, REPETICIONES_SUITE['escrituras'])
+    with app.app_context():
+        creados = db.session.execute(
+            db.select(Pedido.id).where(Pedido.cliente_nombre.like('Suite %'), Pedido.estado == 'PENDIENTE')
+        ).scalars().all()
+
+    def completar(i):
+        respuesta = cliente.get(f'/completar_pedido/{creados[i]}')
+        assert respuesta.status_code == 302, respuesta.status_code
+    mediciones['completar_pedido'] = cronometrar(completar, min(len(creados), REPETICIONES_SUITE['escrituras']))
+
+    def reporte(_):
+        # Sin cache: se mide la consulta, no el acierto
+        cache_reportes.invalidar()
+        generar_reporte_diario()
+    with app.app_context():
+        mediciones['generar_reporte_diario'] = cronometrar(reporte, REPETICIONES_SUITE['reporte'])
+
+    # Los backups escriben en ./backup: que sea dentro del directorio temporal
+    directorio_previo = os.getcwd()
+    os.chdir(_tmp)
+    try:
+        mediciones['backup_database'] = cronometrar(lambda _: backup_database(), REPETICIONES_SUITE['backup'])
+        with app.app_context():
+            mediciones['backup_streaming'] = cronometrar(lambda _: backup_streaming(),
+                                                         REPETICIONES_SUITE['backup'])
+    finally:
+        os.chdir(directorio_previo)
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'version': _version_codigo(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'volumen': filas,
+        'generacion_s': round(generacion, 1),
+        'mediciones': mediciones,
+    }
+
+def suite(pedidos=100000, items_por_pedido=4, salida=None):
+    """Suite contra la base de pruebas y, si hay BENCH_POSTGRES_URL, también contra PostgreSQL"""
+    resultado = ejecutar_suite(pedidos, items_por_pedido)
+    with app.app_context():
+        motores = {db.engine.dialect.name: resultado}
+
+    postgres = os.environ.get('BENCH_POSTGRES_URL')
+    if postgres and 'postgresql' not in motores:
+        parcial = os.path.join(_tmp, 'postgresql.json')
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'suite', str(pedidos),
+                        str(items_por_pedido), parcial],
+                       env=dict(os.environ, BENCH_DATABASE_URL=postgres, BENCH_POSTGRES_URL=''), check=True)
+        with open(parcial, encoding='utf-8') as f:
+            motores.update(json.load(f)['motores'])
+
+    salida = salida or os.path.join(_tmp, 'benchmark.json')
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump({'motores': motores}, f, ensure_ascii=False, indent=2)
+
+    for motor, datos in motores.items():
+        print(f"\n{motor} ({datos['volumen']['pedido']} pedidos)")
+        for nombre, medida in datos['mediciones'].items():
+            print(f"   {nombre:<24} mediana {medida['mediana_ms']:>9.2f} ms   p95 {medida['p95_ms']:>9.2f} ms")
+    print(f"\nResultados en {salida}")
+
+def comparar(antes, despues, tolerancia=0.2):
+    """Compara medianas de dos suites; sale con 1 si algo empeora más de `tolerancia`"""
+    with open(antes, encoding='utf-8') as f:
+        previo = json.load(f)['motores']
+    with open(despues, encoding='utf-8') as f:
+        actual = json.load(f)['motores']
+    regresiones = 0
+    for motor in sorted(previo.keys() & actual.keys()):
+        print(f"{motor}: {previo[motor]['version']} -> {actual[motor]['version']}")
+        for nombre, medida in actual[motor]['mediciones'].items():
+            base = previo[motor]['mediciones'].get(nombre)
+            if not base:
+                continue
+            cambio = medida['mediana_ms'] / base['mediana_ms'] - 1 if base['mediana_ms'] else 0
+            marca = '❌' if cambio > tolerancia else '✅'
+            regresiones += cambio > tolerancia
+            print(f"   {marca} {nombre:<24} {base['mediana_ms']:>9.2f} -> {medida['mediana_ms']:>9.2f} ms "
+                  f"({cambio:+.0%})")
+    if regresiones:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['generar']:
+        with app.app_context():
+            init_db()
+            segundos = generar_datos(int(sys.argv[2]), *(int(x) for x in sys.argv[3:4]))
+            print(f"Generado en {segundos:.1f} s: {volumen()} en {db.engine.url.render_as_string()}")
+    elif sys.argv[1:2] == ['suite']:
+        suite(*(int(x) for x in sys.argv[2:4]), *sys.argv[4:5])
+    elif sys.argv[1:2] == ['comparar']:
+        comparar(sys.argv[2], sys.argv[3], *(float(x) for x in sys.argv[4:5]))
+    elif sys.argv[1:2] == ['arranque']:
+        medir_arranque(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+    elif sys.argv[1:2] == ['carga']:
+        prueba_carga(sys.argv[2], *(int(x) for x in sys.argv[3:5]))
+    else:
+        tamaños = [int(x) for x in sys.argv[1:]] or [1000, 10000, 100000]
+        main(sorted(tamaños))
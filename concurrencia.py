@@ -0,0 +1,83 @@
+"""
+Perfil de concurrencia para Chocolates ByB
+Decide la clase de worker de gunicorn, cuántos workers e hilos usar y el
+tamaño del pool de SQLAlchemy que les corresponde. Lo leen gunicorn.conf.py
+y app.py, así que ambos quedan siempre de acuerdo.
+
+Variables de entorno (todas opcionales):
+    WORKER_CLASS       sync | gthread | gevent (por defecto gthread)
+    WEB_CONCURRENCY    número de workers (por defecto según las CPUs)
+    THREADS            hilos por worker con gthread (por defecto 4)
+    WORKER_CONNECTIONS conexiones simultáneas por worker con gevent (por defecto 100)
+    DB_POOL_SIZE       conexiones fijas por worker (por defecto según hilos)
+    DB_MAX_OVERFLOW    conexiones extra por worker en picos
+    DB_MAX_CONEXIONES  tope de conexiones de toda la aplicación contra la base
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CLASES_WORKER = ('sync', 'gthread', 'gevent')
+
+def _entero(nombre, por_defecto):
+    valor = os.environ.get(nombre)
+    return int(valor) if valor else por_defecto
+
+def _cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _gevent_disponible():
+    try:
+        import gevent  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def perfil_concurrencia():
+    """Devuelve el perfil como dict: clase, workers, hilos, conexiones y pool de la base"""
+    cpus = _cpus()
+    clase = os.environ.get('WORKER_CLASS', 'gthread')
+    if clase not in CLASES_WORKER:
+        logger.warning(f"WORKER_CLASS={clase} no reconocido, usando gthread")
+        clase = 'gthread'
+    if clase == 'gevent' and not _gevent_disponible():
+        logger.warning("gevent no está instalado, usando gthread")
+        clase = 'gthread'
+
+    if clase == 'sync':
+        # Un proceso por petición: los workers hacen de concurrencia
+        workers = _entero('WEB_CONCURRENCY', 2 * cpus + 1)
+        hilos = 1
+        simultaneas = 1
+    elif clase == 'gthread':
+        workers = _entero('WEB_CONCURRENCY', cpus + 1)
+        hilos = _entero('THREADS', 4)
+        simultaneas = hilos
+    else:
+        workers = _entero('WEB_CONCURRENCY', cpus)
+        hilos = 1
+        simultaneas = _entero('WORKER_CONNECTIONS', 100)
+
+    # Cada petición en curso usa como mucho una conexión; con gevent se acota
+    # porque casi todas las conexiones simultáneas esperan a la red, no a la base.
+    pool_size = _entero('DB_POOL_SIZE', min(simultaneas, 10))
+    max_overflow = _entero('DB_MAX_OVERFLOW', max(0, min(simultaneas, 10) // 2))
+    tope = _entero('DB_MAX_CONEXIONES', 0)
+    if tope and workers * (pool_size + max_overflow) > tope:
+        por_worker = max(1, tope // workers)
+        pool_size = min(pool_size, por_worker)
+        max_overflow = max(0, por_worker - pool_size)
+
+    return {
+        'clase': clase,
+        'workers': max(1, workers),
+        'hilos': max(1, hilos),
+        'conexiones_worker': simultaneas,
+        'pool_size': max(1, pool_size),
+        'max_overflow': max_overflow,
+    }
@@ -1,17 +1,86 @@
 import os
+import subprocess
+import sys
+import time
+
+# concurrencia.py vive junto a este archivo, aunque gunicorn se lance desde otro directorio
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from concurrencia import perfil_concurrencia
+import metricas
+
+# Perfil de concurrencia (ver concurrencia.py): el mismo que dimensiona el pool de app.py
+perfil = perfil_concurrencia()
 
 # Servidor
 bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
-workers = 1
-worker_class = "sync"
-timeout = 120  # Reducido de 300 a 120
+worker_class = perfil['clase']
+workers = perfil['workers']
+threads = perfil['hilos']
+# Con gthread, las conexiones por encima de los hilos son las keep-alive en espera
+worker_connections = perfil['conexiones_worker'] if worker_class == 'gevent' else 1000
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
 keepalive = 5
 
+# Reciclar workers de vez en cuando, escalonados para que no reinicien todos a la vez
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
 # Logging
 loglevel = "info"
 accesslog = "-"
 errorlog = "-"
 
 # Proceso
-preload_app = False  # Importante: no precargar la app
+# La app se carga una vez en el master y los workers la heredan al hacer fork;
+# post_fork descarta las conexiones heredadas para que ningún worker las comparta.
+# Con gevent no: el monkey patching tiene que ocurrir antes de importar la app.
+preload_app = perfil['clase'] != 'gevent'
 daemon = False
+
+def on_starting(server):
+    # Las métricas de un arranque anterior no deben sumarse a las de éste
+    metricas.limpiar()
+    # Tablas, migraciones y datos de ejemplo una sola vez por despliegue, antes de
+    # crear workers; en un proceso aparte para no cargar la app en el master con gevent.
+    if os.environ.get('INICIALIZAR_AL_ARRANCAR', '1') != '1':
+        return
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'inicializar'], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    server.log.info(f"Base de datos inicializada en {time.perf_counter() - inicio:.2f} s")
+
+def when_ready(server):
+    server.log.info(
+        f"Perfil: {perfil['clase']}, {perfil['workers']} workers x {perfil['hilos']} hilos, "
+        f"pool {perfil['pool_size']}+{perfil['max_overflow']} conexiones por worker"
+    )
+
+def post_fork(server, worker):
+    if perfil['clase'] == 'gevent':
+        # psycopg2 bloquea el worker entero salvo que se le enseñe a ceder a gevent
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen no está instalado: las consultas bloquean el worker gevent")
+    if preload_app:
+        from app import app, db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+def post_worker_init(worker):
+    # Pool, plantillas y caches listos antes de aceptar la primera petición
+    from app import calentar
+    inicio = time.perf_counter()
+    tiempos = calentar()
+    detalle = ', '.join(f"{paso} {segundos * 1000:.0f} ms" for paso, segundos in tiempos.items())
+    worker.log.info(f"Worker {worker.pid} calentado en {(time.perf_counter() - inicio) * 1000:.0f} ms ({detalle})")
+
+def worker_exit(server, worker):
+    # Último volcado para no perder lo registrado desde el anterior
+    metricas.registro_metricas.volcar()
+
+def child_exit(server, worker):
+    # El master pasa las métricas del worker muerto al histórico: /metrics no retrocede
+    metricas.archivar_worker(worker.pid)
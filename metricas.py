@@ -0,0 +1,208 @@
+"""
+Métricas en formato Prometheus para Chocolates ByB
+Cada proceso acumula sus contadores e histogramas en memoria y los vuelca
+cada segundo a un archivo propio en METRICAS_DIR; /metrics suma los archivos
+de todos los workers, así que el resultado es el mismo sea cual sea el worker
+que atiende la petición. Los archivos de workers terminados se archivan en
+`historico.json` para que los contadores nunca retrocedan.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+DIRECTORIO = os.environ.get('METRICAS_DIR') or os.path.join(tempfile.gettempdir(), 'byb_metricas')
+HISTORICO = 'historico.json'
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_ESPERA = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+# nombre: (tipo, ayuda)
+DESCRIPCIONES = {
+    'byb_http_requests_total': ('counter', 'Peticiones HTTP atendidas por endpoint, método y código'),
+    'byb_http_request_duration_seconds': ('histogram', 'Duración de las peticiones HTTP por endpoint'),
+    'byb_sql_queries_total': ('counter', 'Sentencias SQL ejecutadas por endpoint'),
+    'byb_sql_duration_seconds_total': ('counter', 'Tiempo total en sentencias SQL por endpoint'),
+    'byb_db_pool_checkout_seconds': ('histogram', 'Espera para obtener una conexión del pool'),
+    'byb_whatsapp_envio_seconds': ('histogram', 'Duración de las llamadas salientes a CallMeBot'),
+}
+
+def _clave(nombre, etiquetas):
+    return json.dumps([nombre, sorted(etiquetas.items())], ensure_ascii=False)
+
+def _sumar(destino, origen):
+    for clave, valor in origen.get('contadores', {}).items():
+        destino['contadores'][clave] = destino['contadores'].get(clave, 0) + valor
+    for clave, valores in origen.get('histogramas', {}).items():
+        actual = destino['histogramas'].get(clave)
+        destino['histogramas'][clave] = valores[:] if actual is None else [a + b for a, b in zip(actual, valores)]
+    return destino
+
+def _vacio():
+    return {'contadores': {}, 'histogramas': {}}
+
+def _leer(ruta):
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return _vacio()
+
+def _escribir(ruta, datos):
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f)
+    os.replace(temporal, ruta)
+
+class RegistroMetricas:
+    """Contadores e histogramas de este proceso, volcados a disco en segundo plano"""
+
+    def __init__(self, directorio=DIRECTORIO, intervalo=1.0):
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._datos = _vacio()
+        self._buckets = {}
+        self._pid = None
+        self._hilo = None
+
+    def _ruta_propia(self):
+        return os.path.join(self.directorio, f'worker_{os.getpid()}.json')
+
+    def _asegurar_hilo(self):
+        # Tras un fork el hilo del padre no existe: cada proceso arranca el suyo
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._datos = _vacio()
+            self._pid = os.getpid()
+            os.makedirs(self.directorio, exist_ok=True)
+            self._hilo = threading.Thread(target=self._bucle, name='metricas', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.volcar()
+            except OSError:
+                pass
+
+    def contar(self, nombre, etiquetas, valor=1):
+        self._asegurar_hilo()
+        clave = _clave(nombre, etiquetas)
+        with self._lock:
+            self._datos['contadores'][clave] = self._datos['contadores'].get(clave, 0) + valor
+
+    def observar(self, nombre, etiquetas, valor, buckets=BUCKETS_LATENCIA):
+        """Añade una observación a un histograma: [por bucket..., +Inf, suma, cuenta]"""
+        self._asegurar_hilo()
+        clave = _clave(nombre, etiquetas)
+        with self._lock:
+            self._buckets[nombre] = buckets
+            valores = self._datos['histogramas'].get(clave)
+            if valores is None:
+                valores = self._datos['histogramas'][clave] = [0] * (len(buckets) + 3)
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    valores[i] += 1
+            valores[len(buckets)] += 1
+            valores[-2] += valor
+            valores[-1] += 1
+
+    def volcar(self):
+        """Escribe el estado de este proceso en su archivo"""
+        if self._pid != os.getpid():
+            return  # este proceso aún no ha registrado nada
+        with self._lock:
+            datos = {
+                'contadores': dict(self._datos['contadores']),
+                'histogramas': {k: v[:] for k, v in self._datos['histogramas'].items()},
+                'buckets': dict(self._buckets),
+            }
+        _escribir(self._ruta_propia(), datos)
+
+    def combinar(self):
+        """Suma los archivos de todos los procesos (vivos y archivados)"""
+        self._asegurar_hilo()
+        self.volcar()
+        total = _vacio()
+        buckets = {}
+        # Con el cerrojo compartido nunca se ve un worker a medio archivar
+        with open(os.path.join(self.directorio, '.lock'), 'w') as cerrojo:
+            fcntl.flock(cerrojo, fcntl.LOCK_SH)
+            for nombre in os.listdir(self.directorio):
+                if nombre.endswith('.json'):
+                    datos = _leer(os.path.join(self.directorio, nombre))
+                    buckets.update(datos.get('buckets', {}))
+                    _sumar(total, datos)
+        total['buckets'] = buckets
+        return total
+
+    def exponer(self):
+        """Texto en formato de exposición de Prometheus"""
+        datos = self.combinar()
+        series = {}
+        for clave, valor in datos['contadores'].items():
+            nombre, etiquetas = json.loads(clave)
+            series.setdefault(nombre, []).append((dict(etiquetas), valor))
+        for clave, valores in datos['histogramas'].items():
+            nombre, etiquetas = json.loads(clave)
+            series.setdefault(nombre, []).append((dict(etiquetas), valores))
+
+        lineas = []
+        for nombre in sorted(series):
+            tipo, ayuda = DESCRIPCIONES.get(nombre, ('untyped', nombre))
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for etiquetas, valor in sorted(series[nombre], key=lambda s: sorted(s[0].items())):
+                if tipo != 'histogram':
+                    lineas.append(f'{nombre}{_etiquetas(etiquetas)} {_numero(valor)}')
+                    continue
+                limites = datos['buckets'].get(nombre, BUCKETS_LATENCIA)
+                for limite, cuenta in zip(list(limites) + ['+Inf'], valor):
+                    lineas.append(f'{nombre}_bucket{_etiquetas(dict(etiquetas, le=str(limite)))} {cuenta}')
+                lineas.append(f'{nombre}_sum{_etiquetas(etiquetas)} {_numero(valor[-2])}')
+                lineas.append(f'{nombre}_count{_etiquetas(etiquetas)} {valor[-1]}')
+        return '\n'.join(lineas) + '\n'
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    pares = ','.join(
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in sorted(etiquetas.items())
+    )
+    return '{' + pares + '}'
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def limpiar(directorio=DIRECTORIO):
+    """Borra las métricas de una ejecución anterior (al arrancar gunicorn)"""
+    os.makedirs(directorio, exist_ok=True)
+    for nombre in os.listdir(directorio):
+        if nombre.endswith('.json') or nombre.endswith('.tmp'):
+            os.remove(os.path.join(directorio, nombre))
+
+def archivar_worker(pid, directorio=DIRECTORIO):
+    """Suma el archivo de un worker terminado al histórico y lo elimina"""
+    ruta = os.path.join(directorio, f'worker_{pid}.json')
+    if not os.path.exists(ruta):
+        return
+    with open(os.path.join(directorio, '.lock'), 'w') as cerrojo:
+        fcntl.flock(cerrojo, fcntl.LOCK_EX)
+        historico = os.path.join(directorio, HISTORICO)
+        datos = _leer(ruta)
+        combinado = _sumar(_leer(historico), datos)
+        combinado['buckets'] = dict(_leer(historico).get('buckets', {}), **datos.get('buckets', {}))
+        _escribir(historico, combinado)
+        os.remove(ruta)
+
+registro_metricas = RegistroMetricas()
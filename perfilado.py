@@ -0,0 +1,120 @@
+"""
+Perfilado bajo demanda y registro de consultas lentas para Chocolates ByB
+- Perfiles: una petición firmada (ver `token_perfil` en app.py) se ejecuta con
+  cProfile y guarda aquí el .prof junto a un .json con sus sentencias SQL.
+  Sólo se conservan los últimos PERFILES_MAX.
+- Consultas lentas: cada sentencia por encima del umbral se añade como una
+  línea JSON a un archivo que rota al llegar a la mitad del tope, así que
+  entre el actual y el rotado nunca ocupan más de SQL_LENTO_MAX_BYTES.
+Sólo se guarda la forma de los parámetros (tipos), nunca sus valores.
+"""
+
+import fcntl
+import io
+import json
+import os
+import pstats
+import secrets
+import tempfile
+from datetime import datetime
+
+DIRECTORIO_PERFILES = os.environ.get('PERFILES_DIR') or os.path.join(tempfile.gettempdir(), 'byb_perfiles')
+ARCHIVO_SQL_LENTO = os.environ.get('SQL_LENTO_ARCHIVO') or os.path.join(tempfile.gettempdir(), 'byb_sql_lento.log')
+MAX_SENTENCIA = 2000
+FUNCIONES_RESUMEN = 40
+
+def forma_parametros(parametros, executemany=False):
+    """Tipos de los parámetros ligados, sin sus valores"""
+    if executemany:
+        filas = list(parametros or [])
+        return {'filas': len(filas), 'forma': forma_parametros(filas[0]) if filas else None}
+    if isinstance(parametros, dict):
+        return {clave: type(valor).__name__ for clave, valor in parametros.items()}
+    if isinstance(parametros, (list, tuple)):
+        return [type(valor).__name__ for valor in parametros]
+    return type(parametros).__name__
+
+def _recortar(sentencia):
+    sentencia = ' '.join(sentencia.split())
+    return sentencia if len(sentencia) <= MAX_SENTENCIA else sentencia[:MAX_SENTENCIA] + '…'
+
+class RegistroSqlLento:
+    """Archivo de sentencias lentas con tope de tamaño, compartido entre workers"""
+
+    def __init__(self, ruta=ARCHIVO_SQL_LENTO, max_bytes=5 * 1024 * 1024):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+
+    def registrar(self, sentencia, parametros, executemany, segundos, endpoint, ruta_http=None):
+        linea = json.dumps({
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'ms': round(segundos * 1000, 1),
+            'endpoint': endpoint,
+            'ruta': ruta_http,
+            'sql': _recortar(sentencia),
+            'parametros': forma_parametros(parametros, executemany),
+        }, ensure_ascii=False) + '\n'
+        datos = linea.encode('utf-8')
+        os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+        with open(self.ruta + '.lock', 'w') as cerrojo:
+            fcntl.flock(cerrojo, fcntl.LOCK_EX)
+            try:
+                tamano = os.path.getsize(self.ruta)
+            except OSError:
+                tamano = 0
+            if tamano + len(datos) > self.max_bytes // 2:
+                # El rotado anterior se pierde: el total queda acotado
+                if tamano:
+                    os.replace(self.ruta, self.ruta + '.1')
+                if len(datos) > self.max_bytes // 2:
+                    return
+            with open(self.ruta, 'ab') as f:
+                f.write(datos)
+
+    def leer(self, limite=200):
+        """Últimas `limite` entradas, más recientes primero"""
+        lineas = []
+        for ruta in (self.ruta + '.1', self.ruta):
+            try:
+                with open(ruta, encoding='utf-8') as f:
+                    lineas.extend(f.readlines())
+            except OSError:
+                pass
+        return [json.loads(linea) for linea in reversed(lineas[-limite:])]
+
+def guardar_perfil(perfilador, sentencias, datos, directorio=DIRECTORIO_PERFILES, maximo=20):
+    """Escribe <id>.prof (pstats) y <id>.json (resumen + SQL) y borra los más antiguos
+
+    `sentencias` es una lista de (sql, forma, segundos). Devuelve el id.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    identificador = f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(3)}"
+    base = os.path.join(directorio, identificador)
+    perfilador.dump_stats(base + '.prof')
+
+    resumen = io.StringIO()
+    pstats.Stats(perfilador, stream=resumen).sort_stats('cumulative').print_stats(FUNCIONES_RESUMEN)
+    datos = dict(datos, id=identificador, sql={
+        'total': len(sentencias),
+        'ms': round(sum(s[2] for s in sentencias) * 1000, 1),
+        'sentencias': [{'sql': _recortar(sql), 'parametros': forma, 'ms': round(segundos * 1000, 2)}
+                       for sql, forma, segundos in sentencias],
+    }, resumen=resumen.getvalue())
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, indent=1)
+
+    for antiguo in listar_perfiles(directorio)[maximo:]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(directorio, antiguo + extension))
+            except OSError:
+                pass
+    return identificador
+
+def listar_perfiles(directorio=DIRECTORIO_PERFILES):
+    """Ids de los perfiles guardados, más recientes primero"""
+    try:
+        nombres = os.listdir(directorio)
+    except OSError:
+        return []
+    return sorted((n[:-5] for n in nombres if n.endswith('.json')), reverse=True)
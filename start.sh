@@ -15,7 +15,9 @@ fi
 echo "🔧 Configuración:"
 echo "   - Puerto: ${PORT:-5000}"
 echo "   - Entorno: ${FLASK_ENV:-production}"
+echo "   - Workers: ${WORKER_CLASS:-gthread} (${WEB_CONCURRENCY:-según CPUs} workers)"
 
-# Iniciar la aplicación con gunicorn
+# Iniciar la aplicación con gunicorn: gunicorn.conf.py inicializa la base antes de crear
+# los workers y calienta cada uno antes de que reciba tráfico
 echo "▶️  Iniciando servidor..."
-exec gunicorn --bind 0.0.0.0:${PORT:-5000} --workers 1 --timeout 300 --keep-alive 2 --max-requests 1000 --preload app:app
+exec gunicorn -c gunicorn.conf.py wsgi:application
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py lee la configuración al importarse: base y directorios temporales antes de cargarla
+_tmp = tempfile.mkdtemp(prefix='test_byb_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ['NOTIFICACIONES_HILO'] = '0'
+os.environ['METRICAS_DIR'] = os.path.join(_tmp, 'metricas')
+os.environ['PERFILES_DIR'] = os.path.join(_tmp, 'perfiles')
+os.environ['SQL_LENTO_ARCHIVO'] = os.path.join(_tmp, 'sql_lento.log')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as aplicacion, db, init_db, cache_referencia  # noqa: E402
+
+@pytest.fixture
+def app():
+    """Aplicación con una base vacía (más los datos de ejemplo de init_db) en cada prueba"""
+    with aplicacion.app_context():
+        db.drop_all()
+        init_db()
+        cache_referencia.invalidar()
+        db.session.commit()
+        yield aplicacion
+        db.session.remove()
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
@@ -0,0 +1,55 @@
+import re
+
+import pytest
+
+VALIDO = {'cliente_nombre': 'Ana', 'cliente_direccion': 'Calle 1', 'fecha_entrega': '2030-01-01',
+          'items': [{'producto_id': 1, 'cantidad': 2}]}
+
+def test_alta_valida(cliente):
+    respuesta = cliente.post('/api/pedidos', json=VALIDO)
+    assert respuesta.status_code == 201
+    assert respuesta.get_json()['items'][0]['cantidad'] == 2
+
+@pytest.mark.parametrize('cuerpo, error', [
+    ([VALIDO], 'Se esperaba un objeto JSON'),
+    (dict(VALIDO, cliente_nombre=5), 'cliente_nombre debe ser texto'),
+    (dict(VALIDO, cliente_direccion={'calle': 1}), 'cliente_direccion debe ser texto'),
+    (dict(VALIDO, observaciones=[1]), 'observaciones debe ser texto'),
+    (dict(VALIDO, items='abc'), 'items debe ser una lista de objetos'),
+    (dict(VALIDO, items=[1, 2]), 'items debe ser una lista de objetos'),
+    (dict(VALIDO, items=[{'producto_id': [1]}]), 'producto_id inválido: [1]'),
+    (dict(VALIDO, items=[{'producto_id': 1, 'cantidad': 10 ** 30}]), 'cantidad inválida'),
+    (dict(VALIDO, items=[{'producto_id': 1, 'cantidad': 0}]), 'cantidad inválida: 0'),
+    (dict(VALIDO, items=[{'producto_id': 1, 'cantidad': 2.9}]), 'cantidad inválida: 2.9'),
+    (dict(VALIDO, items=[{'producto_id': 1, 'cantidad': True}]), 'cantidad inválida: True'),
+    (dict(VALIDO, items=[{'producto_id': 10 ** 27}]), 'producto_id inválido'),
+    (dict(VALIDO, items=[{'producto_id': 0}]), 'producto_id inválido: 0'),
+    (dict(VALIDO, items=[{'producto_id': 1.5}]), 'producto_id inválido: 1.5'),
+    (dict(VALIDO, mensajeria=99.5), 'mensajeria inválida: 99.5'),
+    (dict(VALIDO, mensajeria=True), 'mensajeria inválida: True'),
+    (dict(VALIDO, mensajeria='mucha'), 'mensajeria inválida: mucha'),
+    (dict(VALIDO, vendedor_id={'id': 1}), 'Vendedor desconocido'),
+])
+def test_cuerpos_mal_formados_dan_400(cliente, cuerpo, error):
+    respuesta = cliente.post('/api/pedidos', json=cuerpo)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'].startswith(error)
+
+@pytest.mark.parametrize('mensajeria, producto_id', [('Infinity', '1'), ('0', 'Infinity'), ('0', '-Infinity')])
+def test_infinito_en_json_da_400(cliente, mensajeria, producto_id):
+    respuesta = cliente.post('/api/pedidos', data='{"cliente_nombre": "Ana", "cliente_direccion": "C", '
+                             f'"fecha_entrega": "2030-01-01", "mensajeria": {mensajeria}, '
+                             f'"items": [{{"producto_id": {producto_id}}}]}}', content_type='application/json')
+    assert respuesta.status_code == 400
+
+def test_mensajeria_cero_explicita_y_cantidad_por_defecto(cliente):
+    respuesta = cliente.post('/api/pedidos', json=dict(VALIDO, mensajeria=0, items=[{'producto_id': 1}]))
+    assert respuesta.status_code == 201
+    assert respuesta.get_json()['items'][0]['cantidad'] == 1
+
+def test_pagina_siguiente_conserva_limite(cliente):
+    for _ in range(3):
+        assert cliente.post('/api/pedidos', json=VALIDO).status_code == 201
+    pagina = cliente.get('/pedidos?limite=2&estado=PENDIENTE').get_data(as_text=True)
+    enlace = re.search(r'href="(/pedidos\?antes=[^"]*)"', pagina).group(1).replace('&amp;', '&')
+    assert 'limite=2' in enlace and 'estado=PENDIENTE' in enlace
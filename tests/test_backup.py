@@ -0,0 +1,30 @@
+import json
+import os
+
+import pytest
+
+from backup import backup_streaming, cadena_de_backups, leer_manifest
+
+@pytest.fixture
+def carpeta(app, tmp_path, monkeypatch):
+    # Los backups se escriben en ./backup
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_incremental_en_el_mismo_segundo_no_pisa_su_base(carpeta):
+    completo = backup_streaming()
+    incremental = backup_streaming(incremental=True)
+    assert completo != incremental
+    assert leer_manifest(completo)['tipo'] == 'completo'
+    assert leer_manifest(incremental)['base'] == os.path.basename(completo)
+    assert [d for d, _ in cadena_de_backups(incremental)] == [completo, incremental]
+
+def test_cadena_con_ciclo_se_rechaza(carpeta):
+    backup_streaming()
+    incremental = backup_streaming(incremental=True)
+    manifest = leer_manifest(incremental)
+    manifest['base'] = os.path.basename(incremental)
+    with open(os.path.join(incremental, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError, match='ciclo'):
+        cadena_de_backups(incremental)
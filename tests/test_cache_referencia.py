@@ -0,0 +1,29 @@
+import threading
+
+from app import app as aplicacion, db, cache_referencia, Trabajador, trabajadores_activos
+
+def _en_otra_peticion(funcion):
+    """Ejecuta `funcion` en otro hilo con su propia sesión, como una petición concurrente"""
+    resultado = []
+
+    def ejecutar():
+        with aplicacion.app_context():
+            resultado.append(funcion())
+            db.session.remove()
+    hilo = threading.Thread(target=ejecutar)
+    hilo.start()
+    hilo.join()
+    return resultado[0]
+
+def test_invalidar_no_deja_recachear_datos_viejos_antes_del_commit(app):
+    nombres = lambda: [t.nombre for t in trabajadores_activos()]  # noqa: E731
+    antes = _en_otra_peticion(nombres)
+
+    db.session.add(Trabajador(nombre='Nueva', tipo='vendedor', activo=True))
+    cache_referencia.invalidar()
+    db.session.flush()
+    # Una petición concurrente relee la versión antes del commit: aún es la vieja
+    assert _en_otra_peticion(nombres) == antes
+    db.session.commit()
+
+    assert 'Nueva' in _en_otra_peticion(nombres)
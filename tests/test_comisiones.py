@@ -0,0 +1,39 @@
+from app import (db, crear_pedido_con_items, completar_pedidos, calcular_comisiones_pedido,
+                 reconciliar_ganancias, ComisionPedido, GananciaDiaria, Pedido)
+
+PEDIDOS = [
+    {'vendedor_id': 1, 'mensajero_id': 2, 'elaborador_id': 3, 'mensajeria': 100,
+     'items': [{'producto_id': 1, 'cantidad': 2}, {'producto_id': 2, 'cantidad': 1, 'incluye_bolsa_regalo': True}]},
+    {'vendedor_id': 1, 'mensajero_id': 2, 'mensajeria': 0, 'items': [{'producto_id': 2, 'cantidad': 3}]},
+    {'elaborador_id': 3, 'items': [{'producto_id': 1, 'cantidad': 1}]},
+    {'items': [{'producto_id': 1, 'cantidad': 5}, {'producto_id': 1, 'cantidad': 1}]},
+    {'vendedor_id': 1, 'mensajero_id': 2, 'elaborador_id': 3, 'mensajeria': 150,
+     'items': [{'producto_id': 2, 'cantidad': 4}]},
+]
+
+def _comisiones():
+    return [(c.pedido_id, c.trabajador_id, c.tipo_comision, c.monto)
+            for c in ComisionPedido.query.order_by(ComisionPedido.id)]
+
+def _libro():
+    return sorted((g.trabajador_id, g.fecha, g.monto, g.comisiones) for g in GananciaDiaria.query)
+
+def test_lote_y_pedido_a_pedido_dan_las_mismas_comisiones(app):
+    ids = []
+    for datos in PEDIDOS:
+        pedido, _ = crear_pedido_con_items(dict(datos, cliente_nombre='Ana', cliente_direccion='Calle 1',
+                                                fecha_entrega='2030-01-01'))
+        ids.append(pedido.id)
+    db.session.commit()
+
+    assert completar_pedidos(ids) == ids
+    por_lote, libro_por_lote = _comisiones(), _libro()
+    assert por_lote
+
+    for pedido_id in ids:
+        calcular_comisiones_pedido(db.session.get(Pedido, pedido_id))
+    uno_a_uno, libro_uno_a_uno = _comisiones(), _libro()
+
+    assert uno_a_uno == por_lote
+    assert libro_uno_a_uno == libro_por_lote
+    assert reconciliar_ganancias() == []
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from app import db, Contador, Pedido
+
+# Con la base SQLite de las pruebas sólo se ejerce su bloqueo de base entera;
+# el bloqueo de fila del contador en PostgreSQL no se prueba aquí
+ALTAS = 300
+HILOS = 16
+INICIO = 137
+
+def _alta(app, i):
+    app.test_client().post('/crear_pedido', data={
+        'fecha_entrega': date.today().isoformat(),
+        'cliente_nombre': f'Concurrente {i}',
+        'cliente_direccion': 'Calle 1',
+        'productos[]': ['1'],
+        'cantidades[]': ['1'],
+        'precios[]': ['1900'],
+    })
+
+def test_altas_simultaneas_numeran_sin_huecos(app):
+    # El contador no empieza en cero: los números siguen al último asignado
+    db.session.merge(Contador(nombre='numero_orden', valor=INICIO))
+    db.session.commit()
+
+    with ThreadPoolExecutor(max_workers=HILOS) as ejecutor:
+        list(ejecutor.map(lambda i: _alta(app, i), range(ALTAS)))
+
+    # crear_pedido redirige también si falla: se comprueban las filas, no las respuestas
+    db.session.expire_all()
+    numeros = db.session.execute(
+        db.select(Pedido.numero_orden).where(Pedido.cliente_nombre.like('Concurrente %'))
+        .order_by(Pedido.numero_orden)
+    ).scalars().all()
+    assert len(numeros) == ALTAS
+    assert numeros == list(range(INICIO + 1, INICIO + ALTAS + 1))
+    assert db.session.get(Contador, 'numero_orden').valor == INICIO + ALTAS
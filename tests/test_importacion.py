@@ -0,0 +1,66 @@
+import io
+import json
+
+from app import importar_pedidos, Pedido
+
+def _jsonl(*pedidos):
+    return io.StringIO('\n'.join(p if isinstance(p, str) else json.dumps(p) for p in pedidos) + '\n')
+
+VALIDO = {'cliente_nombre': 'Ana', 'cliente_direccion': 'Calle 1', 'fecha_entrega': '2030-01-01',
+          'items': [{'producto_id': 1, 'cantidad': 2}]}
+
+def test_lineas_con_tipos_incorrectos_se_informan_sin_detener_la_importacion(app):
+    resultados = importar_pedidos(_jsonl(
+        dict(VALIDO, items=[1, 2]),
+        dict(VALIDO, items='abc'),
+        dict(VALIDO, cliente_nombre=5),
+        dict(VALIDO, cliente_telefono=['555']),
+        '[1, 2]',
+        VALIDO,
+    ), 'jsonl')
+
+    errores = {r['linea']: r['error'] for r in resultados if not r['ok']}
+    assert errores == {
+        1: 'items debe ser una lista de objetos',
+        2: 'items debe ser una lista de objetos',
+        3: 'cliente_nombre debe ser texto',
+        4: 'cliente_telefono debe ser texto',
+        5: 'JSON inválido: cada línea debe ser un objeto JSON',
+    }
+    assert [r['linea'] for r in resultados if r['ok']] == [6]
+    assert Pedido.query.count() == 1
+
+def test_csv_valido(app):
+    csv = io.StringIO("cliente_nombre,cliente_direccion,fecha_entrega,producto,cantidad\n"
+                      "Ana,Calle 1,2030-01-01,1,2\n"
+                      "Luis,,2030-01-01,1,1\n")
+    resultados = importar_pedidos(csv, 'csv')
+    assert [r['ok'] for r in resultados] == [True, False]
+    assert resultados[1]['error'] == 'Falta cliente_direccion'
+
+def test_byte_invalido_tras_el_primer_lote_informa_lo_ya_importado(cliente):
+    lineas = [json.dumps(dict(VALIDO, cliente_nombre=f'Cliente {n}')) for n in range(1500)]
+    cuerpo = ('\n'.join(lineas) + '\n').encode() + b'{"cliente_nombre": "\xff"}\n' + lineas[0].encode() + b'\n'
+    respuesta = cliente.post('/importar_pedidos', data={'archivo': (io.BytesIO(cuerpo), 'pedidos.jsonl')},
+                             content_type='multipart/form-data')
+
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()
+    guardados = Pedido.query.count()
+    assert guardados >= 1000
+    assert datos['importados'] == guardados
+    ultimo = datos['resultados'][-1]
+    assert ultimo['interrumpido'] and not ultimo['ok']
+    assert ultimo['linea'] == guardados + 1
+    assert datos['error'].startswith(f"Lectura interrumpida en la línea {guardados + 1}")
+
+def test_csv_ilegible_no_importa_el_pedido_a_medias(app):
+    # El pedido B ocupa varios bloques de lectura y el byte inválido cae en su última fila
+    filas = ["referencia,cliente_nombre,cliente_direccion,fecha_entrega,producto,cantidad",
+             "A,Ana,Calle 1,2030-01-01,1,2"]
+    filas += ["B,Luis,Calle 2,2030-01-01,1,1"] * 1000
+    contenido = ("\n".join(filas) + "\n").encode() + b"B,Lu\xffis,Calle 2,2030-01-01,2,1\n"
+    resultados = importar_pedidos(io.TextIOWrapper(io.BytesIO(contenido), encoding='utf-8', newline=''), 'csv')
+    assert [(r['linea'], r['ok']) for r in resultados] == [(2, True), (3, False)]
+    assert resultados[-1]['interrumpido']
+    assert Pedido.query.count() == 1
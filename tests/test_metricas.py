@@ -0,0 +1,19 @@
+from app import db, registro_metricas, Trabajador
+
+def test_espera_del_pool_una_vez_por_transaccion(app, monkeypatch):
+    db.session.commit()
+    esperas = []
+    observar = registro_metricas.observar
+
+    def capturar(nombre, etiquetas, valor, *args):
+        if nombre == 'byb_db_pool_checkout_seconds':
+            esperas.append(valor)
+        return observar(nombre, etiquetas, valor, *args)
+    monkeypatch.setattr(registro_metricas, 'observar', capturar)
+
+    for _ in range(2):
+        Trabajador.query.all()
+        Trabajador.query.count()
+        db.session.commit()
+    assert len(esperas) == 2
+    assert all(0 <= espera < 5 for espera in esperas)
@@ -0,0 +1,16 @@
+import pytest
+
+from app import registro_sql_lento, token_perfil
+
+@pytest.fixture
+def consultas_lentas(app):
+    for n in range(5):
+        registro_sql_lento.registrar(f'SELECT {n}', {}, False, 1.0, 'prueba')
+
+@pytest.mark.parametrize('limite, esperadas', [('2', 2), ('abc', 50), ('0', 1), ('-3', 1)])
+def test_limite_de_consultas_lentas(app, cliente, consultas_lentas, limite, esperadas):
+    with app.test_request_context():
+        token = token_perfil()
+    respuesta = cliente.get(f'/perfiles?limite={limite}', headers={'X-Perfilar': token})
+    assert respuesta.status_code == 200
+    assert len(respuesta.get_json()['sql_lento']) == min(esperadas, len(registro_sql_lento.leer()))
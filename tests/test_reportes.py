@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import app as app_modulo
+from app import (db, crear_pedido_con_items, completar_pedidos, cache_reportes, Pedido,
+                 generar_reporte_diario, generar_reporte_periodo, generar_reporte_pedido)
+
+HOY = date.today()
+INICIO_MES = HOY.replace(day=1)
+FIN_MES = (INICIO_MES + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+REPORTES = {
+    'diario': lambda: generar_reporte_diario(HOY),
+    'semanal': lambda: generar_reporte_periodo(HOY - timedelta(days=6), HOY, 'REPORTE SEMANAL'),
+    'mensual': lambda: generar_reporte_periodo(INICIO_MES, FIN_MES, 'REPORTE MENSUAL'),
+}
+
+@contextmanager
+def contar_sentencias():
+    sentencias = []
+
+    def anotar(conn, cursor, sentencia, parametros, contexto, executemany):
+        sentencias.append(sentencia)
+
+    event.listen(db.engine, 'before_cursor_execute', anotar)
+    try:
+        yield sentencias
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', anotar)
+
+def _crear_completados(cantidad):
+    ids = []
+    for n in range(cantidad):
+        pedido, _ = crear_pedido_con_items({
+            'cliente_nombre': f'Cliente {n}', 'cliente_direccion': 'Calle 1',
+            'fecha_entrega': HOY.isoformat(), 'vendedor_id': 1, 'mensajero_id': 2,
+            'elaborador_id': 3, 'mensajeria': 100,
+            'items': [{'producto_id': 1 + n % 2, 'cantidad': 1 + n % 3}],
+        })
+        ids.append(pedido.id)
+    db.session.commit()
+    completar_pedidos(ids)
+    # Repartidos entre hoy y los días anteriores del mes y de la semana
+    for n, pedido_id in enumerate(ids):
+        dia = max(HOY - timedelta(days=n % 7), INICIO_MES) if n % 2 else HOY
+        db.session.execute(db.update(Pedido).where(Pedido.id == pedido_id).values(fecha_pedido=dia))
+    db.session.commit()
+
+def _sentencias_por_reporte(cantidad):
+    _crear_completados(cantidad)
+    cuentas = {}
+    for nombre, generar in REPORTES.items():
+        db.session.expire_all()
+        with contar_sentencias() as sentencias:
+            reporte = generar()
+        assert 'Pedidos completados' in reporte
+        cuentas[nombre] = len(sentencias)
+    return cuentas
+
+@pytest.fixture
+def sin_cache(monkeypatch):
+    monkeypatch.setattr(cache_reportes, 'almacen', None)
+
+def test_reportes_con_sentencias_constantes(app, sin_cache):
+    pocos = _sentencias_por_reporte(2)
+    muchos = _sentencias_por_reporte(40)
+    assert muchos == pocos
+    assert all(1 <= cuenta <= 2 for cuenta in pocos.values()), pocos
+
+def test_reporte_de_pedido_en_una_consulta(app, sin_cache):
+    _crear_completados(1)
+    db.session.expire_all()
+    pedido = Pedido.query.one()
+    with contar_sentencias() as sentencias:
+        reporte = generar_reporte_pedido(pedido)
+    assert 'VENDEDOR (' in reporte and 'ELABORADOR (' in reporte
+    assert len(sentencias) == 1
+
+def test_reporte_vacio_de_hoy_no_sobrevive_a_medianoche(app, monkeypatch):
+    ayer = HOY - timedelta(days=1)
+
+    class Ayer(date):
+        @classmethod
+        def today(cls):
+            return ayer
+    monkeypatch.setattr(app_modulo, 'date', Ayer)
+    assert generar_reporte_diario(ayer) == "📊 No hay pedidos completados hoy"
+    monkeypatch.undo()
+    assert generar_reporte_diario(ayer) == f"📊 No hay pedidos completados el {ayer.strftime('%d/%m/%Y')}"
@@ -0,0 +1,35 @@
+from datetime import date
+
+from app import db, GananciaDiaria, Trabajador, _reconstruir_ganancias
+
+def _etag(cliente, url='/api/ganancias'):
+    respuesta = cliente.get(url)
+    assert respuesta.status_code == 200
+    return respuesta.headers['ETag']
+
+def _revalidar(cliente, etag, url='/api/ganancias'):
+    return cliente.get(url, headers={'If-None-Match': etag}).status_code
+
+def test_escritura_por_la_sesion_cambia_el_etag(app, cliente):
+    etag = _etag(cliente)
+    assert _revalidar(cliente, etag) == 304
+    db.session.get(Trabajador, 1).telefono = '55555555'
+    db.session.commit()
+    assert _revalidar(cliente, etag) == 200
+
+def test_escritura_sql_directa_cambia_el_etag(app, cliente):
+    db.session.add(GananciaDiaria(trabajador_id=1, fecha=date.today(), monto=999, comisiones=1))
+    db.session.commit()
+    etag = _etag(cliente)
+    # Como `reconciliar-ganancias --corregir`: sentencias sobre la conexión, sin ORM
+    _reconstruir_ganancias(db.session.connection())
+    db.session.commit()
+    assert _revalidar(cliente, etag) == 200
+
+def test_escritura_deshecha_no_cambia_el_etag(app, cliente):
+    etag = _etag(cliente)
+    _reconstruir_ganancias(db.session.connection())
+    db.session.rollback()
+    db.session.execute(db.select(Trabajador.id).limit(1)).all()
+    db.session.commit()
+    assert _revalidar(cliente, etag) == 304